@@ -1,12 +1,32 @@
-from flask import Flask, request, jsonify, g, Response, stream_with_context
+from flask import Flask, request, jsonify, g, Response, stream_with_context, url_for, send_file
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.cloud.firestore import FieldFilter
-import google.generativeai as genai
-from utils import ConfigManager, CryptoManager
+from utils import ConfigManager, CryptoManager, TTLCache
+from uploads import UploadManager, UploadTooLarge, UploadOffsetMismatch, stream_to_tempfile
+from blob_cache import BlobCache
+from blob_store import FirebaseBlobStore, LocalBlobStore, BlobNotFound
+from model_files import ModelFileRegistry, GeminiFileProvider, LocalFileProvider
+from history import HistoryManager, GeminiSummarizer, to_model_turn
+from response_cache import ResponseCache
+from model_pool import ModelPool
+from memory_store import MemoryStore
+from metrics import Instrumentation, setup_logging, phase, timed_iter, instrument, dropped_log_records
+from lazy import Lazy, LazyProxy, Warmup
+from write_buffer import WriteBuffer
+from patient_context import CONTEXT_FIELDS, render_context
+from envelope import DataKeyStore
+from rekey import ReKeyWorker
+from search_index import BlindIndex, MemorySearchIndex, messages_text, file_text
 import os
 import json
+import base64
+import hashlib
+import datetime
+import logging
+import atexit
+import re
+import tempfile
+import time
+import uuid
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -14,6 +34,17 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 # Load Config
 config = ConfigManager()
 
+# Structured JSON logs through a buffered background handler, per-request
+# timings and /metrics. Request summaries are logged for a sample of requests;
+# errors and slow requests are always logged.
+setup_logging(config.get_setting('log_level') or 'INFO', queue_size=config.get_setting('log_queue_size') or 10000)
+log = logging.getLogger(__name__)
+instrumentation = Instrumentation(
+    sample_rate=config.get_setting('log_sample_rate') if config.get_setting('log_sample_rate') is not None else 0.1,
+    slow_seconds=(config.get_setting('slow_request_ms') or 1000) / 1000
+)
+instrumentation.init_app(app)
+
 @app.route('/')
 def health_check():
     return "CareCompass Backend is Running!", 200
@@ -21,82 +52,192 @@ def health_check():
 # Setup Crypto
 encryption_key = config.get_secret('encryption_key')
 if not encryption_key or encryption_key == "YOUR_ENCRYPTION_KEY_HERE":
-    print("WARNING: Using a dummy encryption key for this session.")
+    log.warning("Using a dummy encryption key for this session.")
     from cryptography.fernet import Fernet
     encryption_key = Fernet.generate_key()
     
-crypto = CryptoManager(encryption_key)
+crypto = CryptoManager(
+    encryption_key,
+    compress_min_bytes=config.get_setting('compress_min_bytes'),
+    compress_level=config.get_setting('compress_level') or 1
+)
+# Envelope encryption: per-patient AES-GCM data keys, wrapped by a key derived
+# from the master key and stored in Firestore (dataKeys/<patientId>). The store
+# is always there so sealed values can be read; envelope_encryption decides
+# whether new writes use it. Fernet values stay readable until the re-key worker
+# (set up below) has moved them over.
+crypto.data_keys = DataKeyStore(lambda: db, crypto.derive_key('data-key-wrap'))
+crypto.envelope = bool(config.get_setting('envelope_encryption'))
+# Every encrypt/decrypt made while serving a request is timed as the 'crypto' phase
+instrument(crypto, 'crypto', ['encrypt', 'decrypt', 'encrypt_dict', 'decrypt_dict', 'decrypt_field', 'encrypt_many', 'decrypt_many'])
 
-# Setup Firebase
-cred_json = config.get_secret('firebase_service_account_json')
-cred = None
+# Patient files uploaded to the model provider, reused across chat turns.
+# 'local' keeps everything in-process for offline testing.
+if config.get_setting('model_file_provider') == 'local':
+    model_files = ModelFileRegistry(LocalFileProvider())
+else:
+    model_files = ModelFileRegistry(GeminiFileProvider(client=lambda: gemini.get()), ttl=(config.get_setting('model_file_ttl_hours') or 46) * 3600)
 
-if cred_json:
-    try:
-        print("DEBUG: Loading Firebase creds from JSON environment variable")
-        # Try parsing as direct JSON first
-        try:
-            cred_dict = json.loads(cred_json)
-        except json.JSONDecodeError:
-            # If that fails, try decoding from Base64
-            import base64
-            print("DEBUG: JSON parse failed, attempting Base64 decode...")
-            decoded_json = base64.b64decode(cred_json).decode('utf-8')
-            cred_dict = json.loads(decoded_json)
-            
-        cred = credentials.Certificate(cred_dict)
-    except Exception as e:
-        print(f"Error parsing FIREBASE_SERVICE_ACCOUNT_JSON: {e}")
+# Local cache of storage blob bytes so follow-up chat turns about the same file
+# don't download it again
+blob_cache = BlobCache(
+    config.get_setting('blob_cache_dir') or os.path.join(tempfile.gettempdir(), 'carecompass-blob-cache'),
+    (config.get_setting('blob_cache_mb') or 256) * 1024 * 1024,
+    crypto.derive_key('blob-cache')
+)
+# Thread pool size for bulk encrypt/decrypt during import and export
+bulk_crypto_workers = config.get_setting('bulk_crypto_workers') or 1
 
-if not cred:
+# Setup Firebase. Reading the credentials, initialize_app() and creating the
+# Firestore and Storage clients are deferred (lazy.py): the first request that
+# needs them, or the warmup, pays for them instead of every cold start.
+def load_firebase_credentials():
+    cred_json = config.get_secret('firebase_service_account_json')
     cred_path = config.get_secret('firebase_service_account_path')
-    if cred_path:
+    if not cred_json and not cred_path:
+        return None
+    from firebase_admin import credentials
+    cred = None
+
+    if cred_json:
+        try:
+            log.info("Loading Firebase creds from JSON environment variable")
+            # Try parsing as direct JSON first
+            try:
+                cred_dict = json.loads(cred_json)
+            except json.JSONDecodeError:
+                # If that fails, try decoding from Base64
+                log.info("JSON parse failed, attempting Base64 decode")
+                decoded_json = base64.b64decode(cred_json).decode('utf-8')
+                cred_dict = json.loads(decoded_json)
+                
+            cred = credentials.Certificate(cred_dict)
+        except Exception as e:
+            log.error(f"Error parsing FIREBASE_SERVICE_ACCOUNT_JSON: {e}")
+
+    if not cred and cred_path:
         # Resolve relative path
         if not os.path.isabs(cred_path):
             base_dir = os.path.dirname(os.path.abspath(__file__))
             cred_path = os.path.join(base_dir, cred_path)
 
-        print(f"DEBUG: Attempting to load Firebase creds from: {cred_path}")
+        log.info(f"Attempting to load Firebase creds from: {cred_path}")
         if os.path.exists(cred_path):
             cred = credentials.Certificate(cred_path)
         else:
-            print(f"WARNING: Firebase credentials file not found at {cred_path}")
+            log.warning(f"Firebase credentials file not found at {cred_path}")
+    return cred
 
-db = None
-if cred:
-    try:
-        # Initialize with storage bucket
-        # Initialize with storage bucket
-        firebase_admin.initialize_app(cred, {
-            'storageBucket': 'carecompass-76a6a.firebasestorage.app'
-        })
-        db = firestore.client()
-        from firebase_admin import storage
-        bucket = storage.bucket()
-        print("Firebase initialized successfully with Storage.")
-    except Exception as e:
-        print(f"Error initializing Firebase: {e}")
-else:
-    print(f"WARNING: Firebase credentials not found at {cred_path}. Using in-memory store.")
-    in_memory_store = {}
+def init_firebase():
+    # -> (Firestore client, FirebaseBlobStore), or None without credentials
+    cred = load_firebase_credentials()
+    if not cred:
+        log.warning("Firebase credentials not found. Using in-memory store.")
+        return None
+    import firebase_admin
+    from firebase_admin import firestore, storage
+    # Initialize with storage bucket
+    firebase_admin.initialize_app(cred, {
+        'storageBucket': 'carecompass-76a6a.firebasestorage.app'
+    })
+    clients = firestore.client(), FirebaseBlobStore(storage.bucket())
+    log.info("Firebase initialized successfully with Storage.")
+    return clients
+
+firebase = Lazy('firebase', init_firebase)
 
-# ... (rest of file) ...
+# 'db' resolves to the Firestore client on first use. It is falsy without
+# Firebase (or if initialization failed), so the in-memory branches below are
+# taken as before.
+db = LazyProxy(lambda: (firebase.get() or (None, None))[0])
 
+def field_filter(field_path, op_string, value):
+    # google.cloud.firestore is only imported once Firebase is in use
+    from google.cloud.firestore import FieldFilter
+    return FieldFilter(field_path, op_string, value)
 
+# Without Firestore, data lives in an indexed in-process store. Set
+# memory_store_path to keep it across restarts (encrypted snapshot + append log).
+def init_memory_store():
+    if db:
+        return None
+    store = MemoryStore(
+        path=config.get_setting('memory_store_path'),
+        key=crypto.derive_key('memory-store'),
+        snapshot_interval=config.get_setting('memory_store_snapshot_seconds') or 60
+    )
+    atexit.register(store.close)
+    return store
 
-# Setup Gemini
+lazy_memory_store = Lazy('memory-store', init_memory_store)
+memory_store = LazyProxy(lazy_memory_store.get)
+
+# Patient file bytes. 'local' (the default without Firebase) keeps them on disk
+# and serves them through signed /api/blobs URLs, for offline runs and load tests.
+def init_blob_store():
+    clients = firebase.get()
+    if clients is None or config.get_setting('blob_store') == 'local':
+        return LocalBlobStore(
+            config.get_setting('local_blob_dir') or os.path.join(tempfile.gettempdir(), 'carecompass-blobs'),
+            crypto.derive_key('local-blob-url'),
+            url_for=lambda token: url_for('serve_local_blob', token=token, _external=True)
+        )
+    return clients[1]
+
+lazy_blob_store = Lazy('blob-store', init_blob_store)
+blob_store = LazyProxy(lazy_blob_store.get)
+
+# Setup Gemini. google.generativeai takes a few hundred ms to import, so it is
+# imported and configured when the first model is created.
 api_key = config.get_secret('gemini_api_key')
-if api_key and api_key != "YOUR_GEMINI_API_KEY_HERE":
-    genai.configure(api_key=api_key)
-else:
-    print("WARNING: Gemini API Key not set.")
+if not api_key or api_key == "YOUR_GEMINI_API_KEY_HERE":
+    log.warning("Gemini API Key not set.")
+    api_key = None
+
+def init_gemini():
+    import google.generativeai as genai
+    if api_key:
+        genai.configure(api_key=api_key)
+    return genai
+
+gemini = Lazy('gemini', init_gemini)
+
+# Warm, reused model instances keyed by system instruction
+model_pool = ModelPool(
+    lambda **kwargs: gemini.get().GenerativeModel(**kwargs),
+    max_size=config.get_setting('model_pool_size') or 32
+)
+
+def warm_model():
+    # Opens the model connection and keeps it from going idle
+    if api_key and config.get_setting('model_warmup'):
+        model_pool.warmup(config.get_setting('gemini_model'))
+        model_pool.start_keepalive(config.get_setting('gemini_model'), config.get_setting('model_keepalive_seconds') or 0)
+
+# Builds everything ahead of the first request. Started at the end of this module
+# when warm_on_start is set, or by the first GET /ready (e.g. a startup probe).
+warmup = Warmup([firebase.get, lazy_memory_store.get, lazy_blob_store.get, gemini.get, warm_model])
 
 from functools import wraps
-from firebase_admin import auth
+
+# Verified token claims are cached so the several API calls made per chat turn
+# don't each pay for signature verification. Entries are keyed by a hash of the
+# token and expire with its 'exp' claim, or after token_cache_ttl seconds if that
+# comes first: a revoked token (checked with token_check_revoked) is accepted
+# from the cache for at most that long.
+token_cache = TTLCache(
+    max_size=config.get_setting('token_cache_size') or 1024,
+    ttl=config.get_setting('token_cache_ttl') or 300,
+    clock=time.time
+)
+check_revoked = bool(config.get_setting('token_check_revoked'))
+
+def token_cache_key(id_token):
+    return hashlib.sha256(id_token.encode()).hexdigest()
 
 def verify_token(id_token):
-    # Check if Firebase is initialized
-    if not firebase_admin._apps:
+    # Check if Firebase is initialized (this is what first initializes it)
+    if firebase.get() is None:
         # Fallback for dev without service account: Decode without verification
         # WARNING: This is insecure and should only be used for local dev/testing
         try:
@@ -109,17 +250,27 @@ def verify_token(id_token):
                 padded = payload + '=' * (4 - len(payload) % 4)
                 decoded = base64.urlsafe_b64decode(padded)
                 data = json.loads(decoded)
-                print(f"WARNING: Using unverified token for user {data.get('sub')}")
+                log.debug(f"Using unverified token for user {data.get('sub')}")
                 return {'uid': data['sub'], 'email': data.get('email', 'unknown')}
         except Exception as e:
-            print(f"Manual token decode failed: {e}")
+            log.warning(f"Manual token decode failed: {e}")
         return None
 
+    key = token_cache_key(id_token)
+    cached = token_cache.get(key)
+    if cached:
+        return cached
+
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        from firebase_admin import auth
+        decoded_token = auth.verify_id_token(id_token, check_revoked=check_revoked)
+        # Never cache tokens without a usable expiry
+        expires_at = decoded_token.get('exp')
+        if expires_at and expires_at > time.time():
+            token_cache.put(key, decoded_token, expires_at=expires_at)
         return decoded_token
     except Exception as e:
-        print(f"Token verification failed: {e}")
+        log.warning(f"Token verification failed: {e}")
         return None
 
 def login_required(f):
@@ -135,16 +286,316 @@ def login_required(f):
             return jsonify({'error': 'Invalid token'}), 401
             
         g.user = user
-        print(f"Request by User: {g.user.get('uid')} ({g.user.get('email')})")
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/api/chat', methods=['POST'])
+# patient_id -> owning userId. Saves the extra patient document read that every
+# sub-resource endpoint would otherwise do before its real work.
+patient_owner_cache = TTLCache(
+    max_size=config.get_setting('ownership_cache_size') or 4096,
+    ttl=config.get_setting('ownership_cache_ttl') or 300
+)
+
+def get_patient_owner(patient_id):
+    if not db:
+        return memory_store.owner(patient_id)
+    owner = patient_owner_cache.get(patient_id)
+    if owner is None:
+        with phase('firestore'):
+            p_doc = db.collection('patients').document(patient_id).get()
+        if not p_doc.exists:
+            return None
+        owner = p_doc.to_dict().get('userId')
+        patient_owner_cache.put(patient_id, owner)
+    return owner
+
+def check_patient_owner(patient_id):
+    # Returns an error response if the current user can't access this patient
+    owner = get_patient_owner(patient_id)
+    if owner is None:
+        return jsonify({"error": "Patient not found"}), 404
+    if owner != g.user['uid']:
+        return jsonify({"error": "Unauthorized"}), 403
+    return None
+
+def invalidate_patient_owner(patient_id):
+    # Call whenever a patient is written with a (possibly new) owner or deleted
+    patient_owner_cache.invalidate(patient_id)
+
+# PATCH /api/patients/<id> in Firestore mode goes through a write-behind buffer,
+# so a burst of profile edits becomes a single update(). Anything that reads or
+# overwrites a patient document flushes that patient's pending fields first.
+# patient_write_delay_ms: 0 writes every PATCH straight through.
+def write_patient_fields(patient_id, fields):
+    with phase('firestore'):
+        db.collection('patients').document(patient_id).update(fields)
+
+patient_writes = WriteBuffer(
+    write_patient_fields,
+    delay=(config.get_setting('patient_write_delay_ms') or 0) / 1000,
+    max_delay=(config.get_setting('patient_write_max_delay_ms') or 2000) / 1000
+)
+atexit.register(patient_writes.close)
+
+# patient_id -> {'version', 'text'}: the rendered chat context. Writes through
+# this server invalidate it; the TTL bounds how long another instance's write can
+# go unseen. In memory mode the stored version is also compared on every read.
+patient_context_cache = TTLCache(
+    max_size=config.get_setting('context_cache_size') or 1024,
+    ttl=config.get_setting('context_cache_ttl') or 300
+)
+
+def get_patient_context(patient_id):
+    # Chat context for a patient the caller owns, or None if there is no record
+    cached = patient_context_cache.get(patient_id)
+    if db:
+        if cached is not None:
+            return cached['text']
+        patient_writes.flush(patient_id)
+        with phase('firestore'):
+            doc = db.collection('patients').document(patient_id).get()
+        if not doc.exists:
+            return None
+        patient = crypto.decrypt_dict(doc.to_dict(), fields=CONTEXT_FIELDS, patient_id=patient_id)
+    else:
+        patient = memory_store.get_patient(patient_id)
+        if patient is None:
+            return None
+        if cached is not None and cached['version'] == patient.get('updatedAt'):
+            return cached['text']
+    text = render_context(patient)
+    patient_context_cache.put(patient_id, {'version': patient.get('updatedAt'), 'text': text})
+    return text
+
+def read_blob_bytes(path, generation=None):
+    if not blob_store.remote:
+        # Already on local disk; nothing to cache
+        with phase('storage'):
+            try:
+                return blob_store.read(path, generation)
+            except BlobNotFound:
+                raise FileNotFoundError(path)
+    if generation is None:
+        with phase('storage'):
+            generation = blob_store.generation(path)
+        if generation is None:
+            raise FileNotFoundError(path)
+    content = blob_cache.get(path, generation)
+    if content is None:
+        with phase('storage'):
+            content = blob_store.read(path, generation)
+        blob_cache.put(path, generation, content)
+    return content
+
+# File metadata lives in Firestore (encrypted, contentKey in clear) or in the
+# memory store. These helpers return decrypted dicts either way, without the
+# contentKey: it is only used to find duplicate uploads and never leaves the server.
+def files_collection(patient_id):
+    return db.collection('patients').document(patient_id).collection('files')
+
+def file_meta(file_data, fields=None):
+    return {k: v for k, v in file_data.items() if k != 'contentKey' and (fields is None or k in fields)}
+
+# Search index (see search_index.py). In Firestore each chat and file has a
+# sibling patients/<id>/search/<kind>-<id> document holding its blind index
+# tokens, written in the same batch or transaction as the chat or file itself.
+blind_index = BlindIndex(crypto)
+
+def search_collection(patient_id):
+    return db.collection('patients').document(patient_id).collection('search')
+
+def search_entry(patient_id, kind, ref_id, text, existing=()):
+    return {
+        'kind': kind,
+        'refId': ref_id,
+        'tokens': blind_index.tokens(patient_id, text, existing),
+        'updatedAt': now_stamp()
+    }
+
+def memory_search_documents(patient_id):
+    for chat in memory_store.chats_for_patient(patient_id):
+        yield 'chat', chat['id'], messages_text(chat.get('messages')), chat.get('updatedAt') or chat.get('createdAt')
+    for file_data in memory_store.list_files(patient_id):
+        yield 'file', file_data['id'], file_text(file_data), None
+
+memory_search = MemorySearchIndex(blind_index, memory_search_documents)
+
+def get_file_meta(patient_id, file_id, fields=None):
+    if not db:
+        file_data = memory_store.get_file(patient_id, file_id)
+        if file_data is None:
+            return None
+        return file_meta(file_data, fields)
+    with phase('firestore'):
+        f_doc = files_collection(patient_id).document(file_id).get()
+    if not f_doc.exists:
+        return None
+    return file_meta(crypto.decrypt_dict(f_doc.to_dict(), fields=fields, patient_id=patient_id))
+
+def find_file_by_content(patient_id, content_key):
+    if not db:
+        existing = memory_store.find_file(patient_id, content_key)
+        return file_meta(existing) if existing is not None else None
+    existing_docs = files_collection(patient_id).where(filter=field_filter('contentKey', '==', content_key)).limit(1).stream()
+    for existing in timed_iter('firestore', existing_docs):
+        return file_meta(crypto.decrypt_dict(existing.to_dict(), patient_id=patient_id))
+    return None
+
+def save_file_meta(patient_id, file_data, content_key):
+    if not db:
+        memory_store.save_file(patient_id, dict(file_data, contentKey=content_key))
+        memory_search.add(patient_id, 'file', file_data['id'], file_text(file_data), now_stamp())
+        return
+    # Encrypt metadata; contentKey stays clear so duplicates can be queried
+    encrypted_file = crypto.encrypt_dict(file_data, patient_id)
+    encrypted_file['contentKey'] = content_key
+    batch = db.batch()
+    batch.set(files_collection(patient_id).document(file_data['id']), encrypted_file)
+    batch.set(search_collection(patient_id).document(f"file-{file_data['id']}"), search_entry(patient_id, 'file', file_data['id'], file_text(file_data)))
+    with phase('firestore'):
+        batch.commit()
+
+def delete_file_meta(patient_id, file_id):
+    if not db:
+        memory_store.delete_file(patient_id, file_id)
+        memory_search.remove(patient_id, 'file', file_id)
+        return
+    batch = db.batch()
+    batch.delete(files_collection(patient_id).document(file_id))
+    batch.delete(search_collection(patient_id).document(f"file-{file_id}"))
+    with phase('firestore'):
+        batch.commit()
+
+history_manager = HistoryManager(
+    GeminiSummarizer(config.get_setting('history_summary_model') or config.get_setting('gemini_model'), client=gemini.get),
+    token_budget=config.get_setting('history_token_budget') or 6000
+)
+
+def load_chat_history(patient_id, chat_id, prompt):
+    # Loads only the messages not yet folded into the chat's digest. If they are
+    # over the token budget the digest is moved forward in the background.
+    if db:
+        chat_ref = db.collection('patients').document(patient_id).collection('chats').document(chat_id)
+        digest_ref = chat_ref.collection('digest').document('rolling')
+        with phase('firestore'):
+            c_doc = chat_ref.get()
+            if not c_doc.exists:
+                return []
+            d_doc = digest_ref.get()
+        digest = crypto.decrypt_dict(d_doc.to_dict(), patient_id=patient_id) if d_doc.exists else None
+        covered = digest.get('covered', 0) if digest else 0
+
+        c_raw = c_doc.to_dict()
+        count = c_raw.get('messageCount')
+        if count is None:
+            messages = (crypto.decrypt_dict(c_raw, fields=['messages'], patient_id=patient_id).get('messages') or [])[covered:]
+        elif count > covered:
+            docs = chat_ref.collection('messages').where(filter=field_filter('seq', '>=', covered)).order_by('seq').limit(count - covered).stream()
+            messages = [m.get('message') for m in crypto.decrypt_many([m_doc.to_dict() for m_doc in timed_iter('firestore', docs)], patient_id=patient_id)]
+        else:
+            messages = []
+    else:
+        chat = memory_store.get_chat(patient_id, chat_id)
+        if not chat:
+            return []
+        digest = memory_store.get_digest(patient_id, chat_id)
+        messages = chat.get('messages', [])[digest.get('covered', 0) if digest else 0:]
+
+    # The client saves the user's message before calling /api/chat; don't send it twice
+    if messages and messages[-1].get('sender') == 'user' and messages[-1].get('text') == prompt:
+        messages = messages[:-1]
+
+    # Called from the history manager's worker thread once the oldest turns are
+    # folded. With request-based CPU allocation (Cloud Run's default) that thread
+    # may run slowly between requests; the digest simply lands a little later.
+    def save_digest(new_digest):
+        if db:
+            digest_ref.set(crypto.encrypt_dict(new_digest, patient_id))
+        else:
+            memory_store.set_digest(patient_id, chat_id, new_digest)
+
+    return history_manager.build(messages, digest, key=(patient_id, chat_id), save=save_digest)
+
+response_cache = ResponseCache(
+    crypto,
+    max_size=config.get_setting('response_cache_size') or 512,
+    ttl=config.get_setting('response_cache_ttl') or 3600
+)
+
+def replay_text(text, chunk_size=256):
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i + chunk_size]
+
+@app.route('/api/stats', methods=['GET'])
 @login_required
-def chat():
-    data = request.json
+def get_stats():
+    return jsonify({
+        "tokenCache": token_cache.stats(),
+        "ownershipCache": patient_owner_cache.stats(),
+        "contextCache": patient_context_cache.stats(),
+        "blobCache": blob_cache.stats(),
+        "modelFiles": model_files.stats(),
+        "responseCache": response_cache.stats(),
+        "modelPool": model_pool.stats(),
+        "patientWrites": patient_writes.stats(),
+        "dataKeys": crypto.data_keys.stats(),
+        "rekey": rekey_worker.stats(),
+        "search": memory_search.stats(),
+        "memoryStore": memory_store.stats() if memory_store else None
+    })
+
+metrics_token = config.get_secret('metrics_token')
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text format: request/phase latency histograms, request counters
+    # and cache gauges. Open unless the metrics_token secret is set, in which case
+    # the scraper must send it as a Bearer token.
+    if metrics_token and request.headers.get('Authorization') != f"Bearer {metrics_token}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    gauges = [('carecompass_log_records_dropped', None, dropped_log_records())]
+    caches = {
+        "token": token_cache.stats(),
+        "ownership": patient_owner_cache.stats(),
+        "context": patient_context_cache.stats(),
+        "blob": blob_cache.stats(),
+        "model_files": model_files.stats(),
+        "response": response_cache.stats(),
+        "model_pool": model_pool.stats()
+    }
+    for cache, stats in caches.items():
+        for key in ('size', 'hits', 'misses', 'evictions'):
+            if key in stats:
+                gauges.append((f'carecompass_cache_{key}', {'cache': cache}, stats[key]))
+    body = instrumentation.registry.render(gauges)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # 200 once Firebase, the stores and Gemini have been initialized, else 503.
+    # The first call starts initializing them in the background (once), so a
+    # plain readiness probe warms an idle instance and passes once that's done.
+    # Open like '/'.
+    warmup.start()
+    services = {lazy.name: lazy.status() for lazy in (firebase, lazy_memory_store, lazy_blob_store, gemini)}
+    is_ready = all(status['ready'] for status in services.values())
+    return jsonify({
+        "ready": is_ready,
+        "warming": warmup.started and warmup.seconds is None,
+        "services": services
+    }), (200 if is_ready else 503)
+
+def create_model(model_name, system_instruction):
+    return model_pool.get(model_name, system_instruction)
+
+def prepare_chat(data):
+    # Everything /api/chat does before calling the model: file lookup, history,
+    # prompt assembly and response cache lookup. Shared by the threaded Flask
+    # route below and the asyncio streaming route in asgi.py (which runs this in
+    # a worker thread with g.user set). Returns (plan, None) or (None, error response).
     prompt = data.get('prompt')
     history = data.get('history', [])
+    chat_id = data.get('chatId')
     context = data.get('context', '')
     image_base64 = data.get('image') # Optional
     mime_type = data.get('mimeType', 'image/jpeg')
@@ -152,25 +603,44 @@ def chat():
     # Handle fileId reference (avoids frontend CORS issues)
     file_id = data.get('fileId')
     patient_id = data.get('patientId')
+    model_name = config.get_setting('gemini_model')
+    file_part = None
+
+    if patient_id:
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return None, ownership_error
+        # Built from the stored record; a client-sent context is only used
+        # without a patientId, or if the record can't be read
+        try:
+            context = get_patient_context(patient_id) or context
+        except Exception as e:
+            log.warning(f"Building patient context failed, using the client's: {e}")
     
-    if file_id and patient_id and db:
+    if file_id and patient_id:
         try:
-            print(f"Fetching file {file_id} for patient {patient_id} from storage...")
-            # Fetch file metadata to get path
-            # Note: We need to decrypt metadata if it was encrypted
-            f_doc = db.collection('patients').document(patient_id).collection('files').document(file_id).get()
-            if f_doc.exists:
-                f_data = crypto.decrypt_dict(f_doc.to_dict())
-                blob = bucket.blob(f_data['path'])
-                content = blob.download_as_bytes()
+            def load_file():
+                # Fetch file metadata to get path
+                f_data = get_file_meta(patient_id, file_id, fields=['path', 'type', 'generation'])
+                if f_data is None:
+                    raise FileNotFoundError(f"File document {file_id} not found.")
+                content = read_blob_bytes(f_data['path'], f_data.get('generation'))
+                log.debug(f"Loaded file {file_id} from storage. Type: {f_data.get('type')}, Size: {len(content)}")
+                return content, f_data.get('type') or 'image/jpeg'
+
+            try:
+                # Uploaded to the model provider once, then referenced by URI
+                with phase('llm'):
+                    file_part = model_files.get_part(patient_id, file_id, model_name, load_file)
+            except FileNotFoundError as e:
+                log.warning(str(e))
+            except Exception as e:
+                log.warning(f"Model file upload failed, sending inline: {e}")
                 import base64
+                content, mime_type = load_file()
                 image_base64 = base64.b64encode(content).decode('utf-8')
-                mime_type = f_data.get('type', 'image/jpeg')
-                print(f"Successfully loaded file from storage. Type: {mime_type}, Size: {len(content)}")
-            else:
-                print(f"File document {file_id} not found.")
         except Exception as e:
-            print(f"Error fetching file from storage: {e}")
+            log.error(f"Error fetching file from storage: {e}")
             # Fallback or error? We'll continue and let Gemini fail if image is missing but expected
 
 
@@ -180,98 +650,287 @@ def chat():
         context=context if context else "No specific patient details provided yet."
     )
 
-    print("\n--- LLM REQUEST START ---")
-    print(f"System Instruction:\n{system_instruction}")
-    print(f"User Prompt: {prompt}")
-    print(f"Context Provided: {context}")
-    print(f"History Length: {len(history)} messages")
-    print("--- LLM REQUEST END ---\n")
+    # Sizes only: prompts and context carry patient data
+    log.debug("LLM request", extra={'fields': {
+        'systemInstructionChars': len(system_instruction),
+        'promptChars': len(prompt or ''),
+        'clientHistory': len(history),
+        'chatId': chat_id
+    }})
 
-    model_name = config.get_setting('gemini_model')
-    model = genai.GenerativeModel(
-        model_name=model_name,
-        system_instruction=system_instruction
-    )
-
-    chat_history = []
-    # Convert history format
-    for msg in history:
-        role = "user" if msg.get('sender') == 'user' else "model"
-        chat_history.append({
-            "role": role,
-            "parts": [{"text": msg.get('text', '')}]
-        })
+    if chat_id and patient_id:
+        # History is kept on the server: budgeted window plus rolling digest
+        chat_history = load_chat_history(patient_id, chat_id, prompt)
+    else:
+        # Older clients send the whole history with every request
+        chat_history = [to_model_turn(msg) for msg in history]
 
     # Add the new message
     parts = [{"text": prompt}]
-    if image_base64:
-        mime_type = data.get('mimeType', 'image/jpeg')
+    if file_part:
+        parts.append(file_part)
+    elif image_base64:
         parts.append({
             "mime_type": mime_type,
             "data": image_base64
         })
     
+    # Identical question with identical context/history/attachment: replay the
+    # cached answer through the same streaming response
+    if file_part:
+        attachment = f"file:{patient_id}/{file_id}"
+    elif image_base64:
+        attachment = "inline:" + hashlib.sha256(image_base64.encode()).hexdigest()
+    else:
+        attachment = None
+    cache_key = response_cache.make_key(model_name, system_instruction, chat_history, prompt, attachment, scope=g.user['uid'])
+
+    return {
+        "model_name": model_name,
+        "system_instruction": system_instruction,
+        "history": chat_history,
+        "parts": parts,
+        "cache_key": cache_key,
+        "cached_text": response_cache.get(cache_key)
+    }, None
+
+CHAT_ERROR_TEXT = "I'm having trouble connecting to the service right now. Please check your API key and connection."
+
+@app.route('/api/chat', methods=['POST'])
+@login_required
+def chat():
+    plan, error = prepare_chat(request.json)
+    if error:
+        return error
+
+    if plan['cached_text'] is not None:
+        log.debug("Serving answer from response cache")
+        return Response(stream_with_context(replay_text(plan['cached_text'])), mimetype='text/plain')
+
     try:
         # We use start_chat for history context, but if there's an image we might need generate_content
         # with the history manually appended or just use generate_content for single turn with context if the lib is tricky.
         # The python lib's ChatSession doesn't easily support images in the middle of history in all versions, 
         # but let's try the standard chat.send_message.
-        
-        chat = model.start_chat(history=chat_history)
-        response = chat.send_message(parts, stream=True)
+        with phase('llm'):
+            model = create_model(plan['model_name'], plan['system_instruction'])
+            chat = model.start_chat(history=plan['history'])
+            response = chat.send_message(plan['parts'], stream=True)
 
         def generate():
-            for chunk in response:
+            pieces = []
+            for chunk in timed_iter('llm', response):
                 if chunk.text:
+                    pieces.append(chunk.text)
                     yield chunk.text
+            # Only complete answers are cached; a dropped stream never gets here
+            response_cache.put(plan['cache_key'], ''.join(pieces))
 
         return Response(stream_with_context(generate()), mimetype='text/plain')
     except Exception as e:
-        print(f"Gemini Error: {e}")
-        return jsonify({"text": "I'm having trouble connecting to the service right now. Please check your API key and connection."}), 500
+        log.error(f"Gemini Error: {e}")
+        return jsonify({"text": CHAT_ERROR_TEXT}), 500
+
+# Cursor pagination for the list endpoints. Without ?limit or ?cursor they
+# return the whole list as a JSON array, as before. With either one the response is
+#   {"items": [...], "nextCursor": <token, or null on the last page>}
+# and the client sends nextCursor back as ?cursor= for the next page. The token
+# is the sort key of the last item (base64 JSON). It only positions the query,
+# which is still restricted to the caller's own data. ?view=summary returns
+# lightweight items for list screens.
+MAX_PAGE_SIZE = config.get_setting('max_page_size') or 100
+DOCUMENT_ID = '__name__'  # FieldPath.document_id()
+DESCENDING = 'DESCENDING'  # firestore.Query.DESCENDING
+PATIENT_SUMMARY_FIELDS = ['id', 'name', 'dob', 'age', 'lastUpdate']
+FILE_SUMMARY_FIELDS = ['id', 'name', 'type', 'size', 'uploadedAt']
+CHAT_TITLE_CHARS = 120
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(token, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+def read_page_args(cursor_length=1):
+    # -> (limit, cursor values); limit is None when the request isn't paginated.
+    # Raises ValueError for a bad limit or cursor.
+    limit, cursor = request.args.get('limit'), request.args.get('cursor')
+    if limit is None and cursor is None:
+        return None, None
+    limit = min(max(int(limit), 1), MAX_PAGE_SIZE) if limit else MAX_PAGE_SIZE
+    return limit, (decode_cursor(cursor, cursor_length) if cursor else None)
+
+def take_page(rows, limit):
+    # Rows are fetched with limit + 1, so a full last page isn't followed by an
+    # empty one. -> (page rows, whether there are more)
+    if limit is None or len(rows) <= limit:
+        return rows, False
+    return rows[:limit], True
+
+def page_response(items, limit, next_values):
+    if limit is None:
+        return jsonify(items)
+    return jsonify({"items": items, "nextCursor": encode_cursor(next_values) if next_values else None})
+
+# Conditional GET and delta sync for the patient and chat lists. Every write
+# stamps a plain 'updatedAt' (server time, fixed-width ISO, so strings sort in
+# time order). List responses carry a weak ETag built from each document's ID
+# and version: Firestore's update_time, or updatedAt in the memory store. It is
+# computed from the raw documents, so an unchanged list is answered with 304
+# before anything is decrypted. Browsers revalidate cached responses with
+# If-None-Match on their own.
+#
+# ?since=<updatedAt> returns only documents written after that time, as
+#   {"items": [...], "since": <value to pass next time>}
+# Documents written before updatedAt existed never match; clients get them from
+# a full load.
+def now_stamp():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def doc_version(doc):
+    # Firestore snapshot or memory store dict
+    update_time = getattr(doc, 'update_time', None)
+    if update_time is not None:
+        return str(update_time)
+    return doc.get('updatedAt') if isinstance(doc, dict) else None
+
+def list_etag(versions):
+    # versions: iterable of (document ID, version). The user and query string are
+    # part of the tag, since they change the representation.
+    hasher = hashlib.sha256(f"{g.user['uid']}\0{request.query_string.decode()}".encode())
+    for doc_id, version in versions:
+        hasher.update(f"\0{doc_id}\0{version}".encode())
+    return hasher.hexdigest()[:32]
+
+def not_modified(etag):
+    # A 304 for a client that already holds this version of the list, else None
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+def with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    # Cache privately, but always revalidate
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def read_since():
+    # -> the ?since value or None. Raises ValueError if combined with pagination.
+    since = request.args.get('since')
+    if since and ('limit' in request.args or 'cursor' in request.args):
+        raise ValueError("since can't be combined with limit or cursor")
+    return since or None
+
+def changed_since(since, docs):
+    # Memory store dicts written after 'since'
+    return [d for d in docs if (d.get('updatedAt') or '') > since]
+
+def delta_response(items, since):
+    latest = max((item.get('updatedAt') or '' for item in items), default='')
+    return jsonify({"items": items, "since": max(latest, since)})
+
+def chat_title(messages):
+    first = next((m for m in messages or [] if isinstance(m, dict) and m.get('sender') == 'user'), None)
+    return str(first.get('text') or '')[:CHAT_TITLE_CHARS] if first else None
+
+def summarize_chat(patient_id, chat_ref, c_raw):
+    # List views show the first user message and a date. Only that message is
+    # read for chats stored in the messages subcollection; older chats embed the
+    # list, which has to be decrypted to find it.
+    summary = crypto.decrypt_dict(c_raw, fields=[k for k in c_raw if k not in ('messages', 'digest')], patient_id=patient_id)
+    count = c_raw.get('messageCount')
+    if count is None:
+        messages = crypto.decrypt_field('messages', c_raw.get('messages'), patient_id) or []
+        count = len(messages)
+    else:
+        docs = chat_ref.collection('messages').order_by('seq').limit(2).stream() if count else []
+        messages = [m.get('message') for m in crypto.decrypt_many([m_doc.to_dict() for m_doc in timed_iter('firestore', docs)], patient_id=patient_id)]
+    summary.update(title=chat_title(messages), messageCount=count)
+    return summary
+
+def summarize_memory_chat(chat):
+    summary = {k: v for k, v in chat.items() if k != 'messages'}
+    summary.update(title=chat_title(chat.get('messages')), messageCount=len(chat.get('messages') or []))
+    return summary
 
 @app.route('/api/patients', methods=['GET'])
 @login_required
 def get_patients():
-    import time
-    start_time = time.time()
-    print(f"DEBUG: get_patients called for User ID: {g.user['uid']}")
+    # Optional projection, e.g. ?fields=id,name,lastUpdate for list views.
+    # Only the requested fields are decrypted.
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    if fields is None and request.args.get('view') == 'summary':
+        fields = PATIENT_SUMMARY_FIELDS
+    try:
+        limit, cursor = read_page_args()
+        since = read_since()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if since and fields is not None:
+        # Delta items always carry the stamp the next 'since' is taken from
+        fields = fields + ['updatedAt']
     if db:
         try:
-            print("DEBUG: Querying Firestore for patients...")
-            query_start = time.time()
+            patient_writes.flush_group(g.user['uid'])
+            query = db.collection('patients').where(filter=field_filter('userId', '==', g.user['uid']))
+            if limit is not None:
+                query = query.order_by(DOCUMENT_ID)
+                if cursor:
+                    query = query.start_after({DOCUMENT_ID: cursor[0]})
+                query = query.limit(limit + 1)
             # Add a timeout to the stream to prevent hanging indefinitely
-            docs = db.collection('patients').where(filter=FieldFilter('userId', '==', g.user['uid'])).stream(timeout=5)
+            docs, more = take_page(list(timed_iter('firestore', query.stream(timeout=5))), limit)
+            if since:
+                # A user has few patients; filtering here avoids a composite index
+                docs = [doc for doc in docs if (doc.to_dict().get('updatedAt') or '') > since]
+            etag = list_etag((doc.id, doc_version(doc)) for doc in docs)
+            cached = not_modified(etag)
+            if cached:
+                return cached
             
             patients = []
-            print("DEBUG: Starting iteration over stream...")
             for doc in docs:
                 p_data = doc.to_dict()
-                print(f"DEBUG: Found patient doc {doc.id}")
                 try:
-                    decrypted = crypto.decrypt_dict(p_data)
+                    decrypted = crypto.decrypt_dict(p_data, fields=fields, patient_id=doc.id)
                     patients.append(decrypted)
                 except Exception as e:
-                    print(f"Error decrypting patient {doc.id}: {e}")
-            
-            query_end = time.time()
-            duration = query_end - query_start
-            print(f"DEBUG: Firestore query and iteration took {duration:.4f} seconds.")
-            print(f"DEBUG: Found {len(patients)} patients in Firestore for this user.")
-            
-            # Log response summary
-            print(f"DEBUG: Returning {len(patients)} patients. IDs: {[p.get('id') for p in patients]}")
+                    log.error(f"Error decrypting patient {doc.id}: {e}")
             
-            return jsonify(patients)
+            log.debug(f"Returning {len(patients)} patients")
+            if since:
+                return with_etag(delta_response(patients, since), etag)
+            # Pages are ordered by patient ID
+            return with_etag(page_response(patients, limit, [docs[-1].id] if more else None), etag)
         except Exception as e:
-            print(f"ERROR in get_patients: {e}")
+            log.error(f"ERROR in get_patients: {e}")
             return jsonify({"error": str(e)}), 500
     else:
-        print("DEBUG: Using in-memory store for patients")
-        # Filter in-memory by user
-        user_patients = [p for p in in_memory_store.values() if p.get('userId') == g.user['uid']]
-        print(f"DEBUG: Found {len(user_patients)} patients in memory.")
-        return jsonify(user_patients)
+        user_patients = memory_store.patients_for_user(
+            g.user['uid'],
+            after=cursor[0] if cursor else None,
+            limit=limit + 1 if limit is not None else None
+        )
+        user_patients, more = take_page(user_patients, limit)
+        if since:
+            user_patients = changed_since(since, user_patients)
+        etag = list_etag((p['id'], doc_version(p)) for p in user_patients)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        next_values = [user_patients[-1]['id']] if more else None
+        if fields is not None:
+            user_patients = [{k: v for k, v in p.items() if k in fields} for p in user_patients]
+        if since:
+            return with_etag(delta_response(user_patients, since), etag)
+        return with_etag(page_response(user_patients, limit, next_values), etag)
 
 @app.route('/api/patients', methods=['POST'])
 @login_required
@@ -280,101 +939,183 @@ def save_patient():
     if not patient.get('id'):
         return jsonify({"error": "Patient ID required"}), 400
 
-    print(f"Saving patient {patient.get('id')} with keys: {list(patient.keys())}")
-    if 'doctors' in patient:
-        print(f" - Doctors count: {len(patient['doctors'])}")
-    if 'medicationsList' in patient:
-        print(f" - Meds count: {len(patient['medicationsList'])}")
+    log.debug("Saving patient", extra={'fields': {
+        'patientId': patient.get('id'),
+        'keys': sorted(patient.keys()),
+        'doctors': len(patient.get('doctors') or []),
+        'medications': len(patient.get('medicationsList') or [])
+    }})
 
     if db:
-        print(">> SAVING TO FIREBASE (PERSISTENT)")
-        import time
-        start_time = time.time()
         try:
             # Don't save messages in the main patient doc anymore to keep it light
             # But we might want to keep the 'last message' or something for preview if we wanted
             # Check if exists and verify ownership
             doc_ref = db.collection('patients').document(patient['id'])
-            doc = doc_ref.get()
-            if doc.exists:
-                if doc.to_dict().get('userId') != g.user['uid']:
-                    return jsonify({"error": "Unauthorized"}), 403
+            owner = get_patient_owner(patient['id'])
+            if owner is not None and owner != g.user['uid']:
+                return jsonify({"error": "Unauthorized"}), 403
+            # Buffered PATCH fields must not land on top of this full save
+            patient_writes.flush(patient['id'])
 
             # For now, let's just encrypt what's passed.
             patient['userId'] = g.user['uid']
-            print(f"Attaching User ID {patient['userId']} to patient {patient['id']}")
-            encrypted_patient = crypto.encrypt_dict(patient)
+            patient['updatedAt'] = now_stamp()
+            encrypted_patient = crypto.encrypt_dict(patient, patient['id'])
             
-            print(f"DEBUG: Writing to document path: patients/{patient['id']}")
-            write_start = time.time()
             try:
-                doc_ref.set(encrypted_patient)
-                print("DEBUG: doc_ref.set() completed successfully.")
+                with phase('firestore'):
+                    doc_ref.set(encrypted_patient)
             except Exception as write_err:
-                print(f"ERROR: Failed to write to Firestore: {write_err}")
+                log.error(f"Failed to write to Firestore: {write_err}")
                 raise write_err
-            write_end = time.time()
-            
-            print(f"DEBUG: Firestore write took {write_end - write_start:.4f} seconds.")
-            print(f"DEBUG: Total save_patient operation took {write_end - start_time:.4f} seconds.")
+            finally:
+                invalidate_patient_owner(patient['id'])
+                patient_context_cache.invalidate(patient['id'])
             
             return jsonify({"status": "success"})
         except Exception as e:
-            print(f"ERROR in save_patient: {e}")
+            log.error(f"ERROR in save_patient: {e}")
             return jsonify({"error": str(e)}), 500
     else:
-        print(">> SAVING TO MEMORY (NOT PERSISTENT - RESTART WILL WIPE)")
+        owner = memory_store.owner(patient['id'])
+        if owner is not None and owner != g.user['uid']:
+            return jsonify({"error": "Unauthorized"}), 403
         patient['userId'] = g.user['uid']
-        # Initialize chats list if not present
-        if 'chats' not in patient:
-            patient['chats'] = {}
-        in_memory_store[patient['id']] = patient
+        patient['updatedAt'] = now_stamp()
+        memory_store.save_patient(patient)
+        patient_context_cache.invalidate(patient['id'])
+        return jsonify({"status": "success", "note": "Saved to in-memory store"})
+
+# Top-level patient fields only; they are used as Firestore update() paths
+PATCH_FIELD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+SERVER_FIELDS = ('id', 'userId', 'updatedAt')
+
+@app.route('/api/patients/<patient_id>', methods=['PATCH'])
+@login_required
+def patch_patient(patient_id):
+    # Partial update: only the fields sent are encrypted and written, and the rest
+    # of the document is left alone. In Firestore mode the write is buffered and
+    # the response is 202; reads through this server already see it.
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        return jsonify({"error": "JSON object of fields required"}), 400
+    changes = {k: v for k, v in changes.items() if k not in SERVER_FIELDS}
+    invalid = [k for k in changes if not PATCH_FIELD.match(k)]
+    if invalid:
+        return jsonify({"error": f"Invalid field names: {', '.join(invalid)}"}), 400
+    if not changes:
+        return jsonify({"error": "No fields to update"}), 400
+
+    ownership_error = check_patient_owner(patient_id)
+    if ownership_error:
+        return ownership_error
+
+    changes['updatedAt'] = now_stamp()
+    if not db:
+        memory_store.update_patient(patient_id, changes)
         return jsonify({"status": "success", "note": "Saved to in-memory store"})
+    try:
+        encrypted = crypto.encrypt_dict(changes, patient_id)
+        buffered = patient_writes.delay > 0
+        if buffered:
+            patient_writes.write(patient_id, encrypted, group=g.user['uid'])
+        else:
+            write_patient_fields(patient_id, encrypted)
+        # After the write: a context built from now on flushes and sees it
+        patient_context_cache.invalidate(patient_id)
+        if buffered:
+            return jsonify({"status": "accepted"}), 202
+        return jsonify({"status": "success"})
+    except Exception as e:
+        log.error(f"ERROR in patch_patient: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def decrypt_chat(patient_id, chat_ref, c_raw):
+    return load_chat_messages(patient_id, chat_ref, crypto.decrypt_dict(c_raw, patient_id=patient_id))
+
+def load_chat_messages(patient_id, chat_ref, chat):
+    # Chats written by append_chat_messages keep each message as its own encrypted
+    # document in a 'messages' subcollection; older chats embed the full list.
+    count = chat.get('messageCount')
+    if count is None:
+        return chat
+    docs = chat_ref.collection('messages').order_by('seq').limit(count).stream() if count else []
+    chat['messages'] = [m.get('message') for m in crypto.decrypt_many([m_doc.to_dict() for m_doc in timed_iter('firestore', docs)], patient_id=patient_id)]
+    return chat
 
 @app.route('/api/patients/<patient_id>/chats', methods=['GET'])
 @login_required
 def get_patient_chats(patient_id):
+    # Newest first. Pages are keyed by (createdAt, chat ID); ?view=summary
+    # returns title and messageCount in place of the messages.
+    try:
+        limit, cursor = read_page_args(cursor_length=2)
+        since = read_since()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    summary = request.args.get('view') == 'summary'
     if db:
-        import time
-        start_time = time.time()
         try:
             # Verify ownership
-            p_doc = db.collection('patients').document(patient_id).get()
-            if not p_doc.exists:
-                 return jsonify({"error": "Patient not found"}), 404
-            if p_doc.to_dict().get('userId') != g.user['uid']:
-                 return jsonify({"error": "Unauthorized"}), 403
-
-            print(f"DEBUG: Fetching chats for patient {patient_id}...")
-            query_start = time.time()
-            docs = db.collection('patients').document(patient_id).collection('chats').order_by('createdAt', direction=firestore.Query.DESCENDING).stream()
+            ownership_error = check_patient_owner(patient_id)
+            if ownership_error:
+                return ownership_error
+
+            chats_ref = db.collection('patients').document(patient_id).collection('chats')
+            if since:
+                # Single-field range, covered by Firestore's automatic index
+                query = chats_ref.where(filter=field_filter('updatedAt', '>', since)).order_by('updatedAt')
+            else:
+                query = chats_ref.order_by('createdAt', direction=DESCENDING)
+            if limit is not None:
+                query = query.order_by(DOCUMENT_ID, direction=DESCENDING)
+                if cursor:
+                    query = query.start_after({'createdAt': cursor[0], DOCUMENT_ID: cursor[1]})
+                query = query.limit(limit + 1)
+            docs, more = take_page(list(timed_iter('firestore', query.stream())), limit)
+            etag = list_etag((doc.id, doc_version(doc)) for doc in docs)
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
             chats = []
             for doc in docs:
                 c_data = doc.to_dict()
                 try:
-                    decrypted = crypto.decrypt_dict(c_data)
+                    decrypted = summarize_chat(patient_id, doc.reference, c_data) if summary else decrypt_chat(patient_id, doc.reference, c_data)
                     chats.append(decrypted)
                 except Exception as e:
-                    print(f"Error decrypting chat {doc.id}: {e}")
-            
-            query_end = time.time()
-            print(f"DEBUG: Firestore chat query took {query_end - query_start:.4f} seconds.")
-            print(f"DEBUG: Found {len(chats)} chats.")
+                    log.error(f"Error decrypting chat {doc.id}: {e}")
             
-            return jsonify(chats)
+            log.debug(f"Returning {len(chats)} chats")
+            if since:
+                return with_etag(delta_response(chats, since), etag)
+            next_values = [docs[-1].to_dict().get('createdAt'), docs[-1].id] if more else None
+            return with_etag(page_response(chats, limit, next_values), etag)
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     else:
-        # Mock support for in-memory
-        if patient_id in in_memory_store:
-            p = in_memory_store[patient_id]
-            if p.get('userId') != g.user['uid']:
-                 return jsonify({"error": "Unauthorized"}), 403
-            chats = list(p.get('chats', {}).values())
-            # Sort by createdAt desc
-            chats.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
-            return jsonify(chats)
-        return jsonify([])
+        owner = memory_store.owner(patient_id)
+        if owner is None:
+            return delta_response([], since) if since else page_response([], limit, None)
+        if owner != g.user['uid']:
+            return jsonify({"error": "Unauthorized"}), 403
+        # Already kept in createdAt order
+        chats = memory_store.chats_for_patient(patient_id, before=cursor, limit=limit + 1 if limit is not None else None)
+        chats, more = take_page(chats, limit)
+        if since:
+            chats = sorted(changed_since(since, chats), key=lambda c: c['updatedAt'])
+        etag = list_etag((c['id'], doc_version(c)) for c in chats)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        next_values = [chats[-1].get('createdAt'), chats[-1]['id']] if more else None
+        if summary:
+            chats = [summarize_memory_chat(chat) for chat in chats]
+        if since:
+            return with_etag(delta_response(chats, since), etag)
+        return with_etag(page_response(chats, limit, next_values), etag)
 
 @app.route('/api/patients/<patient_id>/chats', methods=['POST'])
 @login_required
@@ -383,34 +1124,164 @@ def save_patient_chat(patient_id):
     if not chat_data.get('id'):
         return jsonify({"error": "Chat ID required"}), 400
 
-    print(f"Saving chat {chat_data.get('id')} for patient {patient_id}. Message count: {len(chat_data.get('messages', []))}")
+    log.debug(f"Saving chat {chat_data.get('id')}. Message count: {len(chat_data.get('messages', []))}")
+    chat_data['updatedAt'] = now_stamp()
 
     if db:
-        print(">> SAVING CHAT TO FIREBASE (PERSISTENT)")
         try:
             # Verify ownership
-            p_doc = db.collection('patients').document(patient_id).get()
-            if not p_doc.exists:
-                 return jsonify({"error": "Patient not found"}), 404
-            if p_doc.to_dict().get('userId') != g.user['uid']:
-                 return jsonify({"error": "Unauthorized"}), 403
+            ownership_error = check_patient_owner(patient_id)
+            if ownership_error:
+                return ownership_error
 
-            encrypted_chat = crypto.encrypt_dict(chat_data)
-            db.collection('patients').document(patient_id).collection('chats').document(chat_data['id']).set(encrypted_chat)
+            encrypted_chat = crypto.encrypt_dict(chat_data, patient_id)
+            batch = db.batch()
+            batch.set(db.collection('patients').document(patient_id).collection('chats').document(chat_data['id']), encrypted_chat)
+            batch.set(
+                search_collection(patient_id).document(f"chat-{chat_data['id']}"),
+                search_entry(patient_id, 'chat', chat_data['id'], messages_text(chat_data.get('messages')))
+            )
+            with phase('firestore'):
+                batch.commit()
             return jsonify({"status": "success"})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     else:
-        print(">> SAVING CHAT TO MEMORY (NOT PERSISTENT)")
-        if patient_id in in_memory_store:
-            p = in_memory_store[patient_id]
-            if p.get('userId') != g.user['uid']:
-                 return jsonify({"error": "Unauthorized"}), 403
-            if 'chats' not in p:
-                p['chats'] = {}
-            p['chats'][chat_data['id']] = chat_data
-            return jsonify({"status": "success", "note": "Saved to in-memory store"})
-        return jsonify({"error": "Patient not found"}), 404
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return ownership_error
+        memory_store.save_chat(patient_id, chat_data)
+        memory_search.add(patient_id, 'chat', chat_data['id'], messages_text(chat_data.get('messages')), chat_data['updatedAt'])
+        return jsonify({"status": "success", "note": "Saved to in-memory store"})
+
+# Firestore allows at most 500 writes per batch or transaction; an append also
+# writes the chat and its search entry
+MAX_APPEND_MESSAGES = 400
+
+class ChatChanged(Exception):
+    pass
+
+def migrate_legacy_chat(patient_id, chat_id, chat_ref, search_ref):
+    # Moves the messages embedded in a legacy chat document into its messages
+    # subcollection. They are written in batches outside the append transaction,
+    # which couldn't hold a long chat. Message documents have fixed IDs, so a
+    # migration that fails part way is simply redone next time. The chat is only
+    # switched over (messageCount set, embedded messages dropped) once all of them
+    # are written, and only if the embedded messages haven't changed meanwhile.
+    from google.cloud.firestore import transactional
+
+    with phase('firestore'):
+        snapshot = chat_ref.get()
+    existing = snapshot.to_dict() if snapshot.exists else {}
+    if existing.get('messageCount') is not None or 'messages' not in existing:
+        return
+    stored = existing['messages']
+    legacy = crypto.decrypt_dict({'messages': stored}, patient_id=patient_id).get('messages')
+    if not isinstance(legacy, list):
+        legacy = []
+
+    messages_ref = chat_ref.collection('messages')
+    for start in range(0, len(legacy), MAX_APPEND_MESSAGES):
+        batch = db.batch()
+        for seq in range(start, min(start + MAX_APPEND_MESSAGES, len(legacy))):
+            batch.set(messages_ref.document(f"{seq:08d}"), crypto.encrypt_dict({'seq': seq, 'message': legacy[seq]}, patient_id))
+        with phase('firestore'):
+            batch.commit()
+
+    @transactional
+    def switch_over(transaction):
+        current = chat_ref.get(transaction=transaction)
+        current = current.to_dict() if current.exists else {}
+        if current.get('messageCount') is not None or current.get('messages') != stored:
+            raise ChatChanged("Chat changed while its messages were being migrated")
+        indexed = search_ref.get(transaction=transaction)
+        indexed_tokens = (indexed.to_dict() or {}).get('tokens', []) if indexed.exists else []
+        migrated = {k: v for k, v in current.items() if k != 'messages'}
+        migrated['messageCount'] = len(legacy)
+        transaction.set(chat_ref, migrated)
+        transaction.set(search_ref, search_entry(patient_id, 'chat', chat_id, messages_text(legacy), indexed_tokens))
+
+    with phase('firestore'):
+        switch_over(db.transaction())
+
+@app.route('/api/patients/<patient_id>/chats/<chat_id>/messages', methods=['POST'])
+@login_required
+def append_chat_messages(patient_id, chat_id):
+    # Append-only save: only the new messages are encrypted and written, so the
+    # cost of a turn no longer grows with the length of the chat.
+    data = request.json or {}
+    new_messages = data.get('messages', [])
+    if not new_messages:
+        return jsonify({"error": "Messages required"}), 400
+    if len(new_messages) > MAX_APPEND_MESSAGES:
+        return jsonify({"error": f"At most {MAX_APPEND_MESSAGES} messages per append"}), 400
+
+    # Any other keys (createdAt, title, ...) are chat metadata
+    chat_meta = {k: v for k, v in data.items() if k != 'messages'}
+    chat_meta['id'] = chat_id
+    chat_meta['updatedAt'] = now_stamp()
+
+    log.debug(f"Appending {len(new_messages)} messages to chat {chat_id}")
+
+    if db:
+        try:
+            # Verify ownership
+            ownership_error = check_patient_owner(patient_id)
+            if ownership_error:
+                return ownership_error
+
+            chat_ref = db.collection('patients').document(patient_id).collection('chats').document(chat_id)
+            messages_ref = chat_ref.collection('messages')
+            search_ref = search_collection(patient_id).document(f"chat-{chat_id}")
+
+            from google.cloud.firestore import transactional
+
+            # Legacy chats move their embedded messages into the subcollection
+            # first, so ordering is preserved
+            migrate_legacy_chat(patient_id, chat_id, chat_ref, search_ref)
+
+            @transactional
+            def append_in_transaction(transaction):
+                snapshot = chat_ref.get(transaction=transaction)
+                existing = snapshot.to_dict() if snapshot.exists else {}
+                indexed = search_ref.get(transaction=transaction)
+                indexed_tokens = (indexed.to_dict() or {}).get('tokens', []) if indexed.exists else []
+                count = existing.get('messageCount')
+                if count is None:
+                    if 'messages' in existing:
+                        # Saved whole again since the migration above
+                        raise ChatChanged("Chat changed while its messages were being migrated")
+                    count = 0
+                to_write = list(new_messages)
+
+                for offset, message in enumerate(to_write):
+                    seq = count + offset
+                    transaction.set(messages_ref.document(f"{seq:08d}"), crypto.encrypt_dict({'seq': seq, 'message': message}, patient_id))
+
+                # Stored metadata is kept as it is (no decrypt/re-encrypt round
+                # trip); only the fields sent with this append are encrypted
+                merged = {k: v for k, v in existing.items() if k != 'messages'}
+                merged.update(crypto.encrypt_dict(chat_meta, patient_id))
+                merged['messageCount'] = count + len(to_write)
+                transaction.set(chat_ref, merged)
+                # Only the new text is tokenized; the earlier tokens are kept
+                transaction.set(search_ref, search_entry(patient_id, 'chat', chat_id, messages_text(to_write), indexed_tokens))
+                return merged['messageCount']
+
+            with phase('firestore'):
+                message_count = append_in_transaction(db.transaction())
+            return jsonify({"status": "success", "messageCount": message_count})
+        except ChatChanged as e:
+            return jsonify({"error": f"{e}; retry"}), 409
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    else:
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return ownership_error
+        message_count = memory_store.append_messages(patient_id, chat_id, chat_meta, new_messages)
+        memory_search.add(patient_id, 'chat', chat_id, messages_text(new_messages), chat_meta['updatedAt'], replace=False)
+        return jsonify({"status": "success", "messageCount": message_count, "note": "Saved to in-memory store"})
 
 @app.route('/api/patients/<patient_id>/export', methods=['GET'])
 @login_required
@@ -418,15 +1289,20 @@ def export_patient(patient_id):
     # 1. Fetch Patient
     patient_data = None
     if db:
-        doc = db.collection('patients').document(patient_id).get()
+        try:
+            patient_writes.flush(patient_id)
+        except Exception as e:
+            return jsonify({"error": f"Pending patient edits could not be written: {e}"}), 500
+        with phase('firestore'):
+            doc = db.collection('patients').document(patient_id).get()
         if doc.exists:
             p_raw = doc.to_dict()
             if p_raw.get('userId') != g.user['uid']:
                 return jsonify({"error": "Unauthorized"}), 403
-            patient_data = crypto.decrypt_dict(p_raw)
+            patient_data = crypto.decrypt_dict(p_raw, patient_id=patient_id)
     else:
-        if patient_id in in_memory_store:
-            p_raw = in_memory_store[patient_id]
+        p_raw = memory_store.get_patient(patient_id)
+        if p_raw is not None:
             if p_raw.get('userId') != g.user['uid']:
                 return jsonify({"error": "Unauthorized"}), 403
             patient_data = p_raw
@@ -434,214 +1310,560 @@ def export_patient(patient_id):
     if not patient_data:
         return jsonify({"error": "Patient not found"}), 404
 
-    # 2. Fetch Chats
-    chats = []
-    if db:
-        chat_docs = db.collection('patients').document(patient_id).collection('chats').stream()
-        for c_doc in chat_docs:
-            c_raw = c_doc.to_dict()
-            chats.append(crypto.decrypt_dict(c_raw))
-    else:
-        # In memory chats
-        if 'chats' in patient_data:
-            chats = list(patient_data['chats'].values())
-
-    # 3. Construct Export
-    export_data = {
-        "version": 1,
-        "exportedAt": str(os.times()), 
-        "patient": patient_data,
-        "chats": chats
-    }
-    
-    return jsonify(export_data)
+    # 2. Stream Chats
+    # The export is written incrementally: chats are read from the Firestore stream,
+    # decrypted a window at a time and flushed, so memory stays flat no matter how
+    # much history the patient has.
+    #   ?format=ndjson  one JSON record per line instead of a single JSON document
+    #   ?gzip=1         gzip the body (sent with Content-Encoding: gzip)
+    export_format = request.args.get('format', 'json')
+    use_gzip = request.args.get('gzip') in ('1', 'true')
+
+    def iter_chats():
+        if db:
+            chat_docs = db.collection('patients').document(patient_id).collection('chats').stream()
+            window = []
+            for c_doc in timed_iter('firestore', chat_docs):
+                window.append(c_doc)
+                if len(window) >= EXPORT_WINDOW_SIZE:
+                    yield from decrypt_chat_window(patient_id, window)
+                    window = []
+            yield from decrypt_chat_window(patient_id, window)
+        else:
+            # In memory chats
+            yield from memory_store.chats_for_patient(patient_id)
+
+    header = {"version": 1, "exportedAt": str(os.times())}
+
+    def generate_json():
+        # Same document shape as the old jsonify() export
+        yield '{' + json.dumps(header)[1:-1] + ', "patient": ' + json.dumps(patient_data) + ', "chats": ['
+        for i, chat in enumerate(iter_chats()):
+            yield (', ' if i else '') + json.dumps(chat)
+        yield ']}'
+
+    def generate_ndjson():
+        yield json.dumps({"type": "header", **header}) + '\n'
+        yield json.dumps({"type": "patient", "data": patient_data}) + '\n'
+        for chat in iter_chats():
+            yield json.dumps({"type": "chat", "data": chat}) + '\n'
+
+    body = generate_ndjson() if export_format == 'ndjson' else generate_json()
+    headers = {}
+    if use_gzip:
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+# Chats decrypted per bulk call while streaming an export
+EXPORT_WINDOW_SIZE = 50
+
+def decrypt_chat_window(patient_id, chat_docs):
+    decrypted = crypto.decrypt_many([c_doc.to_dict() for c_doc in chat_docs], workers=bulk_crypto_workers, patient_id=patient_id)
+    for c_doc, chat in zip(chat_docs, decrypted):
+        yield load_chat_messages(patient_id, c_doc.reference, chat)
+
+def gzip_stream(chunks):
+    import zlib
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Firestore allows at most 500 writes per batch
+IMPORT_BATCH_SIZE = min(config.get_setting('import_batch_size') or 400, 500)
+IMPORT_COMMIT_WORKERS = config.get_setting('import_commit_workers') or 4
+
+# (uid, patient ID, import_id) -> set of chat IDs already committed, so a failed
+# import can be re-sent with ?resume=<importId> and only the missing chats are
+# written. An importId only resumes the same user's import of the same patient.
+import_progress = TTLCache(max_size=256, ttl=3600)
+
+def iter_import_records():
+    # Yields ('patient', dict) then ('chat', dict) records from the request body.
+    # NDJSON bodies (the export ?format=ndjson output) are read line by line from
+    # the request stream; plain JSON bodies are parsed as a whole as before.
+    if request.mimetype == 'application/x-ndjson':
+        for line in iter_stream_lines(request.stream):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get('type') in ('patient', 'chat'):
+                yield record['type'], record['data']
+        return
+
+    data = request.json
+    if not data or 'patient' not in data:
+        return
+    yield 'patient', data['patient']
+    for chat in data.get('chats', []):
+        yield 'chat', chat
+
+def iter_stream_lines(stream, chunk_size=64 * 1024):
+    # Iterating the request stream directly reads one byte at a time; read in
+    # fixed-size chunks and split lines ourselves.
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def commit_chat_batch(patient_id, index, chats):
+    chat_ref = db.collection('patients').document(patient_id).collection('chats')
+    try:
+        batch = db.batch()
+        for chat, encrypted_chat in zip(chats, crypto.encrypt_many(chats, patient_id=patient_id)):
+            batch.set(chat_ref.document(chat['id']), encrypted_chat)
+        batch.commit()
+        log.debug(f"Import batch {index}: committed {len(chats)} chats")
+        index_chat_batch(patient_id, index, chats)
+        return {"batch": index, "chats": len(chats), "status": "committed", "chatIds": [c['id'] for c in chats]}
+    except Exception as e:
+        log.error(f"Import batch {index} failed: {e}")
+        return {"batch": index, "chats": len(chats), "status": "failed", "error": str(e), "chatIds": []}
+
+def index_chat_batch(patient_id, index, chats):
+    # Search entries for imported chats, in their own batch: a chat batch can hold
+    # up to 500 writes already. A failure here leaves the chats unsearchable until
+    # they are saved again, but doesn't fail the import.
+    try:
+        batch = db.batch()
+        for chat in chats:
+            batch.set(search_collection(patient_id).document(f"chat-{chat['id']}"), search_entry(patient_id, 'chat', chat['id'], messages_text(chat.get('messages'))))
+        batch.commit()
+    except Exception as e:
+        log.warning(f"Import batch {index}: search index not written: {e}")
 
 @app.route('/api/patients/import', methods=['POST'])
 @login_required
 def import_patient():
-    data = request.json
-    if not data or 'patient' not in data:
+    from concurrent.futures import ThreadPoolExecutor
+
+    records = iter_import_records()
+    try:
+        kind, patient = next(records)
+    except (StopIteration, ValueError):
+        kind, patient = None, None
+    if kind != 'patient' or not patient.get('id'):
         return jsonify({"error": "Invalid import data structure"}), 400
-    
-    patient = data['patient']
-    chats = data.get('chats', [])
-    
-    # Force User ID to current user
+
+    # Force User ID to current user; imported documents count as changed now
+    stamp = now_stamp()
     patient['userId'] = g.user['uid']
-    
+    patient['updatedAt'] = stamp
+    chats = (dict(record, updatedAt=stamp) for kind, record in records if kind == 'chat')
+
     if db:
+        import_id = request.args.get('resume') or uuid.uuid4().hex
+        progress_key = (g.user['uid'], patient['id'], import_id)
+        already_committed = set(import_progress.get(progress_key) or ())
         try:
+            owner = get_patient_owner(patient['id'])
+            if owner is not None and owner != g.user['uid']:
+                return jsonify({"error": "Unauthorized"}), 403
+
             # 1. Save Patient (Overwrite)
-            encrypted_patient = crypto.encrypt_dict(patient)
-            db.collection('patients').document(patient['id']).set(encrypted_patient)
-            
-            # 2. Save Chats
-            batch = db.batch()
-            chat_ref = db.collection('patients').document(patient['id']).collection('chats')
-            
-            for chat in chats:
-                c_doc_ref = chat_ref.document(chat['id'])
-                encrypted_chat = crypto.encrypt_dict(chat)
-                batch.set(c_doc_ref, encrypted_chat)
-            
-            batch.commit()
-            
-            return jsonify({"status": "success", "message": f"Imported patient and {len(chats)} chats"})
+            patient_writes.flush(patient['id'])
+            encrypted_patient = crypto.encrypt_dict(patient, patient['id'])
+            with phase('firestore'):
+                db.collection('patients').document(patient['id']).set(encrypted_patient)
+            invalidate_patient_owner(patient['id'])
+            patient_context_cache.invalidate(patient['id'])
+
+            # 2. Save Chats in bounded batches. Batches are independent, so they are
+            # committed in parallel; at most 2 * workers batches are held in memory.
+            pending = (c for c in chats if c['id'] not in already_committed)
+            results = []
+            in_flight = []
+            # Encryption and commits run on the pool; the request thread's time
+            # waiting on them is counted as Firestore time.
+            with ThreadPoolExecutor(max_workers=IMPORT_COMMIT_WORKERS) as pool:
+                for index, batch in enumerate(iter_batches(pending, IMPORT_BATCH_SIZE)):
+                    in_flight.append(pool.submit(commit_chat_batch, patient['id'], index, batch))
+                    if len(in_flight) >= IMPORT_COMMIT_WORKERS * 2:
+                        with phase('firestore'):
+                            results.append(in_flight.pop(0).result())
+                with phase('firestore'):
+                    results.extend(f.result() for f in in_flight)
+
+            for result in results:
+                already_committed.update(result.pop('chatIds'))
+            import_progress.put(progress_key, already_committed)
+
+            failed = [r for r in results if r['status'] == 'failed']
+            committed = sum(r['chats'] for r in results if r['status'] == 'committed')
+            return jsonify({
+                "status": "partial" if failed else "success",
+                "importId": import_id,
+                "message": f"Imported patient and {committed} chats",
+                "committedChats": len(already_committed),
+                "batches": results
+            }), (207 if failed else 200)
         except Exception as e:
-            print(f"Import Error: {e}")
-            return jsonify({"error": str(e)}), 500
+            log.error(f"Import Error: {e}")
+            return jsonify({"error": str(e), "importId": import_id}), 500
     else:
         # In-memory import
-        in_memory_store[patient['id']] = patient
-        if 'chats' not in patient:
-            patient['chats'] = {}
-        for chat in chats:
-            patient['chats'][chat['id']] = chat
+        owner = memory_store.owner(patient['id'])
+        if owner is not None and owner != g.user['uid']:
+            return jsonify({"error": "Unauthorized"}), 403
+        memory_store.import_patient(patient, chats)
+        patient_context_cache.invalidate(patient['id'])
+        memory_search.reset(patient['id'])
         return jsonify({"status": "success", "message": "Imported to memory"})
 
+MAX_UPLOAD_BYTES = (config.get_setting('max_upload_mb') or 50) * 1024 * 1024
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+upload_sessions = UploadManager()
+
+def store_uploaded_file(patient_id, data, size, sha256, filename, content_type):
+    # Shared by single-request and chunked uploads. 'data' is a file object holding
+    # the whole upload. If this patient already has a file with the same content,
+    # the existing metadata is returned instead of storing a second copy.
+    content_key = crypto.blind_index(f"{patient_id}:{sha256}")
+    existing = find_file_by_content(patient_id, content_key)
+    if existing is not None:
+        log.debug(f"Upload matches existing file {existing.get('id')}; skipping storage write")
+        return existing, True
+
+    file_id = uuid.uuid4().hex
+    path = f"patients/{patient_id}/{file_id}/{filename}"
+    with phase('storage'):
+        generation = blob_store.upload(path, data, size, content_type, sha256=sha256)
+
+    file_data = {
+        "id": file_id,
+        "name": filename,
+        "type": content_type,
+        "size": size,
+        "sha256": sha256,
+        "path": path,
+        "generation": generation,
+        "uploadedAt": str(time.time())
+    }
+    save_file_meta(patient_id, file_data, content_key)
+    return file_data, False
+
 @app.route('/api/patients/<patient_id>/files', methods=['POST'])
 @login_required
 def upload_file(patient_id):
+    # Checked before request.files is touched: parsing the form reads and spools
+    # the whole body. Not a global MAX_CONTENT_LENGTH, which would also cap imports.
+    if request.content_length is None:
+        return jsonify({"error": "Content-Length required"}), 411
+    if request.content_length > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+        return jsonify({"error": f"File exceeds the {MAX_UPLOAD_BYTES} byte limit"}), 413
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
     
-    if db:
-        try:
-            # Verify ownership
-            p_doc = db.collection('patients').document(patient_id).get()
-            if not p_doc.exists:
-                 return jsonify({"error": "Patient not found"}), 404
-            if p_doc.to_dict().get('userId') != g.user['uid']:
-                 return jsonify({"error": "Unauthorized"}), 403
-
-            # Upload to Firebase Storage
-            blob = bucket.blob(f"patients/{patient_id}/{file.filename}")
-            blob.upload_from_file(file)
-            
-            # Save metadata to Firestore
-            file_id = str(int(os.times().elapsed * 1000)) # Simple ID
-            file_data = {
-                "id": file_id,
-                "name": file.filename,
-                "type": file.content_type,
-                "size": 0, # Could get from blob
-                "path": blob.name,
-                "uploadedAt": str(os.times().elapsed)
-            }
-            
-            # Encrypt metadata
-            encrypted_file = crypto.encrypt_dict(file_data)
-            db.collection('patients').document(patient_id).collection('files').document(file_id).set(encrypted_file)
-            
-            return jsonify({"status": "success", "file": file_data})
-        except Exception as e:
-            print(f"Upload Error: {e}")
-            return jsonify({"error": str(e)}), 500
-    else:
-        return jsonify({"error": "Storage not supported in memory mode"}), 501
+    try:
+        # Verify ownership
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return ownership_error
+
+        data, size, sha256 = stream_to_tempfile(file.stream, MAX_UPLOAD_BYTES)
+        with data:
+            file_data, duplicate = store_uploaded_file(patient_id, data, size, sha256, file.filename, file.content_type)
+        return jsonify({"status": "success", "file": file_data, "duplicate": duplicate})
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        log.error(f"Upload Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Chunked / resumable uploads for large scans:
+#   POST   /api/patients/<id>/uploads                  {name, type, size} -> uploadId
+#   PUT    /api/patients/<id>/uploads/<uploadId>?offset=N   raw chunk bytes
+#   GET    /api/patients/<id>/uploads/<uploadId>       -> bytes received so far
+#   POST   /api/patients/<id>/uploads/<uploadId>/complete
+# Sessions and their bytes live in this process (UploadManager), so every request
+# of one upload has to reach the same instance: run one instance or turn on
+# session affinity. A request that lands elsewhere gets a 404 and the client
+# starts a new upload.
+def get_upload_session(patient_id, upload_id):
+    session = upload_sessions.get(upload_id)
+    if not session or session.patient_id != patient_id or session.user_id != g.user['uid']:
+        return None
+    return session
+
+@app.route('/api/patients/<patient_id>/uploads', methods=['POST'])
+@login_required
+def start_upload(patient_id):
+    ownership_error = check_patient_owner(patient_id)
+    if ownership_error:
+        return ownership_error
+
+    data = request.json or {}
+    if not data.get('name'):
+        return jsonify({"error": "File name required"}), 400
+    total_size = data.get('size')
+    if total_size is not None and (not isinstance(total_size, int) or isinstance(total_size, bool) or total_size < 0):
+        return jsonify({"error": "size must be a non-negative integer"}), 400
+    if total_size is not None and total_size > MAX_UPLOAD_BYTES:
+        return jsonify({"error": f"File exceeds the {MAX_UPLOAD_BYTES} byte limit"}), 413
+
+    session = upload_sessions.create(patient_id, g.user['uid'], data['name'], data.get('type', 'application/octet-stream'), total_size)
+    return jsonify(session.to_dict()), 201
+
+@app.route('/api/patients/<patient_id>/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_upload(patient_id, upload_id):
+    session = get_upload_session(patient_id, upload_id)
+    if not session:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/api/patients/<patient_id>/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(patient_id, upload_id):
+    session = get_upload_session(patient_id, upload_id)
+    if not session:
+        return jsonify({"error": "Upload not found"}), 404
+    try:
+        offset = int(request.args.get('offset', session.received))
+    except ValueError:
+        return jsonify({"error": "offset must be an integer"}), 400
+    limit = session.total_size if session.total_size is not None else MAX_UPLOAD_BYTES
+    if request.content_length is not None and offset + request.content_length > limit:
+        upload_sessions.discard(upload_id)
+        return jsonify({"error": f"File exceeds the {limit} byte limit"}), 413
+    try:
+        received = session.append(offset, request.stream, limit)
+        return jsonify({"received": received})
+    except UploadOffsetMismatch as e:
+        return jsonify({"error": str(e), "received": e.expected}), 409
+    except UploadTooLarge as e:
+        upload_sessions.discard(upload_id)
+        return jsonify({"error": str(e)}), 413
+
+@app.route('/api/patients/<patient_id>/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(patient_id, upload_id):
+    session = get_upload_session(patient_id, upload_id)
+    if not session:
+        return jsonify({"error": "Upload not found"}), 404
+    if session.total_size is not None and session.received != session.total_size:
+        return jsonify({"error": "Upload incomplete", "received": session.received}), 409
+    try:
+        with session.lock:
+            data, size, sha256 = session.finish()
+            file_data, duplicate = store_uploaded_file(patient_id, data, size, sha256, session.name, session.content_type)
+        upload_sessions.discard(upload_id)
+        return jsonify({"status": "success", "file": file_data, "duplicate": duplicate})
+    except Exception as e:
+        log.error(f"Upload Error: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/patients/<patient_id>/files', methods=['GET'])
 @login_required
 def list_files(patient_id):
-    if db:
-        try:
-            # Verify ownership
-            p_doc = db.collection('patients').document(patient_id).get()
-            if not p_doc.exists:
-                 return jsonify({"error": "Patient not found"}), 404
-            if p_doc.to_dict().get('userId') != g.user['uid']:
-                 return jsonify({"error": "Unauthorized"}), 403
+    # Pages are ordered by file ID; ?view=summary drops path, hash and generation
+    try:
+        limit, cursor = read_page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fields = FILE_SUMMARY_FIELDS if request.args.get('view') == 'summary' else None
+    try:
+        # Verify ownership
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return ownership_error
 
-            docs = db.collection('patients').document(patient_id).collection('files').stream()
-            files = []
-            for doc in docs:
-                f_data = doc.to_dict()
-                try:
-                    decrypted = crypto.decrypt_dict(f_data)
-                    files.append(decrypted)
-                except Exception as e:
-                    print(f"Error decrypting file {doc.id}: {e}")
-            return jsonify(files)
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-    else:
-        return jsonify([])
+        if not db:
+            files, more = take_page(memory_store.list_files(
+                patient_id,
+                after=cursor[0] if cursor else None,
+                limit=limit + 1 if limit is not None else None
+            ), limit)
+            next_values = [files[-1]['id']] if more else None
+            return page_response([file_meta(f, fields) for f in files], limit, next_values)
+
+        query = files_collection(patient_id)
+        more = False
+        if limit is not None:
+            query = query.order_by(DOCUMENT_ID)
+            if cursor:
+                query = query.start_after({DOCUMENT_ID: cursor[0]})
+            docs, more = take_page(list(timed_iter('firestore', query.limit(limit + 1).stream())), limit)
+        else:
+            docs = timed_iter('firestore', query.stream())
+        files = []
+        for doc in docs:
+            f_data = doc.to_dict()
+            try:
+                files.append(file_meta(crypto.decrypt_dict(f_data, fields=fields, patient_id=patient_id)))
+            except Exception as e:
+                log.error(f"Error decrypting file {doc.id}: {e}")
+        return page_response(files, limit, [doc.id] if more else None)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patients/<patient_id>/search', methods=['GET'])
+@login_required
+def search_patient(patient_id):
+    # ?q=<terms>: chats and files containing every term, most recently written
+    # first, as chat summaries and file summaries with a 'kind'. Matching runs on
+    # blind index tokens; only the hits are read and decrypted.
+    tokens = blind_index.query(patient_id, request.args.get('q', ''))
+    if not tokens:
+        return jsonify({"error": "q must contain at least one search term"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit') or 20), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    try:
+        # Verify ownership
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return ownership_error
+
+        items = []
+        if not db:
+            hits = memory_search.search(patient_id, tokens)
+            for kind, ref_id in hits[:limit]:
+                if kind == 'chat':
+                    chat = memory_store.get_chat(patient_id, ref_id)
+                    if chat is not None:
+                        items.append(dict(summarize_memory_chat(chat), kind=kind))
+                else:
+                    file_data = get_file_meta(patient_id, ref_id, fields=FILE_SUMMARY_FIELDS)
+                    if file_data is not None:
+                        items.append(dict(file_data, kind=kind))
+            return jsonify({"items": items, "total": len(hits)})
+
+        # array_contains on one token (single-field index), the rest checked here
+        query = search_collection(patient_id).where(filter=field_filter('tokens', 'array_contains', tokens[0]))
+        hits = []
+        for doc in timed_iter('firestore', query.stream()):
+            entry = doc.to_dict()
+            if all(token in entry['tokens'] for token in tokens[1:]):
+                hits.append(entry)
+        hits.sort(key=lambda entry: entry.get('updatedAt') or '', reverse=True)
+        chats_ref = db.collection('patients').document(patient_id).collection('chats')
+        for entry in hits[:limit]:
+            if entry['kind'] == 'chat':
+                chat_ref = chats_ref.document(entry['refId'])
+                with phase('firestore'):
+                    c_doc = chat_ref.get()
+                if c_doc.exists:
+                    items.append(dict(summarize_chat(patient_id, chat_ref, c_doc.to_dict()), kind='chat'))
+            else:
+                file_data = get_file_meta(patient_id, entry['refId'], fields=FILE_SUMMARY_FIELDS)
+                if file_data is not None:
+                    items.append(dict(file_data, kind='file'))
+        return jsonify({"items": items, "total": len(hits)})
+    except Exception as e:
+        log.error(f"Search error: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/files/<patient_id>/<file_id>/download', methods=['GET'])
 @login_required
 def download_file_url(patient_id, file_id):
-    if db:
-        try:
-            # Verify ownership
-            p_doc = db.collection('patients').document(patient_id).get()
-            if not p_doc.exists:
-                 return jsonify({"error": "Patient not found"}), 404
-            if p_doc.to_dict().get('userId') != g.user['uid']:
-                 return jsonify({"error": "Unauthorized"}), 403
-
-            # Get file metadata
-            f_doc = db.collection('patients').document(patient_id).collection('files').document(file_id).get()
-            if not f_doc.exists:
-                return jsonify({"error": "File not found"}), 404
-            
-            f_data = crypto.decrypt_dict(f_doc.to_dict())
-            blob = bucket.blob(f_data['path'])
-            
-            # Generate signed URL
-            import datetime
-            url = blob.generate_signed_url(expiration=datetime.timedelta(minutes=15))
-            return jsonify({"url": url})
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-    else:
-        return jsonify({"error": "Not supported"}), 501
+    try:
+        # Verify ownership
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return ownership_error
+
+        # Get file metadata
+        f_data = get_file_meta(patient_id, file_id, fields=['path'])
+        if f_data is None:
+            return jsonify({"error": "File not found"}), 404
+
+        # Generate signed URL
+        with phase('storage'):
+            url = blob_store.signed_url(f_data['path'], 15 * 60)
+        return jsonify({"url": url})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/blobs/<token>', methods=['GET'])
+def serve_local_blob(token):
+    # Download URLs handed out by LocalBlobStore.signed_url(). Like a GCS signed
+    # URL, the token itself is the authorization; no login header is needed.
+    if blob_store.remote:
+        return jsonify({"error": "Not found"}), 404
+    path = blob_store.verify_token(token)
+    if path is None:
+        return jsonify({"error": "Invalid or expired link"}), 403
+    try:
+        local_path = blob_store.local_path(path)
+    except BlobNotFound:
+        return jsonify({"error": "File not found"}), 404
+    # send_file hands the open file to the server's wsgi.file_wrapper, which
+    # sends it with sendfile(2) where supported
+    return send_file(local_path, download_name=os.path.basename(path), conditional=True, max_age=0)
 
 @app.route('/api/patients/<patient_id>/files/<file_id>', methods=['DELETE'])
 @login_required
 def delete_file(patient_id, file_id):
-    if not db:
-        return jsonify({"error": "Database not configured"}), 500
-
     try:
         # Verify patient ownership
-        p_doc = db.collection('patients').document(patient_id).get()
-        if not p_doc.exists or p_doc.to_dict().get('userId') != g.user['uid']:
-            return jsonify({"error": "Unauthorized"}), 403
+        ownership_error = check_patient_owner(patient_id)
+        if ownership_error:
+            return ownership_error
 
-        # Get file doc
-        f_ref = db.collection('patients').document(patient_id).collection('files').document(file_id)
-        f_doc = f_ref.get()
-        
-        if not f_doc.exists:
+        f_data = get_file_meta(patient_id, file_id, fields=['path'])
+        if f_data is None:
             return jsonify({"error": "File not found"}), 404
-
-        f_data = crypto.decrypt_dict(f_doc.to_dict())
         storage_path = f_data.get('path')
 
         # Delete from Storage
         if storage_path:
             try:
-                # Assuming 'bucket' is already initialized globally or via firebase_admin.storage
-                # If not, it would need to be initialized here or passed in.
-                # The existing code uses 'bucket' directly, so we'll assume it's available.
-                blob = bucket.blob(storage_path)
-                blob.delete()
-                print(f"Deleted blob: {storage_path}")
+                with phase('storage'):
+                    blob_store.delete(storage_path)
             except Exception as e:
-                print(f"Error deleting blob (might not exist): {e}")
-
-        # Delete from Firestore
-        f_ref.delete()
-        print(f"Deleted file document: {file_id}")
+                log.warning(f"Error deleting blob (might not exist): {e}")
+            blob_cache.invalidate(storage_path)
+        model_files.invalidate(patient_id, file_id)
 
+        delete_file_meta(patient_id, file_id)
         return jsonify({"success": True})
 
     except Exception as e:
-        print(f"Error deleting file: {e}")
+        log.error(f"Error deleting file: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Background migration of stored documents onto the patients' current data keys
+rekey_worker = ReKeyWorker(
+    db,
+    crypto,
+    batch_size=config.get_setting('rekey_batch_size') or 100,
+    workers=config.get_setting('rekey_workers') or 4,
+    docs_per_second=config.get_setting('rekey_docs_per_second') or 200,
+    rotate=bool(config.get_setting('rekey_rotate'))
+)
+
+if config.get_setting('warm_on_start'):
+    warmup.start()
+
+if crypto.envelope and config.get_setting('rekey_on_start'):
+    rekey_worker.start()
+
 if __name__ == '__main__':
     app.run(port=config.get_setting('app_port'), debug=config.get_setting('debug_mode'))
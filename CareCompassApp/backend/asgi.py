@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+from a2wsgi import WSGIMiddleware
+from flask import g
+import app as backend
+from metrics import phase
+
+log = logging.getLogger(__name__)
+
+# ASGI entry point (run with: uvicorn asgi:application).
+#
+# POST /api/chat is served natively on the event loop: model answers are streamed
+# with send_message_async, so a slow generation holds a coroutine instead of a
+# thread. Everything else is the unchanged Flask app running in a bounded thread
+# pool, which chat streams can no longer starve.
+
+WSGI_THREADS = backend.config.get_setting('wsgi_threads') or 8
+MAX_CHAT_STREAMS = backend.config.get_setting('max_chat_streams') or 200
+
+flask_app = WSGIMiddleware(backend.app, workers=WSGI_THREADS)
+_stream_slots = None
+
+def stream_slots():
+    # Created on first use so it binds to the server's running loop
+    global _stream_slots
+    if _stream_slots is None:
+        _stream_slots = asyncio.Semaphore(MAX_CHAT_STREAMS)
+    return _stream_slots
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/api/chat':
+        return await chat_stream(scope, receive, send)
+    return await flask_app(scope, receive, send)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+def response_headers(content_type):
+    # Preflight OPTIONS requests still go through flask-cors; this covers the POST
+    return [
+        (b'content-type', content_type.encode()),
+        (b'access-control-allow-origin', b'*'),
+    ]
+
+async def send_json(send, status, payload):
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers('application/json')})
+    await send({'type': 'http.response.body', 'body': json.dumps(payload).encode()})
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+def prepare_in_app_context(user, data):
+    # prepare_chat is regular Flask code (g.user, jsonify, blocking Firestore calls)
+    with backend.app.app_context():
+        g.user = user
+        plan, error = backend.prepare_chat(data)
+        if error is not None:
+            error = backend.app.make_response(error)
+            return None, (error.status_code, error.get_data())
+        return plan, None
+
+async def chat_stream(scope, receive, send):
+    # Same request tracing as the Flask routes: request ID, per-phase timings,
+    # latency histogram and sampled summary log
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+    trace = backend.instrumentation.start('chat', 'POST', headers.get('x-request-id'))
+
+    async def traced_send(message):
+        if message['type'] == 'http.response.start':
+            trace.status = message['status']
+            message['headers'] = message['headers'] + [(b'x-request-id', trace.request_id.encode())]
+        await send(message)
+
+    try:
+        await handle_chat(headers, receive, traced_send)
+    finally:
+        # 499: the client went away before a response was started
+        backend.instrumentation.finish(trace, trace.status if trace.status is not None else 499)
+
+async def handle_chat(headers, receive, send):
+    auth_header = headers.get('authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return await send_json(send, 401, {'error': 'Unauthorized'})
+    user = await asyncio.to_thread(backend.verify_token, auth_header.split(' ')[1])
+    if not user:
+        return await send_json(send, 401, {'error': 'Invalid token'})
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        return await send_json(send, 400, {'error': 'Invalid JSON'})
+
+    plan, error = await asyncio.to_thread(prepare_in_app_context, user, data)
+    if error:
+        status, error_body = error
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers('application/json')})
+        return await send({'type': 'http.response.body', 'body': error_body})
+
+    if plan['cached_text'] is not None:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers('text/plain; charset=utf-8')})
+        for piece in backend.replay_text(plan['cached_text']):
+            await send({'type': 'http.response.body', 'body': piece.encode(), 'more_body': True})
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    async with stream_slots():
+        streamer = asyncio.ensure_future(stream_model(plan, send))
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        done, _ = await asyncio.wait({streamer, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if streamer in done:
+            disconnect.cancel()
+            streamer.result()
+        else:
+            # Client went away: stop pulling from the model
+            streamer.cancel()
+            try:
+                await streamer
+            except asyncio.CancelledError:
+                pass
+
+async def stream_model(plan, send):
+    try:
+        with phase('llm'):
+            model = backend.create_model(plan['model_name'], plan['system_instruction'])
+            session = model.start_chat(history=plan['history'])
+            response = await session.send_message_async(plan['parts'], stream=True)
+    except Exception as e:
+        log.error(f"Gemini Error: {e}")
+        return await send_json(send, 500, {'text': backend.CHAT_ERROR_TEXT})
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers('text/plain; charset=utf-8')})
+    pieces = []
+    try:
+        chunks = response.__aiter__()
+        while True:
+            with phase('llm'):
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    break
+            if chunk.text:
+                pieces.append(chunk.text)
+                # Awaiting send() is the backpressure: a slow client slows the pull
+                await send({'type': 'http.response.body', 'body': chunk.text.encode(), 'more_body': True})
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.error(f"Gemini stream error: {e}")
+        return await send({'type': 'http.response.body', 'body': b''})
+    await send({'type': 'http.response.body', 'body': b''})
+    backend.response_cache.put(plan['cache_key'], ''.join(pieces))
@@ -0,0 +1,841 @@
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+
+# Offline benchmarks for backend hot paths. Nothing here talks to Firebase or Gemini:
+# Firestore is replaced by fake_firestore.FakeFirestore and requests go through
+# Flask's test client with an unsigned dev token.
+#
+#   python benchmark.py --list
+#   python benchmark.py ownership --requests 200 --latency 0.005
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+def make_dev_token(uid='bench-user'):
+    # Same shape as a Firebase ID token; only accepted while Firebase is not initialized
+    payload = base64.urlsafe_b64encode(json.dumps({'sub': uid, 'email': f'{uid}@example.com'}).encode()).decode().rstrip('=')
+    return f"header.{payload}.signature"
+
+def load_app(latency=0.0):
+    # Warnings and errors only, on stderr, so they don't mix with the results
+    import metrics
+    metrics.setup_logging('WARNING', stream=sys.stderr)
+    # app.py is chatty at import time; keep benchmark output readable
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        import app as app_module
+        import fake_firestore
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    app_module.db = fake_firestore.FakeFirestore(latency=latency)
+    return app_module
+
+class quiet:
+    # Suppress the per-request print() noise while timing
+    def __enter__(self):
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+    }
+
+def print_row(label, stats, extra=""):
+    print(f"  {label:<32} mean {stats['mean_ms']:8.3f} ms   p50 {stats['p50_ms']:8.3f} ms   p95 {stats['p95_ms']:8.3f} ms   {extra}")
+
+def sample_patient(patient_id='bench-patient', doctors=25, medications=40):
+    # Roughly the shape the frontend saves from the profile and docs/meds screens
+    return {
+        "id": patient_id,
+        "userId": "bench-user",
+        "lastUpdate": "2024-06-01T12:00:00Z",
+        "name": "Jordan Example",
+        "dob": "1950-04-12",
+        "insuranceProvider": "Example Health",
+        "insuranceId": "EX123456789",
+        "groupId": "GRP-0042",
+        "height": "5'9\"",
+        "weight": "172 lb",
+        "bloodPressure": "128/82",
+        "heartRate": "71",
+        "otherVitals": "SpO2 97%",
+        "age": "74",
+        "medications": "",
+        "conditions": ["Type 2 diabetes", "Hypertension", "Hyperlipidemia", "Osteoarthritis"],
+        "doctors": [
+            {"id": str(i), "name": f"Dr. Example {i}", "specialty": "Cardiology", "phone": "555-0100",
+             "address": f"{i} Clinic Way, Springfield", "notes": "Follow up every 6 months. " * 3}
+            for i in range(doctors)
+        ],
+        "medicationsList": [
+            {"id": str(i), "name": f"Medication {i}", "dosage": "10 mg", "frequency": "Twice daily",
+             "prescriber": f"Dr. Example {i % max(doctors, 1)}", "notes": "Take with food. " * 4}
+            for i in range(medications)
+        ],
+    }
+
+def make_crypto(**kwargs):
+    from cryptography.fernet import Fernet
+    from utils import CryptoManager
+    return CryptoManager(Fernet.generate_key(), **kwargs)
+
+def time_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+@benchmark('decrypt')
+def bench_decrypt(args):
+    crypto = make_crypto()
+    docs = [crypto.encrypt_dict(sample_patient(f"p{i}")) for i in range(10)]
+    summary_fields = ['id', 'name', 'lastUpdate']
+
+    full = time_per_call(lambda: [crypto.decrypt_dict(d) for d in docs], args.requests) / len(docs)
+    projected = time_per_call(lambda: [crypto.decrypt_dict(d, fields=summary_fields) for d in docs], args.requests) / len(docs)
+
+    doc_bytes = len(json.dumps(docs[0]))
+    print(f"Patient document decrypt ({doc_bytes} bytes encrypted, {len(docs[0])} fields):")
+    print(f"  {'full decrypt_dict':<40} {full * 1e6:9.1f} us/doc")
+    print(f"  {'decrypt_dict(fields=' + ','.join(summary_fields) + ')':<40} {projected * 1e6:9.1f} us/doc   {full / projected:5.1f}x faster")
+
+def sample_chat(chat_id='c0', messages=40):
+    # Alternating user/AI turns with AI answers about the size Gemini returns
+    return {
+        "id": chat_id,
+        "createdAt": f"2024-01-01T00:00:{int(chat_id[1:]) % 60:02d}Z" if chat_id[1:].isdigit() else "2024-01-01T00:00:00Z",
+        "messages": [
+            {"id": i, "sender": "user" if i % 2 == 0 else "ai",
+             "text": "What does metformin do and when should I take it?" if i % 2 == 0 else
+                     ("**Most Important Information**\n- Metformin lowers blood sugar. " * 12)}
+            for i in range(messages)
+        ],
+    }
+
+TRANSCRIPT_WORDS = (
+    "blood sugar metformin dose morning evening meal kidney function test result doctor visit "
+    "pressure reading heart rate swelling ankle pain knee joint exercise walk daily minutes water "
+    "sleep tired dizzy nausea appointment lab cholesterol statin side effect muscle ache insulin "
+    "a1c diet fiber vegetables salt weight scale pharmacy refill prescription dosage twice once "
+    "take with food before after bedtime call nurse emergency symptoms chest breathing mild normal "
+    "high low range target week month improve check monitor record log ask question explain"
+).split()
+
+def sample_transcript(chat_id='c0', messages=40, seed=0):
+    # Chat whose messages are varied text, unlike sample_chat's repeated
+    # sentences, so it compresses about as well as a real conversation would
+    import random
+    rng = random.Random(seed)
+
+    def sentence():
+        words = rng.choices(TRANSCRIPT_WORDS, k=rng.randint(8, 18))
+        return ' '.join(words).capitalize() + '.'
+
+    return {
+        "id": chat_id,
+        "createdAt": "2024-01-01T00:00:00Z",
+        "messages": [
+            {"id": i, "sender": "user" if i % 2 == 0 else "ai",
+             "text": ' '.join(sentence() for _ in range(rng.randint(1, 2))) if i % 2 == 0 else
+                     "**Most Important Information**\n" + '\n'.join(f"- {sentence()}" for _ in range(rng.randint(6, 12)))}
+            for i in range(messages)
+        ],
+    }
+
+@benchmark('bulk')
+def bench_bulk(args):
+    crypto = make_crypto()
+    workers = max(2, os.cpu_count() or 1)
+
+    variants = [
+        ("per-dict loop", lambda docs, op: [getattr(crypto, op + '_dict')(d) for d in docs]),
+        ("*_many (1 worker)", lambda docs, op: getattr(crypto, op + '_many')(docs)),
+        (f"*_many ({workers} threads)", lambda docs, op: getattr(crypto, op + '_many')(docs, workers=workers)),
+        (f"*_many ({workers} processes)", lambda docs, op: getattr(crypto, op + '_many')(docs, workers=workers, use_processes=True)),
+    ]
+    rounds = max(1, args.requests // 20)
+    # Chats: a few large fields. Patients: many small text fields.
+    for kind, plain in (('chat', [sample_chat(f"c{i}") for i in range(200)]), ('patient', [sample_patient(f"p{i}") for i in range(200)])):
+        encrypted = [crypto.encrypt_dict(d) for d in plain]
+        for op, docs in (('encrypt', plain), ('decrypt', encrypted)):
+            size = sum(len(json.dumps(d)) for d in docs)
+            print(f"{op} {len(docs)} {kind} documents ({size / len(docs) / 1024:.1f} KiB each):")
+            for label, run in variants:
+                elapsed = time_per_call(lambda: run(docs, op), rounds)
+                print(f"  {label:<28} {len(docs) / elapsed:10.0f} docs/s   {size / elapsed / 1e6:8.1f} MB/s")
+
+@benchmark('export')
+def bench_export(args):
+    import tracemalloc
+    app_module = load_app()
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    print("Streaming export, peak Python heap while the response is consumed:")
+    for chat_count in (10, 100, 1000):
+        app_module.db = __import__('fake_firestore').FakeFirestore()
+        app_module.patient_owner_cache.clear()
+        with quiet():
+            client.post('/api/patients', json={'id': 'bench-patient', 'name': 'Bench'}, headers=headers)
+        encrypted = app_module.crypto.encrypt_many([sample_chat(f"c{i}", messages=20) for i in range(chat_count)])
+        chats_ref = app_module.db.collection('patients').document('bench-patient').collection('chats')
+        for chat in encrypted:
+            app_module.db._write(chats_ref.document(chat['id'])._path, chat, merge=False)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        total = 0
+        with quiet():
+            response = client.get('/api/patients/bench-patient/export?format=ndjson', headers=headers, buffered=False)
+            for chunk in response.response:
+                total += len(chunk)
+            response.close()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {chat_count:>5} chats  {total / 1e6:8.2f} MB exported  peak heap {peak / 1e6:7.2f} MB  {elapsed:6.2f} s")
+
+@benchmark('import')
+def bench_import(args):
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}', 'Content-Type': 'application/x-ndjson'}
+    chat_count = 2000
+    body = json.dumps({"type": "patient", "data": {"id": "bench-patient", "name": "Bench"}}) + "\n" + "".join(
+        json.dumps({"type": "chat", "data": sample_chat(f"c{i}", messages=10)}) + "\n" for i in range(chat_count)
+    )
+    # Batch commits cost more than a single document write on the real service
+    app_module.db.latency = args.latency * 10
+    print(f"NDJSON import of {chat_count} chats ({len(body) / 1e6:.1f} MB), batch size {app_module.IMPORT_BATCH_SIZE}, "
+          f"simulated commit latency {app_module.db.latency * 1000:.0f} ms:")
+    default_workers = app_module.IMPORT_COMMIT_WORKERS
+    for workers in (1, 2, 4, 8):
+        app_module.IMPORT_COMMIT_WORKERS = workers
+        start = time.perf_counter()
+        with quiet():
+            response = client.post('/api/patients/import', data=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        result = response.get_json()
+        print(f"  {workers} commit workers  {chat_count / elapsed:8.0f} chats/s  {len(result['batches'])} batches  status {result['status']}")
+    app_module.IMPORT_COMMIT_WORKERS = default_workers
+
+def start_mock_gemini(connect_delay=0.05, first_token_delay=0.02):
+    # Local stand-in for the Gemini REST endpoint. connect_delay is charged once per
+    # new TCP connection (like a TLS handshake), first_token_delay per request.
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    chunk = json.dumps({"candidates": [{"content": {"parts": [{"text": "hello "}], "role": "model"}, "index": 0}]})
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            import socket
+            time.sleep(connect_delay)
+            # Small chunked writes would otherwise sit behind Nagle + delayed ACK
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            super().setup()
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if ':countTokens' in self.path:
+                payload = json.dumps({"totalTokens": 1}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            time.sleep(first_token_delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for piece in ('[' + chunk, ',' + chunk, ']'):
+                data = piece.encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@benchmark('ttft')
+def bench_ttft(args):
+    import google.generativeai as genai
+    from model_pool import ModelPool
+    from prompts import SYSTEM_PROMPT_TEMPLATE
+
+    server = start_mock_gemini()
+    endpoint = {'api_endpoint': f'http://127.0.0.1:{server.server_port}'}
+    system_instruction = SYSTEM_PROMPT_TEMPLATE.format(context=json.dumps(sample_patient())[:2000])
+    requests = max(5, args.requests // 5)
+
+    def first_token(model):
+        start = time.perf_counter()
+        response = model.start_chat(history=[]).send_message([{"text": "What does metformin do?"}], stream=True)
+        for chunk in response:
+            if chunk.text:
+                elapsed = time.perf_counter() - start
+                break
+        for _ in response:
+            pass
+        return elapsed
+
+    # Unpooled: fresh client (new connection) and model per request
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        genai.configure(api_key='bench', transport='rest', client_options=endpoint)
+        model = genai.GenerativeModel(model_name='gemini-bench', system_instruction=system_instruction)
+        setup = time.perf_counter() - start
+        samples.append(setup + first_token(model))
+
+    # Pooled: one client, warmed up, model instance reused per system instruction
+    genai.configure(api_key='bench', transport='rest', client_options=endpoint)
+    pool = ModelPool(lambda **kwargs: genai.GenerativeModel(**kwargs))
+    pool.warmup('gemini-bench')
+    pooled = [first_token(pool.get('gemini-bench', system_instruction)) for _ in range(requests)]
+    server.shutdown()
+
+    print(f"Time to first token against a local mock endpoint (50 ms connect cost, 20 ms first-token delay), {requests} requests:")
+    print_row("new client + model per request", summarize(samples))
+    print_row("pooled + warmed", summarize(pooled), f"{pool.stats()['created']} model instance(s) created")
+
+@benchmark('ownership')
+def bench_ownership(args):
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    with quiet():
+        client.post('/api/patients', json={'id': 'bench-patient', 'name': 'Bench'}, headers=headers)
+        client.post('/api/patients/bench-patient/chats', json={'id': 'c1', 'createdAt': '2024-01-01', 'messages': []}, headers=headers)
+
+    endpoints = [
+        ('GET chats', lambda: client.get('/api/patients/bench-patient/chats', headers=headers)),
+        ('GET files', lambda: client.get('/api/patients/bench-patient/files', headers=headers)),
+        ('POST chat', lambda: client.post('/api/patients/bench-patient/chats', json={'id': 'c1', 'createdAt': '2024-01-01', 'messages': []}, headers=headers)),
+    ]
+    default_size = app_module.patient_owner_cache.max_size
+    for mode, cache_size in (('uncached', 0), ('cached', default_size)):
+        app_module.patient_owner_cache.clear()
+        app_module.patient_owner_cache.max_size = cache_size
+        print(f"{mode} ownership checks (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+        for label, call in endpoints:
+            samples = []
+            app_module.db.reset_counters()
+            with quiet():
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    call()
+                    samples.append(time.perf_counter() - start)
+            reads = app_module.db.counters['reads'] / args.requests
+            print_row(label, summarize(samples), f"{reads:.2f} reads/req")
+    app_module.patient_owner_cache.max_size = default_size
+
+@benchmark('memory')
+def bench_memory(args):
+    # In-memory backend: per-user patient lookup and chat listing against the old
+    # plain dict (linear scan by userId, sort on every read), then the cost of
+    # the encrypted append log, snapshot and recovery
+    import tempfile
+    from memory_store import MemoryStore
+    users, per_user, chats_per_patient = 1000, 10, 200
+    store = MemoryStore()
+    legacy = {}
+    for u in range(users):
+        for p in range(per_user):
+            patient = {'id': f'p{u}-{p}', 'userId': f'u{u}', 'name': f'Patient {p}'}
+            store.save_patient(patient)
+            legacy[patient['id']] = dict(patient, chats={})
+    for c in range(chats_per_patient):
+        chat = {'id': f'c{c}', 'createdAt': f'2024-01-{c % 28 + 1:02d}T{c % 24:02d}:00:00', 'messages': []}
+        store.save_chat('p0-0', chat)
+        legacy['p0-0']['chats'][chat['id']] = chat
+
+    def legacy_chats():
+        chats = list(legacy['p0-0']['chats'].values())
+        chats.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
+        return chats
+
+    print(f"{users * per_user} patients across {users} users, {chats_per_patient} chats on one patient:")
+    for label, fn in (
+        ("patients for user (dict scan)", lambda: [p for p in legacy.values() if p.get('userId') == 'u500']),
+        ("patients for user (userId index)", lambda: store.patients_for_user('u500')),
+        ("chats for patient (sort per read)", legacy_chats),
+        ("chats for patient (sorted index)", lambda: store.chats_for_patient('p0-0')),
+    ):
+        print(f"  {label:<36} {time_per_call(fn, args.requests) * 1e6:9.1f} us/call")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path, key = os.path.join(directory, 'store'), os.urandom(32)
+        persistent = MemoryStore(path, key=key, snapshot_interval=0)
+        persistent.save_patient({'id': 'p', 'userId': 'u'})
+        append = lambda: persistent.append_messages('p', 'c', {}, [{'sender': 'user', 'text': 'How should I take this medication?'}])
+        print(f"  {'append with encrypted log':<36} {time_per_call(append, args.requests) * 1e6:9.1f} us/call")
+        start = time.perf_counter()
+        persistent.snapshot()
+        print(f"  snapshot of {args.requests} messages          {(time.perf_counter() - start) * 1000:9.2f} ms")
+        start = time.perf_counter()
+        recovered = MemoryStore(path, key=key, snapshot_interval=0)
+        print(f"  recovery                             {(time.perf_counter() - start) * 1000:9.2f} ms   {len(recovered.get_chat('p', 'c')['messages'])} messages")
+
+@benchmark('metrics')
+def bench_metrics(args):
+    # Cost of request tracing on a cheap endpoint, and the per-phase breakdown it records
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    client.post('/api/patients', json=sample_patient(), headers=headers)
+    client.post('/api/patients/bench-patient/chats', json=sample_chat(), headers=headers)
+
+    instrumentation = app_module.instrumentation
+    print(f"GET /api/patients/<id>/chats, {args.requests} requests (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    for label, sample_rate in (('traced, 0% logged', 0.0), ('traced, 100% logged', 1.0)):
+        instrumentation.sample_rate = sample_rate
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            client.get('/api/patients/bench-patient/chats', headers=headers)
+            samples.append(time.perf_counter() - start)
+        print_row(label, summarize(samples))
+
+    print("Recorded phase totals (from /metrics):")
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        if line.startswith('carecompass_phase_seconds_sum') and 'get_patient_chats' in line:
+            print(f"  {line}")
+
+@benchmark('files')
+def bench_files(args):
+    # File path without a cloud bucket: upload, download through the signed local
+    # URL, delete; plus the local store's copy into place with and without a
+    # known hash (sendfile vs read/hash/write)
+    import io
+    import tempfile
+    from urllib.parse import urlparse
+    from blob_store import LocalBlobStore
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    client.post('/api/patients', json=sample_patient(), headers=headers)
+    size = 4 * 1024 * 1024
+    count = max(1, args.requests // 10)
+
+    print(f"{count} x {size // (1024 * 1024)} MiB files through the Flask routes (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    uploads, downloads, file_ids = [], [], []
+    for i in range(count):
+        body = os.urandom(size)
+        start = time.perf_counter()
+        response = client.post('/api/patients/bench-patient/files', data={'file': (io.BytesIO(body), f'scan-{i}.pdf')}, headers=headers, content_type='multipart/form-data')
+        uploads.append(time.perf_counter() - start)
+        file_ids.append(response.get_json()['file']['id'])
+    for file_id in file_ids:
+        start = time.perf_counter()
+        url = client.get(f'/api/files/bench-patient/{file_id}/download', headers=headers).get_json()['url']
+        response = client.get(urlparse(url).path)
+        received = len(response.get_data())
+        response.close()
+        downloads.append(time.perf_counter() - start)
+    for label, samples in (("upload", uploads), ("signed URL + download", downloads)):
+        stats = summarize(samples)
+        print_row(label, stats, f"{size / (1024 * 1024) / (stats['mean_ms'] / 1000):7.1f} MiB/s")
+    assert received == size
+    for file_id in file_ids:
+        client.delete(f'/api/patients/bench-patient/files/{file_id}', headers=headers)
+
+    print(f"LocalBlobStore.upload of one {size // (1024 * 1024)} MiB file:")
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryFile() as source:
+        store = LocalBlobStore(directory, os.urandom(32))
+        source.write(os.urandom(size))
+        source.flush()
+        source.seek(0)
+        import hashlib
+        sha256 = hashlib.sha256(source.read()).hexdigest()
+        for label, known in (("read, hash and write", None), ("sendfile (hash known)", sha256)):
+            def upload():
+                source.seek(0)
+                store.upload('bench/file', source, size, 'application/pdf', sha256=known)
+            seconds = time_per_call(upload, count)
+            print(f"  {label:<32} {seconds * 1000:8.3f} ms   {size / (1024 * 1024) / seconds:8.1f} MiB/s")
+
+@benchmark('pages')
+def bench_pages(args):
+    # First load of a long chat history: everything at once vs. the first page,
+    # with full messages and as summaries
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    client.post('/api/patients', json=sample_patient(), headers=headers)
+    chats = 300
+    for i in range(chats):
+        chat = sample_chat(f'c{i:04d}', messages=40)
+        chat['createdAt'] = f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T{i % 24:02d}:00:00Z'
+        client.post('/api/patients/bench-patient/chats', json=chat, headers=headers)
+
+    print(f"GET /api/patients/<id>/chats with {chats} chats of 40 messages (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    iterations = max(1, args.requests // 10)
+    for label, query in (
+        ("all chats", ""),
+        ("first page of 20", "?limit=20"),
+        ("first page of 20, summaries", "?limit=20&view=summary"),
+    ):
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            response = client.get(f'/api/patients/bench-patient/chats{query}', headers=headers)
+            samples.append(time.perf_counter() - start)
+        print_row(label, summarize(samples), f"{len(response.get_data()) / 1024:8.1f} KiB")
+
+@benchmark('sync')
+def bench_sync(args):
+    # Re-fetching an unchanged chat list: full reload vs. If-None-Match (304)
+    # vs. ?since delta
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    client.post('/api/patients', json=sample_patient(), headers=headers)
+    chats = 100
+    for i in range(chats):
+        client.post('/api/patients/bench-patient/chats', json=sample_chat(f'c{i:04d}', messages=40), headers=headers)
+    first = client.get('/api/patients/bench-patient/chats', headers=headers)
+    etag = first.headers['ETag']
+    since = max(chat['updatedAt'] for chat in first.get_json())
+
+    print(f"GET /api/patients/<id>/chats, {chats} unchanged chats of 40 messages (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    for label, url, extra_headers in (
+        ("full reload", '/api/patients/bench-patient/chats', {}),
+        ("If-None-Match (304)", '/api/patients/bench-patient/chats', {'If-None-Match': etag}),
+        ("?since delta", f'/api/patients/bench-patient/chats?since={since}', {}),
+    ):
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.get(url, headers=dict(headers, **extra_headers))
+            samples.append(time.perf_counter() - start)
+        print_row(label, summarize(samples), f"{response.status_code} {len(response.get_data()) / 1024:8.1f} KiB")
+
+@benchmark('patch')
+def bench_patch(args):
+    # A burst of 50 profile edits (someone typing into the weight field): full
+    # POST of the patient per edit vs. PATCH of the changed field, written
+    # through or coalesced by the write-behind buffer
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    patient = sample_patient()
+    client.post('/api/patients', json=patient, headers=headers)
+    edits = [{'weight': f"{170 + i / 10:.1f} lb"} for i in range(50)]
+    buffered_delay = app_module.patient_writes.delay or 0.5
+
+    print(f"{len(edits)} edits to one patient (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    for label, delay in (("POST full patient", None), ("PATCH, write-through", 0), ("PATCH, buffered", buffered_delay)):
+        app_module.patient_writes.delay = delay or 0
+        app_module.db.reset_counters()
+        samples = []
+        sent = 0
+        for edit in edits:
+            if delay is None:
+                patient = dict(patient, **edit)
+                body = patient
+                start = time.perf_counter()
+                client.post('/api/patients', json=body, headers=headers)
+            else:
+                body = edit
+                start = time.perf_counter()
+                client.patch('/api/patients/bench-patient', json=body, headers=headers)
+            samples.append(time.perf_counter() - start)
+            sent += len(json.dumps(body))
+        if delay:
+            # Let the buffer's timer write the burst, as it would in the server
+            time.sleep(delay + 0.1)
+        writes = app_module.db.counters['writes']
+        print_row(label, summarize(samples), f"{writes:3d} Firestore writes  {sent / 1024:7.1f} KiB sent")
+    stored = app_module.crypto.decrypt_dict(app_module.db.collection('patients').document('bench-patient').get().to_dict())
+    print(f"  final weight in Firestore: {stored['weight']} (last edit {edits[-1]['weight']})")
+
+@benchmark('context')
+def bench_context(args):
+    # Chat request preparation with the patient context sent by the client vs.
+    # built on the server from the stored record, uncached and cached
+    from flask import g
+    from patient_context import render_context
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    patient = sample_patient()
+    client.post('/api/patients', json=patient, headers=headers)
+    prompt = "What does metformin do and when should I take it?"
+    bodies = {
+        "client-sent context": {'prompt': prompt, 'context': render_context(patient)},
+        "server context, uncached": {'prompt': prompt, 'patientId': 'bench-patient'},
+        "server context, cached": {'prompt': prompt, 'patientId': 'bench-patient'},
+    }
+
+    print(f"prepare_chat for one patient, {len(patient['doctors'])} doctors and {len(patient['medicationsList'])} medications (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    for label, body in bodies.items():
+        samples = []
+        app_module.db.reset_counters()
+        prompts = set()
+        with app_module.app.test_request_context():
+            g.user = {'uid': 'bench-user'}
+            for _ in range(args.requests):
+                if label.endswith('uncached'):
+                    app_module.patient_context_cache.clear()
+                start = time.perf_counter()
+                plan, _ = app_module.prepare_chat(body)
+                samples.append(time.perf_counter() - start)
+                prompts.add(plan['system_instruction'])
+        reads = app_module.db.counters['reads'] / args.requests
+        print_row(label, summarize(samples), f"{len(json.dumps(body)):6d} B request  {reads:.2f} reads/req  {len(prompts)} distinct prompt(s)")
+
+@benchmark('compress')
+def bench_compress(args):
+    # Stored size and encrypt/decrypt throughput of chat transcripts and a
+    # patient document, plain Fernet vs. zlib-before-encryption
+    docs = [sample_transcript(f"c{i}", messages=40, seed=i) for i in range(50)] + [sample_patient()]
+    plain_bytes = sum(len(json.dumps(d)) for d in docs)
+    rounds = max(1, args.requests // 20)
+    print(f"{len(docs)} documents (50 chats of 40 messages + 1 patient), {plain_bytes / 1024:.0f} KiB as JSON:")
+    baseline = expected = None
+    for label, options in (
+        ("plain Fernet", {}),
+        ("zlib level 1, >= 1 KiB", {'compress_min_bytes': 1024, 'compress_level': 1}),
+        ("zlib level 6, >= 1 KiB", {'compress_min_bytes': 1024, 'compress_level': 6}),
+        ("zlib level 9, >= 1 KiB", {'compress_min_bytes': 1024, 'compress_level': 9}),
+    ):
+        crypto = make_crypto(**options)
+        encrypted = [crypto.encrypt_dict(d) for d in docs]
+        decrypted = [crypto.decrypt_dict(e) for e in encrypted]
+        # Same round trip as plain Fernet (which turns "74" into 74, for one)
+        expected = expected or decrypted
+        assert decrypted == expected
+        stored = sum(len(json.dumps(e)) for e in encrypted)
+        largest = max(len(json.dumps(e)) for e in encrypted)
+        baseline = baseline or stored
+        encrypt_s = time_per_call(lambda: [crypto.encrypt_dict(d) for d in docs], rounds)
+        decrypt_s = time_per_call(lambda: [crypto.decrypt_dict(e) for e in encrypted], rounds)
+        print(f"  {label:<24} stored {stored / 1024:7.0f} KiB ({stored / baseline:4.0%})  largest doc {largest / 1024:5.1f} KiB"
+              f"   encrypt {plain_bytes / encrypt_s / 1e6:6.1f} MB/s   decrypt {plain_bytes / decrypt_s / 1e6:6.1f} MB/s")
+
+@benchmark('envelope')
+def bench_envelope(args):
+    # Per-field cost of AES-GCM with a per-patient data key vs. Fernet under the
+    # master key, the first-use cost of a data key, and re-key worker throughput
+    import fake_firestore
+    from envelope import DataKeyStore
+    from rekey import ReKeyWorker
+    db = fake_firestore.FakeFirestore(latency=args.latency)
+    fernet = make_crypto()
+    gcm = make_crypto()
+    gcm.data_keys = DataKeyStore(lambda: db, gcm.derive_key('data-key-wrap'))
+    gcm.envelope = True
+    gcm.encrypt('warm', 'p0')
+    iterations = args.requests * 20
+
+    print("Per field (data key cached):")
+    for size in (32, 1024, 16 * 1024):
+        value = sample_transcript(messages=200)['messages'][1]['text'] * (size // 64 + 1)
+        value = value[:size]
+        rows = []
+        for label, crypto, patient_id in (("Fernet", fernet, None), ("AES-GCM", gcm, 'p0')):
+            sealed = crypto.encrypt(value, patient_id)
+            encrypt_s = time_per_call(lambda: crypto.encrypt(value, patient_id), iterations)
+            decrypt_s = time_per_call(lambda: crypto.decrypt(sealed), iterations)
+            rows.append(f"{label} enc {encrypt_s * 1e6:6.1f} us  dec {decrypt_s * 1e6:6.1f} us  +{len(sealed) - size:5d} B")
+        print(f"  {size:6d} B   " + "   |   ".join(rows))
+
+    cold = []
+    for i in range(20):
+        gcm.data_keys = DataKeyStore(lambda: db, gcm.derive_key('data-key-wrap'))
+        start = time.perf_counter()
+        gcm.encrypt('x', f"new{i}")
+        cold.append(time.perf_counter() - start)
+    print_row("first write, new patient", summarize(cold), "creates and wraps a data key (transaction)")
+    sealed = [gcm.encrypt('x', f"new{i}") for i in range(20)]
+    cold = []
+    for value in sealed:
+        gcm.data_keys = DataKeyStore(lambda: db, gcm.derive_key('data-key-wrap'))
+        start = time.perf_counter()
+        gcm.decrypt(value)
+        cold.append(time.perf_counter() - start)
+    print_row("first read, cold key cache", summarize(cold), "one dataKeys read + unwrap")
+
+    # Fernet-era data for 50 patients: patient document + 10 chats of 40 messages each
+    patients = 50
+    for i in range(patients):
+        patient_id = f"m{i:03d}"
+        patient_ref = db.collection('patients').document(patient_id)
+        patient_ref.set(fernet.encrypt_dict(sample_patient(patient_id)))
+        for j in range(10):
+            patient_ref.collection('chats').document(f"c{j}").set(fernet.encrypt_dict(sample_transcript(f"c{j}", seed=j)))
+    migrate = make_crypto()
+    migrate.fernet = fernet.fernet
+    migrate.data_keys = DataKeyStore(lambda: db, migrate.derive_key('data-key-wrap'))
+    migrate.envelope = True
+    documents = patients * 11
+    print(f"Re-key {documents} Fernet documents ({patients} patients; simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    for label, options in (
+        ("1 worker, unthrottled", {'workers': 1, 'docs_per_second': 0, 'batch_size': 50}),
+        ("4 workers, unthrottled", {'workers': 4, 'docs_per_second': 0, 'batch_size': 50}),
+        ("4 workers, 200 docs/s cap", {'workers': 4, 'docs_per_second': 200, 'batch_size': 50}),
+    ):
+        if label != "1 worker, unthrottled":
+            # Put the data back on Fernet (and the next patient key version)
+            for path, data in list(db._docs.items()):
+                if path[0] == 'patients':
+                    db._write(path, fernet.encrypt_dict(migrate.decrypt_dict(data)), merge=False)
+        worker = ReKeyWorker(db, migrate, **options)
+        worker.run()
+        stats = worker.stats()
+        print(f"  {label:<32} {stats['migrated']:5d} migrated in {stats['seconds']:6.2f} s   {stats['migrated'] / stats['seconds']:8.0f} docs/s")
+
+# Runs in a fresh interpreter so nothing is imported yet
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import metrics
+metrics.setup_logging('WARNING', stream=sys.stderr)
+import app
+from benchmark import make_dev_token
+timings = {'import app': time.perf_counter() - started}
+client = app.app.test_client()
+start = time.perf_counter()
+client.get('/')
+timings['first GET /'] = time.perf_counter() - start
+start = time.perf_counter()
+client.get('/api/patients', headers={'Authorization': 'Bearer ' + make_dev_token()})
+timings['first GET /api/patients'] = time.perf_counter() - start
+timings['time to first API response'] = time.perf_counter() - started
+start = time.perf_counter()
+client.get('/ready?warm=1')
+app.warmup.wait()
+timings['deferred init (/ready?warm=1)'] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+@benchmark('search')
+def bench_search(args):
+    # GET /api/patients/<id>/search against decrypting every chat and scanning
+    # it, and the stored size of the search entries next to the chats, as the
+    # chat history grows. One query term is in every 25th chat; the other query
+    # matches nearly every chat, so its time is mostly reading the 20 results.
+    from search_index import terms, messages_text
+    app_module = load_app(latency=args.latency)
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {make_dev_token()}'}
+    queries = ("lisinopril", "metformin kidney appointment")
+    iterations = max(1, args.requests // 10)
+
+    print(f"GET /api/patients/<id>/search, chats of 20 messages (simulated Firestore latency {args.latency * 1000:.1f} ms):")
+    for chats in (50, 200, 800):
+        app_module.db = type(app_module.db)(latency=args.latency)
+        patient_id = f'bench-patient-{chats}'
+        client.post('/api/patients', json=sample_patient(patient_id), headers=headers)
+        for i in range(chats):
+            chat = sample_transcript(f'c{i:04d}', messages=20, seed=i)
+            if i % 25 == 0:
+                chat['messages'][0]['text'] += " I started lisinopril last week."
+            client.post(f'/api/patients/{patient_id}/chats', json=chat, headers=headers)
+        patient_ref = app_module.db.collection('patients').document(patient_id)
+
+        def scan(query):
+            wanted = terms(query)
+            hits = 0
+            for doc in patient_ref.collection('chats').stream():
+                messages = app_module.crypto.decrypt_field('messages', doc.to_dict().get('messages'))
+                hits += wanted <= terms(messages_text(messages))
+            return hits
+
+        def search(query):
+            return client.get(f'/api/patients/{patient_id}/search?q={query}', headers=headers).get_json()['total']
+
+        for query in queries:
+            assert scan(query) == search(query)
+            for label, fn in (("scan", scan), ("index", search)):
+                samples = []
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    hits = fn(query)
+                    samples.append(time.perf_counter() - start)
+                print_row(f"{chats} chats, {query.split()[0]}, {label}", summarize(samples), f"{hits} hits")
+        corpus = sum(len(json.dumps(doc.to_dict())) for doc in patient_ref.collection('chats').stream())
+        index = sum(len(json.dumps(doc.to_dict())) for doc in patient_ref.collection('search').stream())
+        print(f"  {chats} chats: {corpus / 1024:.0f} KiB encrypted chats, {index / 1024:.0f} KiB search entries ({index / corpus:.0%})")
+
+@benchmark('startup')
+def bench_startup(args):
+    # Cold start: what importing app.py costs, split by its direct imports, and
+    # how long until the first responses. The clients that are now built lazily
+    # are then warmed to show what startup no longer pays for.
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(max(1, args.requests // 20)):
+        result = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=here, capture_output=True, text=True, check=True)
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    print(f"Cold start, mean of {len(runs)} fresh processes (no Firebase credentials):")
+    for key in runs[0]:
+        print(f"  {key:<32} {statistics.mean(r[key] for r in runs) * 1000:9.1f} ms")
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', "import sys, metrics; metrics.setup_logging('WARNING', stream=sys.stderr); import app"],
+                            cwd=here, capture_output=True, text=True, check=True)
+    # Lines are "import time: self | cumulative | <indent>name", children first,
+    # one indent level (two spaces) per nesting depth
+    direct, pending = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            pending.append((int(cumulative) / 1000, name.strip()))
+        elif depth == 0:
+            if name.strip() == 'app':
+                direct = pending
+            pending = []
+    print("Import time of app.py's direct imports (python -X importtime):")
+    for ms, name in sorted(direct, reverse=True)[:8]:
+        print(f"  {name:<32} {ms:9.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="CareCompass backend benchmarks")
+    parser.add_argument('name', nargs='?', help="Benchmark to run")
+    parser.add_argument('--list', action='store_true', help="List available benchmarks")
+    parser.add_argument('--requests', type=int, default=100, help="Iterations per measurement")
+    parser.add_argument('--latency', type=float, default=0.002, help="Simulated Firestore round trip (seconds)")
+    args = parser.parse_args()
+
+    if args.list or not args.name:
+        print("Available benchmarks: " + ", ".join(sorted(BENCHMARKS)))
+        return
+    if args.name not in BENCHMARKS:
+        parser.error(f"Unknown benchmark '{args.name}'")
+    BENCHMARKS[args.name](args)
+
+if __name__ == '__main__':
+    main()
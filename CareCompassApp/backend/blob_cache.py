@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+log = logging.getLogger(__name__)
+
+class BlobCache:
+    # Disk-backed, size-bounded LRU cache of storage blob bytes, keyed by storage
+    # path and generation (a new generation means new content, so stale bytes are
+    # never served). Cached files are AES-GCM encrypted at rest and read back
+    # through mmap. File names start with a hash of the storage path, so files
+    # re-adopted after a restart can still be invalidated by path.
+    def __init__(self, directory, max_bytes, key):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._aead = AESGCM(key)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # cache file name -> (path hash, size on disk)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        # Re-adopt files left by a previous process, oldest first
+        names = []
+        for name in os.listdir(self.directory):
+            full = os.path.join(self.directory, name)
+            if not (name.endswith('.blob') and os.path.isfile(full)):
+                continue
+            if name.count('-') != 1:
+                # Older naming without the path hash; never looked up again
+                self._remove(name)
+                continue
+            names.append((os.path.getmtime(full), name, os.path.getsize(full)))
+        for _, name, size in sorted(names):
+            self._entries[name] = (name.split('-')[0], size)
+        self._evict()
+
+    def _path_hash(self, path):
+        return hashlib.sha256(path.encode()).hexdigest()[:32]
+
+    def _name(self, path, generation):
+        return f"{self._path_hash(path)}-{hashlib.sha256(f'{path}#{generation}'.encode()).hexdigest()}.blob"
+
+    def get(self, path, generation):
+        name = self._name(path, generation)
+        full = os.path.join(self.directory, name)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+        try:
+            with open(full, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    content = self._aead.decrypt(view[:12], view[12:], name.encode())
+                finally:
+                    view.release()
+        except Exception as e:
+            # Missing, truncated or tampered file: drop it and treat as a miss
+            log.warning(f"Blob cache read failed for {path}: {e}")
+            self._remove(name)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(content)
+        return content
+
+    def put(self, path, generation, content):
+        if len(content) > self.max_bytes:
+            return
+        name = self._name(path, generation)
+        nonce = os.urandom(12)
+        sealed = nonce + self._aead.encrypt(nonce, content, name.encode())
+        tmp = os.path.join(self.directory, f".{name}.{threading.get_ident()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(sealed)
+        os.replace(tmp, os.path.join(self.directory, name))
+        with self._lock:
+            self._entries[name] = (self._path_hash(path), len(sealed))
+            self._entries.move_to_end(name)
+        self._evict()
+
+    def invalidate(self, path):
+        path_hash = self._path_hash(path)
+        with self._lock:
+            names = [n for n, (h, _) in self._entries.items() if h == path_hash]
+        for name in names:
+            self._remove(name)
+
+    def _remove(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            total = sum(size for _, size in self._entries.values())
+            evicted = []
+            while total > self.max_bytes and self._entries:
+                name, (_, size) = self._entries.popitem(last=False)
+                total -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(size for _, size in self._entries.values()),
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "bytesSaved": self.bytes_saved
+            }
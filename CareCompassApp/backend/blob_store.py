@@ -0,0 +1,198 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Where patient files live. app.py only talks to this interface:
+#   upload(path, data, size, content_type, sha256=None) -> generation
+#   generation(path)                       -> current generation, None if missing
+#   read(path, generation)                 -> bytes
+#   delete(path)
+#   signed_url(path, expires_in)           -> time-limited download URL
+# 'remote' tells the caller whether reads cross the network (and are worth
+# keeping in the local blob cache).
+
+class BlobNotFound(Exception):
+    pass
+
+class FirebaseBlobStore:
+    remote = True
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def upload(self, path, data, size, content_type, sha256=None):
+        blob = self.bucket.blob(path)
+        blob.upload_from_file(data, size=size, content_type=content_type)
+        return blob.generation
+
+    def generation(self, path):
+        # Files uploaded before generations were recorded: one metadata request
+        blob = self.bucket.get_blob(path)
+        return blob.generation if blob is not None else None
+
+    def read(self, path, generation):
+        return self.bucket.blob(path, generation=generation).download_as_bytes()
+
+    def delete(self, path):
+        self.bucket.blob(path).delete()
+
+    def signed_url(self, path, expires_in):
+        return self.bucket.blob(path).generate_signed_url(expiration=datetime.timedelta(seconds=expires_in))
+
+def copy_file(source, target, size):
+    # sendfile(2) between two regular files; False if that isn't possible here
+    try:
+        in_fd, out_fd = source.fileno(), target.fileno()
+        offset = source.tell()
+    except (AttributeError, OSError, ValueError):
+        return False
+    sent = 0
+    try:
+        while sent < size:
+            count = os.sendfile(out_fd, in_fd, offset + sent, size - sent)
+            if count == 0:
+                break
+            sent += count
+    except OSError:
+        if sent:
+            raise
+        return False
+    return sent == size
+
+def copy_and_hash(source, target):
+    hasher = hashlib.sha256()
+    while True:
+        chunk = source.read(1024 * 1024)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        target.write(chunk)
+    return hasher.hexdigest()
+
+class LocalBlobStore:
+    # Filesystem backend for offline development and load testing. Content is
+    # stored once under objects/<sha256>. Each storage path is a hard link to
+    # its object at refs/<sha256 of path>/<sha256 of content>, so identical
+    # uploads share disk space. The object goes away with its last ref. The
+    # generation is derived from the content hash.
+    #
+    # signed_url() returns an HMAC-signed, expiring token in place of a GCS
+    # signed URL. The /api/blobs/<token> route checks it and serves the ref with
+    # send_file, which uses sendfile(2) when the server offers
+    # wsgi.file_wrapper (gunicorn, for example).
+    #
+    # Files are stored unencrypted so they can be sent zero-copy. Keep the
+    # directory on local, access-controlled disk.
+    remote = False
+
+    def __init__(self, root, url_key, url_for=None):
+        self.root = root
+        self.url_key = url_key
+        # url_for(token) -> URL the client can fetch; set by app.py
+        self.url_for = url_for or (lambda token: f"/api/blobs/{token}")
+        os.makedirs(os.path.join(root, 'objects'), mode=0o700, exist_ok=True)
+        os.makedirs(os.path.join(root, 'refs'), mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _ref_dir(self, path):
+        digest = hashlib.sha256(path.encode()).hexdigest()
+        return os.path.join(self.root, 'refs', digest[:2], digest)
+
+    def _object_path(self, sha256):
+        return os.path.join(self.root, 'objects', sha256[:2], sha256)
+
+    def _ref(self, path):
+        # refs/<path hash>/<content hash>: the single entry names the object
+        directory = self._ref_dir(path)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return None, None
+        return (os.path.join(directory, names[0]), names[0]) if names else (None, None)
+
+    @staticmethod
+    def _generation(sha256):
+        # Positive int like a GCS generation, stable for identical content
+        return int(sha256[:15], 16)
+
+    def upload(self, path, data, size, content_type, sha256=None):
+        # Copy to a temp file next to the objects, then move it into place (or
+        # drop it if the content is already stored). When the caller already
+        # hashed the upload, the kernel copies the bytes.
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, 'objects'))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if sha256 is None or not copy_file(data, out, size):
+                    sha256 = copy_and_hash(data, out)
+            target = self._object_path(sha256)
+            with self._lock:
+                _, current = self._ref(path)
+                if current != sha256:
+                    # Drop the old ref first: it may have been the object's last
+                    self._remove_ref(path)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    if not os.path.exists(target):
+                        os.replace(tmp, target)
+                    directory = self._ref_dir(path)
+                    os.makedirs(directory, exist_ok=True)
+                    os.link(target, os.path.join(directory, sha256))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return self._generation(sha256)
+
+    def local_path(self, path):
+        ref, _ = self._ref(path)
+        if ref is None:
+            raise BlobNotFound(path)
+        return ref
+
+    def generation(self, path):
+        _, sha256 = self._ref(path)
+        return self._generation(sha256) if sha256 else None
+
+    def read(self, path, generation=None):
+        with open(self.local_path(path), 'rb') as f:
+            return f.read()
+
+    def delete(self, path):
+        with self._lock:
+            if not self._remove_ref(path):
+                raise BlobNotFound(path)
+
+    def _remove_ref(self, path):
+        # Caller holds the lock. Drops the object too once no ref points at it.
+        ref, sha256 = self._ref(path)
+        if ref is None:
+            return False
+        os.remove(ref)
+        target = self._object_path(sha256)
+        if os.path.exists(target) and os.stat(target).st_nlink == 1:
+            os.remove(target)
+        return True
+
+    def signed_url(self, path, expires_in):
+        payload = base64.urlsafe_b64encode(json.dumps([path, int(time.time() + expires_in)]).encode()).decode().rstrip('=')
+        return self.url_for(f"{payload}.{self._sign(payload)}")
+
+    def _sign(self, payload):
+        return hmac.new(self.url_key, payload.encode(), hashlib.sha256).hexdigest()
+
+    def verify_token(self, token):
+        # Returns the storage path for a valid, unexpired token, else None
+        payload, _, signature = token.rpartition('.')
+        if not payload or not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        try:
+            path, expires = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        except ValueError:
+            return None
+        if expires < time.time():
+            return None
+        return path
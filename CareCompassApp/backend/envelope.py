@@ -0,0 +1,161 @@
+import base64
+import datetime
+import os
+import threading
+import time
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Envelope encryption for patient data. Every patient gets its own 256-bit data
+# key. Field values are sealed with AES-GCM under that key, and the data key is
+# stored wrapped (AES-GCM under a key derived from the master key) in
+#   dataKeys/<patientId>  {'current': 'v2', 'keys': {'v1': <wrapped>, 'v2': <wrapped>}, ...}
+# A ciphertext names the key that sealed it:
+#   g2:<patientId>.<version>:<base64url(nonce | AES-GCM(flag | payload))>
+# so decrypting never needs to know which patient a document belongs to, and a
+# rotated patient keeps its old versions until the re-key worker has moved its
+# documents onto the new one. The flag byte says whether the payload was
+# zlib-compressed (see CryptoManager.compress_min_bytes). The key ID (and with it
+# the patient) and the field name are authenticated, so a value copied into
+# another field or another patient's document fails to open.
+
+ENVELOPE_TAG = 'g2:'
+NONCE_BYTES = 12
+
+class DataKeyStore:
+    # Per-patient data keys, unwrapped once and then cached for the life of the
+    # process. Keys are never deleted: a value sealed under an old version stays
+    # readable. 'db' is a callable returning the Firestore client (or None when
+    # Firestore isn't configured, in which case current() returns None and the
+    # caller falls back to Fernet). Which version is current is re-read every
+    # refresh_seconds, so a rotation by another instance is picked up.
+    def __init__(self, db, wrapping_key, collection='dataKeys', lock_stripes=64, refresh_seconds=300, clock=time.monotonic):
+        self._db = db
+        self._wrap = AESGCM(wrapping_key)
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        # Per-patient (striped) so first use of one patient doesn't wait on another's
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._keys = {}       # key ID -> AESGCM
+        self._current = {}    # patient ID -> (key ID, clock time to re-read the record)
+        self.unwrapped = 0
+        self.created = 0
+
+    @staticmethod
+    def key_id(patient_id, version):
+        return f"{patient_id}.{version}"
+
+    @staticmethod
+    def split_key_id(key_id):
+        patient_id, _, version = key_id.rpartition('.')
+        return patient_id, version
+
+    def _lock(self, patient_id):
+        return self._locks[hash(patient_id) % len(self._locks)]
+
+    def _ref(self, patient_id):
+        return self._db().collection(self.collection).document(patient_id)
+
+    def _wrap_key(self, key_id, data_key):
+        nonce = os.urandom(NONCE_BYTES)
+        return base64.b64encode(nonce + self._wrap.encrypt(nonce, data_key, key_id.encode())).decode()
+
+    def _unwrap_key(self, key_id, wrapped):
+        raw = base64.b64decode(wrapped)
+        return self._wrap.decrypt(raw[:NONCE_BYTES], raw[NONCE_BYTES:], key_id.encode())
+
+    def _load(self, patient_id, record):
+        # Caches every version in a dataKeys record; returns the current key ID
+        for version, wrapped in (record.get('keys') or {}).items():
+            key_id = self.key_id(patient_id, version)
+            if key_id not in self._keys:
+                self._keys[key_id] = AESGCM(self._unwrap_key(key_id, wrapped))
+                self.unwrapped += 1
+        current = self.key_id(patient_id, record['current'])
+        self._current[patient_id] = (current, self.clock() + self.refresh_seconds)
+        return current
+
+    def _fresh_current(self, patient_id):
+        entry = self._current.get(patient_id)
+        return entry[0] if entry is not None and entry[1] > self.clock() else None
+
+    def current(self, patient_id):
+        # (key ID, AESGCM) to seal new values for this patient with. The first
+        # call for a new patient creates its key in a transaction, so two
+        # instances racing on the same patient agree on one key.
+        key_id = self._fresh_current(patient_id)
+        if key_id is None:
+            if not self._db():
+                return None
+            with self._lock(patient_id):
+                key_id = self._fresh_current(patient_id) or self._update(patient_id, rotate=False)
+        return key_id, self._keys[key_id]
+
+    def get(self, key_id):
+        # AESGCM for a key ID read from a ciphertext header; KeyError if unknown
+        aead = self._keys.get(key_id)
+        if aead is None:
+            patient_id, _ = self.split_key_id(key_id)
+            with self._lock(patient_id):
+                if key_id not in self._keys:
+                    snapshot = self._ref(patient_id).get()
+                    if not snapshot.exists:
+                        raise KeyError(key_id)
+                    self._load(patient_id, snapshot.to_dict())
+            aead = self._keys[key_id]
+        return aead
+
+    def rotate(self, patient_id):
+        # Starts a new key version for the patient; returns its key ID. Existing
+        # values stay under the old version until the re-key worker moves them.
+        with self._lock(patient_id):
+            return self._update(patient_id, rotate=True)
+
+    def _update(self, patient_id, rotate):
+        # Caller holds the patient's lock. Reads the record in a transaction and
+        # adds a version if there is none yet (or if rotating).
+        from google.cloud.firestore import transactional
+        ref = self._ref(patient_id)
+
+        @transactional
+        def update_in_transaction(transaction):
+            snapshot = ref.get(transaction=transaction)
+            record = snapshot.to_dict() if snapshot.exists else {'keys': {}}
+            if record.get('current') is None or rotate:
+                version = f"v{len(record['keys']) + 1}"
+                record['keys'][version] = self._wrap_key(self.key_id(patient_id, version), AESGCM.generate_key(bit_length=256))
+                record['current'] = version
+                record['updatedAt'] = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+                transaction.set(ref, record)
+                self.created += 1
+            return record
+
+        record = update_in_transaction(self._db().transaction())
+        return self._load(patient_id, record)
+
+    def stats(self):
+        return {
+            "cachedKeys": len(self._keys),
+            "patients": len(self._current),
+            "unwrapped": self.unwrapped,
+            "created": self.created
+        }
+
+def _aad(key_id, field):
+    return f"{key_id}|{field or ''}".encode()
+
+def seal(key_id, aead, flag, payload, field=None):
+    nonce = os.urandom(NONCE_BYTES)
+    body = nonce + aead.encrypt(nonce, bytes([flag]) + payload, _aad(key_id, field))
+    return f"{ENVELOPE_TAG}{key_id}:{base64.urlsafe_b64encode(body).decode().rstrip('=')}"
+
+def parse(value):
+    # (key ID, sealed body) from an envelope ciphertext
+    key_id, _, body = value[len(ENVELOPE_TAG):].rpartition(':')
+    return key_id, base64.urlsafe_b64decode(body + '=' * (-len(body) % 4))
+
+def open_sealed(key_id, aead, body, field=None):
+    # (flag, payload); raises InvalidTag if the header or field doesn't match
+    plain = aead.decrypt(body[:NONCE_BYTES], body[NONCE_BYTES:], _aad(key_id, field))
+    return plain[0], plain[1:]
@@ -0,0 +1,304 @@
+import copy
+import itertools
+import threading
+import time
+
+# Minimal in-memory stand-in for the parts of the Firestore client that app.py uses.
+# It lets the real Firestore code paths run offline for benchmarks and load tests:
+#   import fake_firestore, app
+#   app.db = fake_firestore.FakeFirestore(latency=0.005)
+# 'latency' adds a simulated round trip to every read and write so Firestore-bound
+# optimizations show up in timings.
+
+_auto_ids = itertools.count(1)
+
+def split_field_path(field_path):
+    # 'a.b' -> ['a', 'b']; '`a.b`' -> ['a.b'] (backslash escapes inside backticks)
+    parts, current, quoted, chars = [], '', False, iter(field_path)
+    for char in chars:
+        if quoted and char == '\\':
+            current += next(chars, '')
+        elif char == '`':
+            quoted = not quoted
+        elif char == '.' and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        # Firestore returns a timestamp; a per-database write counter is enough here
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def path(self):
+        return '/'.join(self._path)
+
+    def collection(self, name):
+        return FakeCollectionReference(self._db, self._path + (name,))
+
+    def get(self, transaction=None, **kwargs):
+        self._db._round_trip('reads')
+        with self._db._lock:
+            return FakeSnapshot(self, copy.deepcopy(self._db._docs.get(self._path)), self._db._update_times.get(self._path))
+
+    def set(self, data, merge=False):
+        self._db._round_trip('writes')
+        self._db._write(self._path, data, merge)
+
+    def update(self, data):
+        self._db._round_trip('writes')
+        with self._db._lock:
+            if self._path not in self._db._docs:
+                raise KeyError(f"No document to update: {self.path}")
+            self._db._update(self._path, data)
+
+    def delete(self):
+        self._db._round_trip('writes')
+        with self._db._lock:
+            self._db._docs.pop(self._path, None)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), orders=(), limit=None, start_after=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        args = dict(filters=self._filters, orders=self._orders, limit=self._limit, start_after=self._start_after)
+        args.update(changes)
+        return FakeQuery(self._collection, **args)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        if isinstance(values, FakeSnapshot):
+            values = {field: self._value(values.reference._path, values.to_dict() or {}, field) for field, _ in self._orders}
+        return self._copy(start_after=values)
+
+    def _matches(self, data):
+        for field, op, value in self._filters:
+            actual = data.get(field)
+            if op == '==' and actual != value:
+                return False
+            if op == '>' and not (actual is not None and actual > value):
+                return False
+            if op == '>=' and not (actual is not None and actual >= value):
+                return False
+            if op == '<' and not (actual is not None and actual < value):
+                return False
+            if op == 'in' and actual not in value:
+                return False
+            if op == 'array_contains' and value not in (actual or []):
+                return False
+        return True
+
+    @staticmethod
+    def _value(path, data, field):
+        # '__name__' is FieldPath.document_id()
+        value = path[-1] if field == '__name__' else data.get(field)
+        return '' if value is None else value
+
+    def _sort_key(self, path, data):
+        return tuple(self._value(path, data, field) for field, _ in self._orders)
+
+    def stream(self, timeout=None, **kwargs):
+        self._collection._db._round_trip('reads')
+        db = self._collection._db
+        prefix = self._collection._path
+        with db._lock:
+            rows = [
+                (path, copy.deepcopy(data)) for path, data in db._docs.items()
+                if len(path) == len(prefix) + 1 and path[:-1] == prefix and self._matches(data)
+            ]
+            update_times = {path: db._update_times.get(path) for path, _ in rows}
+        # Like Firestore, ties are broken by document ID in the last order's direction
+        rows.sort(key=lambda row: row[0][-1], reverse=bool(self._orders) and str(self._orders[-1][1]).upper().endswith('DESCENDING'))
+        for field, direction in reversed(self._orders):
+            reverse = str(direction).upper().endswith('DESCENDING')
+            rows.sort(key=lambda row: self._value(row[0], row[1], field), reverse=reverse)
+        if self._start_after is not None:
+            cursor = tuple(self._start_after.get(field) for field, _ in self._orders) \
+                if isinstance(self._start_after, dict) else tuple(self._start_after)
+            descending = bool(self._orders) and str(self._orders[0][1]).upper().endswith('DESCENDING')
+            rows = [
+                row for row in rows
+                if (self._sort_key(*row) < cursor if descending else self._sort_key(*row) > cursor)
+            ]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for path, data in rows:
+            yield FakeSnapshot(FakeDocumentReference(db, path), data, update_times[path])
+
+    def get(self, **kwargs):
+        return list(self.stream(**kwargs))
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+        self.id = path[-1]
+        super().__init__(self)
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = f"auto{next(_auto_ids):012d}"
+        return FakeDocumentReference(self._db, self._path + (str(document_id),))
+
+
+class FakeWriteOption:
+    # Precondition from FakeFirestore.write_option(last_update_time=...)
+    def __init__(self, last_update_time=None):
+        self.last_update_time = last_update_time
+
+
+class FailedPrecondition(Exception):
+    pass
+
+
+class FakeWriteBatch:
+    MAX_WRITES = 500
+
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def _add(self, op):
+        if len(self._ops) >= self.MAX_WRITES:
+            raise ValueError("maximum 500 writes allowed per request")
+        self._ops.append(op)
+
+    def set(self, reference, data, merge=False):
+        self._add(('set', reference, data, merge))
+
+    def update(self, reference, data, option=None):
+        self._add(('update', reference, data, option))
+
+    def delete(self, reference):
+        self._add(('delete', reference, None, False))
+
+    def commit(self):
+        self._db._round_trip('writes')
+        with self._db._lock:
+            # All or nothing, like Firestore: check every update first
+            for op, reference, _, option in self._ops:
+                if op != 'update':
+                    continue
+                if reference._path not in self._db._docs:
+                    raise KeyError(f"No document to update: {reference.path}")
+                if option is not None and option.last_update_time != self._db._update_times.get(reference._path):
+                    raise FailedPrecondition(f"{reference.path} was changed since it was read")
+            for op, reference, data, merge in self._ops:
+                if op == 'delete':
+                    self._db._docs.pop(reference._path, None)
+                elif op == 'update':
+                    self._db._update(reference._path, data)
+                else:
+                    self._db._write(reference._path, data, merge=merge)
+        self._ops = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    # Implements the private hooks that google.cloud.firestore.transactional calls
+    _read_only = False
+    _max_attempts = 1
+    _id = b'fake-transaction'
+
+    def _clean_up(self):
+        self._ops = []
+
+    def _begin(self, retry_id=None):
+        pass
+
+    def _commit(self):
+        self.commit()
+
+    def _rollback(self):
+        self._ops = []
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._docs = {}
+        self._lock = threading.RLock()
+        self._update_times = {}
+        self._clock = itertools.count(1)
+        self.counters = {'reads': 0, 'writes': 0}
+
+    def _round_trip(self, kind):
+        with self._lock:
+            self.counters[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _write(self, path, data, merge):
+        with self._lock:
+            if merge and path in self._docs:
+                self._docs[path].update(copy.deepcopy(data))
+            else:
+                self._docs[path] = copy.deepcopy(data)
+            self._update_times[path] = next(self._clock)
+
+    def _update(self, path, data):
+        # update() keys are field paths: dots reach into maps, and backtick-quoted
+        # segments are taken literally
+        with self._lock:
+            doc = self._docs[path]
+            for field_path, value in data.items():
+                *parents, name = split_field_path(field_path)
+                target = doc
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                target[name] = copy.deepcopy(value)
+            self._update_times[path] = next(self._clock)
+
+    def collection(self, name):
+        return FakeCollectionReference(self, (name,))
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def write_option(self, last_update_time=None):
+        return FakeWriteOption(last_update_time)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters = {'reads': 0, 'writes': 0}
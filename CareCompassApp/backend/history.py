@@ -0,0 +1,113 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from prompts import HISTORY_SUMMARY_PROMPT_TEMPLATE
+
+log = logging.getLogger(__name__)
+
+def import_genai():
+    import google.generativeai as genai
+    return genai
+
+def estimate_tokens(text):
+    # Rough count (about 4 characters per token for English). Good enough for
+    # budgeting; the model bills the real count.
+    return len(text or '') // 4 + 1
+
+def to_model_turn(message):
+    role = "user" if message.get('sender') == 'user' else "model"
+    return {"role": role, "parts": [{"text": message.get('text', '')}]}
+
+class GeminiSummarizer:
+    # client() returns the configured google.generativeai module
+    def __init__(self, model_name, client=None):
+        self.model_name = model_name
+        self.client = client or import_genai
+
+    def __call__(self, previous_summary, messages):
+        genai = self.client()
+        transcript = "\n".join(
+            f"{'User' if m.get('sender') == 'user' else 'Assistant'}: {m.get('text', '')}" for m in messages
+        )
+        prompt = HISTORY_SUMMARY_PROMPT_TEMPLATE.format(
+            summary=previous_summary or "(none yet)",
+            transcript=transcript
+        )
+        return genai.GenerativeModel(model_name=self.model_name).generate_content(prompt).text.strip()
+
+class HistoryManager:
+    # Keeps the history sent to the model within a token budget. When the recent
+    # turns no longer fit, the oldest ones are folded into a rolling digest (a short
+    # summary plus how many messages it covers) that is stored beside the chat.
+    # Trimming goes down to target_ratio of the budget, so the digest is only
+    # updated every few turns rather than on every request.
+    #
+    # Folding calls the model, so it runs on the executor and never delays the
+    # request that triggers it: that request still gets every message the digest
+    # doesn't cover yet, and later ones get the shorter history once save() has
+    # stored the new digest. One fold per key (chat) runs at a time.
+    def __init__(self, summarize, token_budget=6000, target_ratio=0.75, executor=None):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.target_ratio = target_ratio
+        self.executor = executor or ThreadPoolExecutor(max_workers=2, thread_name_prefix='history-digest')
+        self._lock = threading.Lock()
+        self._folding = set()
+        self.summaries = 0
+        self.failures = 0
+
+    def build(self, messages, digest=None, key=None, save=None):
+        # messages: chronological messages not yet covered by the digest.
+        # Returns the model history; save(new digest) is called in the background
+        # when the messages are over budget.
+        summary = digest.get('summary') if digest else None
+        drop = self._overflow(messages)
+        if drop and save:
+            self._fold_later(key, messages[:drop], digest, save)
+
+        history = []
+        if summary:
+            history.append({"role": "user", "parts": [{"text": f"Summary of our earlier conversation:\n{summary}"}]})
+            history.append({"role": "model", "parts": [{"text": "Thanks, I have that context."}]})
+        history.extend(to_model_turn(m) for m in messages)
+        return history
+
+    def fold(self, messages, digest=None):
+        # Summarizes messages (the oldest ones the digest doesn't cover) into a new digest
+        summary = self.summarize(digest.get('summary') if digest else None, messages)
+        covered = digest.get('covered', 0) if digest else 0
+        self.summaries += 1
+        return {"summary": summary, "covered": covered + len(messages)}
+
+    def _overflow(self, messages):
+        # How many of the oldest messages to fold to get back under target
+        tokens = [estimate_tokens(m.get('text')) for m in messages]
+        total = sum(tokens)
+        if total <= self.token_budget:
+            return 0
+        target = self.token_budget * self.target_ratio
+        drop = 0
+        while drop < len(messages) and total > target:
+            total -= tokens[drop]
+            drop += 1
+        return drop
+
+    def _fold_later(self, key, messages, digest, save):
+        with self._lock:
+            if key in self._folding:
+                return
+            self._folding.add(key)
+
+        def run():
+            try:
+                save(self.fold(messages, digest))
+            except Exception as e:
+                # Nothing is lost: the messages stay outside the digest and the
+                # next request over budget tries again
+                self.failures += 1
+                log.warning(f"History summary failed: {e}")
+            finally:
+                with self._lock:
+                    self._folding.discard(key)
+
+        self.executor.submit(run)
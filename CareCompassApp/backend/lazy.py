@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Deferred initialization for the heavy clients (Firebase, Gemini, the memory
+# store). Importing app.py only records how to build them; each one is built the
+# first time a request needs it, or earlier by warm_up() from /ready or at startup.
+
+class Lazy:
+    # A value built on first use. get() runs the factory once, however many
+    # threads ask at the same time; later calls return the stored value without
+    # taking the lock. A factory that raises isn't retried: get() returns None,
+    # the same as "not configured", and the error is kept for status().
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._done = False
+        self._value = None
+        self.error = None
+        self.seconds = None
+
+    def get(self):
+        if not self._done:
+            with self._lock:
+                if not self._done:
+                    started = time.perf_counter()
+                    try:
+                        self._value = self.factory()
+                    except Exception as e:
+                        log.error(f"Initializing {self.name} failed: {e}")
+                        self.error = str(e)
+                    self.seconds = time.perf_counter() - started
+                    self._done = True
+        return self._value
+
+    @property
+    def done(self):
+        return self._done
+
+    def status(self):
+        return {
+            "ready": self._done and self.error is None,
+            "configured": self._value is not None if self._done else None,
+            "initMs": round(self.seconds * 1000, 2) if self.seconds is not None else None,
+            "error": self.error
+        }
+
+class LazyProxy:
+    # Stands in for a lazily built object so module globals like app.db keep
+    # working: attribute access builds it, and bool() is False while resolve()
+    # returns None (not configured, or initialization failed).
+    def __init__(self, resolve):
+        self._resolve = resolve
+
+    def __getattr__(self, name):
+        target = self._resolve()
+        if target is None:
+            raise AttributeError(f"{name}: not configured")
+        return getattr(target, name)
+
+    def __bool__(self):
+        return self._resolve() is not None
+
+class Warmup:
+    # Runs the given steps (callables, usually Lazy.get) once, in order, on a
+    # background thread. start() is safe to call on every /ready request.
+    def __init__(self, steps):
+        self.steps = steps
+        self._lock = threading.Lock()
+        self._thread = None
+        self.seconds = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        started = time.perf_counter()
+        for step in self.steps:
+            try:
+                step()
+            except Exception as e:
+                log.warning(f"Warmup step failed: {e}")
+        self.seconds = time.perf_counter() - started
+        log.info(f"Warmup finished in {self.seconds * 1000:.0f} ms")
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import time
+
+# Load test for concurrent /api/chat streams against a fake slow-streaming model,
+# comparing the threaded gunicorn setup with the asyncio (uvicorn + asgi.py) setup.
+#
+#   python loadtest.py --streams 50
+#
+# gunicorn isn't a runtime dependency any more; install it locally (pip install
+# gunicorn) to include the threaded baseline, or pass --server uvicorn-asgi.
+#
+# The driver starts each server as a subprocess on this module, which (when
+# imported by gunicorn/uvicorn) swaps in fake_firestore and FakeSlowModel so
+# nothing leaves the machine. While the chat streams run, GET /api/patients is
+# probed continuously to show whether non-chat endpoints get starved.
+
+CHUNKS = int(os.environ.get('LOADTEST_CHUNKS', 20))
+CHUNK_DELAY = float(os.environ.get('LOADTEST_CHUNK_DELAY', 0.1))
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeSlowModel:
+    # Stands in for genai.GenerativeModel: CHUNKS chunks, CHUNK_DELAY seconds apart
+    def __init__(self, model_name=None, system_instruction=None, **kwargs):
+        pass
+
+    def start_chat(self, history=None):
+        return self
+
+    def send_message(self, parts, stream=True):
+        def chunks():
+            for i in range(CHUNKS):
+                time.sleep(CHUNK_DELAY)
+                yield FakeChunk(f"chunk {i} ")
+        return chunks()
+
+    async def send_message_async(self, parts, stream=True):
+        async def chunks():
+            for i in range(CHUNKS):
+                await asyncio.sleep(CHUNK_DELAY)
+                yield FakeChunk(f"chunk {i} ")
+        return chunks()
+
+if __name__ != '__main__':
+    # Imported by the server under test
+    import fake_firestore
+    import app as backend
+    backend.db = fake_firestore.FakeFirestore()
+    backend.model_pool.factory = FakeSlowModel
+    patient = backend.crypto.encrypt_dict({"id": "load-patient", "userId": "load-user", "name": "Load Test"})
+    backend.db.collection('patients').document('load-patient').set(patient)
+    app = backend.app
+    from asgi import application
+
+def make_token():
+    from benchmark import make_dev_token
+    return make_dev_token('load-user')
+
+async def http_request(port, method, path, token, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    request = (
+        f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {token}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    ).encode() + body
+    writer.write(request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct))] if samples else float('nan')
+
+async def run_load(port, streams, token):
+    import json
+    chat_body = json.dumps({"prompt": "Explain my medications", "context": "load test"}).encode()
+    stream_times = []
+    probe_times = []
+    done = asyncio.Event()
+
+    async def one_stream(i):
+        start = time.perf_counter()
+        # Distinct prompts so the response cache can't short-circuit the model
+        body = chat_body.replace(b'medications', f'medications {i}'.encode())
+        await http_request(port, 'POST', '/api/chat', token, body)
+        stream_times.append(time.perf_counter() - start)
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await http_request(port, 'GET', '/api/patients?fields=id,name', token)
+            probe_times.append(time.perf_counter() - start)
+            await asyncio.sleep(0.05)
+
+    prober = asyncio.ensure_future(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(one_stream(i) for i in range(streams)))
+    wall = time.perf_counter() - start
+    done.set()
+    await prober
+    return wall, stream_times, probe_times
+
+def wait_for_port(port, timeout=30):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+SERVERS = {
+    # Same settings as the previous Dockerfile CMD
+    'gunicorn-threads': ['gunicorn', '--bind', '127.0.0.1:{port}', '--workers', '1', '--threads', '8', '--timeout', '0', 'loadtest:app'],
+    'uvicorn-asgi': ['uvicorn', '--host', '127.0.0.1', '--port', '{port}', '--workers', '1', '--log-level', 'warning', 'loadtest:application'],
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent chat stream load test")
+    parser.add_argument('--streams', type=int, default=50, help="Concurrent /api/chat streams")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--server', choices=sorted(SERVERS), action='append', help="Server(s) to test (default: all)")
+    args = parser.parse_args()
+
+    token = make_token()
+    expected = CHUNKS * CHUNK_DELAY
+    print(f"{args.streams} concurrent chat streams, each ~{expected:.1f}s of fake model output")
+    for name in args.server or sorted(SERVERS):
+        command = [part.format(port=args.port) for part in SERVERS[name]]
+        server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_for_port(args.port):
+                print(f"  {name}: server did not start")
+                continue
+            wall, stream_times, probe_times = asyncio.run(run_load(args.port, args.streams, token))
+            print(f"  {name:<18} wall {wall:6.2f}s   stream p50 {percentile(stream_times, 0.5):6.2f}s "
+                  f"p99 {percentile(stream_times, 0.99):6.2f}s   GET /api/patients p50 {percentile(probe_times, 0.5) * 1000:7.1f}ms "
+                  f"p99 {percentile(probe_times, 0.99) * 1000:7.1f}ms ({len(probe_times)} probes)")
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == '__main__':
+    main()
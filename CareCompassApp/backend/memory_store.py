@@ -0,0 +1,367 @@
+import base64
+import bisect
+import json
+import logging
+import os
+import threading
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+log = logging.getLogger(__name__)
+
+def sort_key(value):
+    # createdAt is an ISO string from the frontend; anything else sorts as text
+    return '' if value is None else str(value)
+
+def copy_doc(doc):
+    # Shallow copy plus copies of top-level lists (messages, doctors, ...)
+    return {k: (list(v) if isinstance(v, list) else v) for k, v in doc.items()}
+
+class MemoryStore:
+    # Storage backend used when Firebase isn't configured (local dev, CI, load
+    # tests). Documents are plain dicts, as they were in the old in_memory_store,
+    # and every operation goes through a single lock. Stored documents are never
+    # modified in place: writes copy the incoming dict and replace the stored one,
+    # so reads hand out the stored dicts without copying. Callers must treat them
+    # as read-only. Two indexes are kept:
+    #   userId -> sorted patient IDs           (patients_for_user is O(result))
+    #   patient -> chats sorted by createdAt   (no sort per request)
+    #   patient -> sorted file IDs
+    # The list methods take a cursor (the last key of the previous page) and a
+    # limit, and find their starting point by bisection.
+    #
+    # With a path, every write is also appended to <path>.log and the state is
+    # compacted into <path>.snapshot every snapshot_interval seconds. Both are
+    # read back at startup. Files are AES-GCM encrypted with 'key', like the blob
+    # cache, since they hold patient data in the clear otherwise.
+    def __init__(self, path=None, key=None, snapshot_interval=60):
+        self._lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+        self._patients = {}       # patient_id -> patient
+        self._by_user = {}        # userId -> sorted [patient_id]
+        self._chats = {}          # patient_id -> {chat_id: chat}
+        self._chat_order = {}     # patient_id -> sorted [(createdAt, chat_id)]
+        self._digests = {}        # patient_id -> {chat_id: rolling history digest}
+        self._files = {}          # patient_id -> {file_id: file metadata}
+        self._file_ids = {}       # patient_id -> sorted [file_id]
+        self.path = path
+        self._aead = AESGCM(key) if path else None
+        self._log_file = None
+        self._dirty = False
+        self._stop = threading.Event()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._recover()
+            self._log_file = open(path + '.log', 'a', encoding='utf-8')
+            if snapshot_interval:
+                threading.Thread(target=self._snapshot_loop, args=(snapshot_interval,), name='memory-store-snapshot', daemon=True).start()
+
+    # Patients
+
+    def get_patient(self, patient_id):
+        with self._lock:
+            return self._patients.get(patient_id)
+
+    def owner(self, patient_id):
+        with self._lock:
+            patient = self._patients.get(patient_id)
+            return patient.get('userId') if patient is not None else None
+
+    def patients_for_user(self, user_id, after=None, limit=None):
+        # Ordered by patient ID; 'after' is the last ID of the previous page
+        with self._lock:
+            ids = self._by_user.get(user_id, [])
+            start = bisect.bisect_right(ids, after) if after is not None else 0
+            end = start + limit if limit is not None else len(ids)
+            return [self._patients[pid] for pid in ids[start:end]]
+
+    def save_patient(self, patient):
+        # Replaces the patient document. Chats are stored separately and kept
+        # (like the Firestore subcollection), unless the document carries a
+        # 'chats' dict, which replaces them.
+        patient = copy_doc(patient)
+        chats = patient.pop('chats', None)
+        with self._lock:
+            self._put_patient(patient)
+            self._write_log('patient', patient)
+            if isinstance(chats, dict):
+                self._drop_chats(patient['id'])
+                self._write_log('drop_chats', patient['id'])
+                for chat in chats.values():
+                    self._put_chat(patient['id'], copy_doc(chat))
+                    self._write_log('chat', patient['id'], chat)
+
+    def update_patient(self, patient_id, fields):
+        # Merges top-level fields into an existing patient; False if there is none
+        with self._lock:
+            patient = self._patients.get(patient_id)
+            if patient is None:
+                return False
+            patient = dict(patient, **fields)
+            self._put_patient(patient)
+            self._write_log('patient', patient)
+            return True
+
+    def _put_patient(self, patient):
+        patient_id = patient['id']
+        old = self._patients.get(patient_id)
+        if old is not None and old.get('userId') != patient.get('userId'):
+            self._index_remove(self._by_user, old.get('userId'), patient_id)
+        if old is None or old.get('userId') != patient.get('userId'):
+            self._index_add(self._by_user, patient.get('userId'), patient_id)
+        self._patients[patient_id] = patient
+
+    # Chats
+
+    def get_chat(self, patient_id, chat_id):
+        with self._lock:
+            return self._chats.get(patient_id, {}).get(chat_id)
+
+    def chats_for_patient(self, patient_id, before=None, limit=None):
+        # Newest first, the order get_patient_chats has always returned.
+        # 'before' is the (createdAt, chat ID) of the last chat on the previous page.
+        with self._lock:
+            chats = self._chats.get(patient_id, {})
+            order = self._chat_order.get(patient_id, [])
+            end = bisect.bisect_left(order, (sort_key(before[0]), before[1])) if before is not None else len(order)
+            start = max(0, end - limit) if limit is not None else 0
+            return [chats[chat_id] for _, chat_id in reversed(order[start:end])]
+
+    def save_chat(self, patient_id, chat):
+        chat = copy_doc(chat)
+        with self._lock:
+            self._put_chat(patient_id, chat)
+            self._write_log('chat', patient_id, chat)
+
+    def append_messages(self, patient_id, chat_id, meta, messages):
+        # Returns the new message count
+        with self._lock:
+            chat = self._chats.get(patient_id, {}).get(chat_id) or {'id': chat_id}
+            start = len(chat.get('messages') or [])
+            self._apply_append(patient_id, chat, meta, start, messages)
+            # The start offset makes replaying this entry idempotent
+            self._write_log('append', patient_id, chat_id, meta, start, messages)
+            return start + len(messages)
+
+    def _apply_append(self, patient_id, chat, meta, start, messages):
+        chat = dict(chat, **meta)
+        chat['messages'] = (chat.get('messages') or [])[:start] + list(messages)
+        self._put_chat(patient_id, chat)
+
+    # Digests are kept beside the chat, like the Firestore digest subcollection,
+    # so they never go out with the chat itself
+
+    def get_digest(self, patient_id, chat_id):
+        with self._lock:
+            return self._digests.get(patient_id, {}).get(chat_id)
+
+    def set_digest(self, patient_id, chat_id, digest):
+        with self._lock:
+            if chat_id in self._chats.get(patient_id, {}):
+                self._digests.setdefault(patient_id, {})[chat_id] = digest
+                self._write_log('digest', patient_id, chat_id, digest)
+
+    def _put_chat(self, patient_id, chat):
+        chats = self._chats.setdefault(patient_id, {})
+        order = self._chat_order.setdefault(patient_id, [])
+        old = chats.get(chat['id'])
+        if old is not None:
+            entry = (sort_key(old.get('createdAt')), chat['id'])
+            index = bisect.bisect_left(order, entry)
+            if index < len(order) and order[index] == entry:
+                order.pop(index)
+        bisect.insort(order, (sort_key(chat.get('createdAt')), chat['id']))
+        chats[chat['id']] = chat
+
+    def _drop_chats(self, patient_id):
+        self._chats.pop(patient_id, None)
+        self._chat_order.pop(patient_id, None)
+        self._digests.pop(patient_id, None)
+
+    # File metadata (the bytes live in the blob store)
+
+    def list_files(self, patient_id, after=None, limit=None):
+        # Ordered by file ID; 'after' is the last ID of the previous page
+        with self._lock:
+            files = self._files.get(patient_id, {})
+            ids = self._file_ids.get(patient_id, [])
+            start = bisect.bisect_right(ids, after) if after is not None else 0
+            end = start + limit if limit is not None else len(ids)
+            return [files[file_id] for file_id in ids[start:end]]
+
+    def get_file(self, patient_id, file_id):
+        with self._lock:
+            return self._files.get(patient_id, {}).get(file_id)
+
+    def find_file(self, patient_id, content_key):
+        with self._lock:
+            for file_data in self._files.get(patient_id, {}).values():
+                if file_data.get('contentKey') == content_key:
+                    return file_data
+            return None
+
+    def save_file(self, patient_id, file_data):
+        file_data = dict(file_data)
+        with self._lock:
+            self._put_file(patient_id, file_data)
+            self._write_log('file', patient_id, file_data)
+
+    def delete_file(self, patient_id, file_id):
+        with self._lock:
+            if self._drop_file(patient_id, file_id):
+                self._write_log('delete_file', patient_id, file_id)
+
+    def _put_file(self, patient_id, file_data):
+        self._files.setdefault(patient_id, {})[file_data['id']] = file_data
+        self._index_add(self._file_ids, patient_id, file_data['id'])
+
+    def _drop_file(self, patient_id, file_id):
+        if self._files.get(patient_id, {}).pop(file_id, None) is None:
+            return False
+        self._index_remove(self._file_ids, patient_id, file_id)
+        return True
+
+    def import_patient(self, patient, chats):
+        # Patient plus an iterable of chats, added to (not replacing) existing
+        # chats. The lock is taken per document: 'chats' may be reading a request
+        # body.
+        self.save_patient(patient)
+        count = 0
+        for chat in chats:
+            self.save_chat(patient['id'], chat)
+            count += 1
+        return count
+
+    @staticmethod
+    def _index_add(index, key, value):
+        values = index.setdefault(key, [])
+        position = bisect.bisect_left(values, value)
+        if position == len(values) or values[position] != value:
+            values.insert(position, value)
+
+    @staticmethod
+    def _index_remove(index, key, value):
+        values = index.get(key, [])
+        position = bisect.bisect_left(values, value)
+        if position < len(values) and values[position] == value:
+            values.pop(position)
+        if not values:
+            index.pop(key, None)
+
+    # Persistence
+
+    def _encrypt(self, data):
+        nonce = os.urandom(12)
+        return nonce + self._aead.encrypt(nonce, data, None)
+
+    def _decrypt(self, data):
+        return self._aead.decrypt(data[:12], data[12:], None)
+
+    def _write_log(self, op, *args):
+        # Caller holds the lock, so log order matches apply order
+        if self._log_file is None:
+            return
+        line = base64.b64encode(self._encrypt(json.dumps([op, *args]).encode())).decode()
+        self._log_file.write(line + '\n')
+        self._log_file.flush()
+        self._dirty = True
+
+    def _replay(self, op, *args):
+        if op == 'patient':
+            self._put_patient(args[0])
+        elif op == 'chat':
+            self._put_chat(args[0], args[1])
+        elif op == 'drop_chats':
+            self._drop_chats(args[0])
+        elif op == 'append':
+            patient_id, chat_id, meta, start, messages = args
+            chat = self._chats.get(patient_id, {}).get(chat_id) or {'id': chat_id}
+            self._apply_append(patient_id, chat, meta, start, messages)
+        elif op == 'file':
+            self._put_file(args[0], args[1])
+        elif op == 'delete_file':
+            self._drop_file(args[0], args[1])
+        elif op == 'digest':
+            self._digests.setdefault(args[0], {})[args[1]] = args[2]
+
+    def _recover(self):
+        snapshot = self.path + '.snapshot'
+        if os.path.exists(snapshot):
+            with open(snapshot, 'rb') as f:
+                state = json.loads(self._decrypt(f.read()))
+            for patient in state['patients']:
+                self._put_patient(patient)
+            for patient_id, chats in state['chats'].items():
+                for chat in chats:
+                    self._put_chat(patient_id, chat)
+            for patient_id, files in state.get('files', {}).items():
+                for file_data in files:
+                    self._put_file(patient_id, file_data)
+            self._digests = state.get('digests', {})
+        # .log.old is left behind if the process stopped mid-snapshot; entries are
+        # idempotent, so replaying ones already in the snapshot is harmless
+        replayed = 0
+        for name in (self.path + '.log.old', self.path + '.log'):
+            if not os.path.exists(name):
+                continue
+            with open(name, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._replay(*json.loads(self._decrypt(base64.b64decode(line))))
+                        replayed += 1
+                    except Exception as e:
+                        # A torn final line from a crash mid-write
+                        log.warning(f"Skipping unreadable memory store log entry in {name}: {e}")
+        log.info(f"Memory store loaded {len(self._patients)} patients, replayed {replayed} log entries")
+
+    def snapshot(self):
+        # Serialize under the lock and start a fresh log; the slow disk write
+        # happens outside it
+        if self.path is None:
+            return False
+        with self._snapshot_lock:
+            self._write_snapshot()
+        return True
+
+    def _write_snapshot(self):
+        with self._lock:
+            state = json.dumps({
+                "patients": list(self._patients.values()),
+                "chats": {pid: list(chats.values()) for pid, chats in self._chats.items()},
+                "files": {pid: list(files.values()) for pid, files in self._files.items()},
+                "digests": self._digests
+            }).encode()
+            self._log_file.close()
+            os.replace(self.path + '.log', self.path + '.log.old')
+            self._log_file = open(self.path + '.log', 'a', encoding='utf-8')
+            self._dirty = False
+
+        tmp = self.path + '.snapshot.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self._encrypt(state))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path + '.snapshot')
+        os.remove(self.path + '.log.old')
+
+    def _snapshot_loop(self, interval):
+        while not self._stop.wait(interval):
+            if self._dirty:
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    log.error(f"Memory store snapshot failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self.path and self._dirty:
+            self.snapshot()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "patients": len(self._patients),
+                "users": len(self._by_user),
+                "chats": sum(len(chats) for chats in self._chats.values()),
+                "files": sum(len(files) for files in self._files.values()),
+                "persistent": self.path is not None
+            }
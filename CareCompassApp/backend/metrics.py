@@ -0,0 +1,320 @@
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+# Request tracing, latency histograms and structured logging.
+#
+# Each request gets a RequestTrace (request ID, endpoint, per-phase timings).
+# Code on the hot path wraps its Firestore / crypto / storage / LLM work in
+# phase('firestore') etc.; phases nest and each one only counts its own time, so
+# decrypting inside a Firestore stream loop isn't billed to Firestore. When the
+# request finishes its total and phase times go into histograms served by
+# /metrics, and a one-line JSON summary is logged for a sample of requests (and
+# always for errors and slow requests).
+#
+# Log records go through a bounded queue to a background thread, so logging
+# never blocks the request thread on stdout. If the queue is full the record is
+# dropped and counted.
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PHASES = ('firestore', 'crypto', 'storage', 'llm')
+
+_current_trace = contextvars.ContextVar('carecompass_trace', default=None)
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    # Counters and histograms keyed by (name, sorted label items). Rendered in the
+    # Prometheus text format by /metrics.
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self, gauges=None):
+        # gauges: optional [(name, labels, value)] sampled at scrape time (cache sizes, ...)
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+            histograms = [(key, list(h.counts), h.sum, h.count, h.buckets) for key, h in histograms]
+
+        described = set()
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), counts, total, count, buckets in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for name, labels, value in gauges or []:
+            header(name, 'gauge')
+            lines.append(f"{name}{format_labels(tuple(sorted((labels or {}).items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+class RequestTrace:
+    def __init__(self, request_id, endpoint, method, sampled):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.method = method
+        self.sampled = sampled
+        self.status = None
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.calls = {}
+        self._stack = []
+        self._token = None
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.phases[outer[0]] = self.phases.get(outer[0], 0.0) + now - outer[1]
+        self._stack.append([name, now])
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def exit(self):
+        now = time.perf_counter()
+        name, started = self._stack.pop()
+        self.phases[name] = self.phases.get(name, 0.0) + now - started
+        if self._stack:
+            # The outer phase resumes from here
+            self._stack[-1][1] = now
+
+def current_trace():
+    return _current_trace.get()
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+@contextmanager
+def phase(name):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    trace.enter(name)
+    try:
+        yield
+    finally:
+        trace.exit()
+
+def timed_iter(name, iterable):
+    # For lazy results (Firestore streams, model streams): times each next() call
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def instrument(obj, name, methods):
+    # Wraps methods of one object so every call is timed as phase 'name'
+    for method_name in methods:
+        method = getattr(obj, method_name)
+
+        def wrapper(*args, _method=method, **kwargs):
+            with phase(name):
+                return _method(*args, **kwargs)
+
+        setattr(obj, method_name, wraps(method)(wrapper))
+    return obj
+
+class Instrumentation:
+    def __init__(self, registry=None, sample_rate=0.1, slow_seconds=1.0, logger=None):
+        self.registry = registry or MetricsRegistry()
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.log = logger or logging.getLogger('carecompass.requests')
+        self.registry.describe('carecompass_requests_total', "Requests by endpoint, method and status.")
+        self.registry.describe('carecompass_request_seconds', "Request latency by endpoint, including streamed bodies.")
+        self.registry.describe('carecompass_phase_seconds', "Time spent per request in each phase (firestore, crypto, storage, llm).")
+
+    def start(self, endpoint, method, request_id=None):
+        if not request_id or not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        trace = RequestTrace(request_id, endpoint or 'unknown', method, random.random() < self.sample_rate)
+        trace._token = _current_trace.set(trace)
+        return trace
+
+    def finish(self, trace, status=None):
+        if trace._token is None:
+            return
+        try:
+            _current_trace.reset(trace._token)
+        except ValueError:
+            # Finished from a different context (e.g. a streamed body); nothing to reset
+            _current_trace.set(None)
+        trace._token = None
+        duration = time.perf_counter() - trace.started
+        status = status if status is not None else trace.status
+        endpoint = {'endpoint': trace.endpoint}
+
+        self.registry.inc('carecompass_requests_total', {'endpoint': trace.endpoint, 'method': trace.method, 'status': str(status)})
+        self.registry.observe('carecompass_request_seconds', duration, endpoint)
+        for name, seconds in trace.phases.items():
+            self.registry.observe('carecompass_phase_seconds', seconds, {'endpoint': trace.endpoint, 'phase': name})
+
+        slow = duration >= self.slow_seconds
+        failed = status is None or status >= 500
+        if trace.sampled or slow or failed:
+            level = logging.WARNING if slow or failed else logging.INFO
+            self.log.log(level, "request", extra={'fields': {
+                'requestId': trace.request_id,
+                'endpoint': trace.endpoint,
+                'method': trace.method,
+                'status': status,
+                'ms': round(duration * 1000, 2),
+                'phasesMs': {k: round(v * 1000, 2) for k, v in trace.phases.items()},
+                'calls': trace.calls,
+                'sampled': trace.sampled
+            }})
+
+    def init_app(self, app):
+        # Flask hooks. teardown_request runs after a streamed body has been fully
+        # sent, so streamed responses are timed end to end.
+        from flask import request
+
+        @app.before_request
+        def start_trace():
+            request.environ['carecompass.trace'] = self.start(request.endpoint, request.method, request.headers.get('X-Request-ID'))
+
+        @app.after_request
+        def tag_response(response):
+            trace = request.environ.get('carecompass.trace')
+            if trace is not None:
+                trace.status = response.status_code
+                response.headers['X-Request-ID'] = trace.request_id
+            return response
+
+        @app.teardown_request
+        def finish_trace(error=None):
+            trace = request.environ.pop('carecompass.trace', None)
+            if trace is not None:
+                self.finish(trace, 500 if error is not None else None)
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; 'severity' and 'message' are the keys Cloud
+    # Logging picks up from stdout.
+    def format(self, record):
+        entry = {
+            'severity': record.levelname,
+            'time': round(record.created, 3),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['requestId'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        return json.dumps(entry, default=str)
+
+class RequestContextFilter(logging.Filter):
+    # Runs on the request thread: tags records with the request ID and drops
+    # DEBUG/INFO records from requests that weren't sampled.
+    def filter(self, record):
+        trace = _current_trace.get()
+        if trace is None:
+            return True
+        record.request_id = trace.request_id
+        return trace.sampled or record.levelno >= logging.WARNING
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Never waits on a full queue: the record is dropped and counted instead
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_log_handler = None
+
+def setup_logging(level='INFO', queue_size=10000, stream=None):
+    # Installs the buffered JSON handler on the root logger (once per process)
+    global _log_handler
+    if _log_handler is not None:
+        return _log_handler
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(RequestContextFilter())
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    _log_handler = handler
+    return handler
+
+def dropped_log_records():
+    return _log_handler.dropped if _log_handler else 0
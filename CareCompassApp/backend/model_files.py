@@ -0,0 +1,122 @@
+import io
+import logging
+import threading
+import uuid
+from concurrent.futures import Future
+from utils import TTLCache
+
+log = logging.getLogger(__name__)
+
+def import_genai():
+    import google.generativeai as genai
+    return genai
+
+class GeminiFileProvider:
+    # Uploads through the Gemini Files API. Uploaded files expire on the provider
+    # side after 48 hours, so registry entries must expire before that.
+    # client() returns the configured google.generativeai module.
+    def __init__(self, client=None):
+        self.client = client or import_genai
+
+    def upload(self, content, mime_type, display_name):
+        uploaded = self.client().upload_file(io.BytesIO(content), mime_type=mime_type, display_name=display_name)
+        return {"name": uploaded.name, "uri": uploaded.uri}
+
+    def delete(self, handle):
+        self.client().delete_file(handle['name'])
+
+class LocalFileProvider:
+    # Offline stand-in for the provider Files API: keeps bytes in memory and hands
+    # out local:// URIs. Counts uploads so reuse can be checked without network.
+    def __init__(self):
+        self.files = {}
+        self.uploads = 0
+        self._lock = threading.Lock()
+
+    def upload(self, content, mime_type, display_name):
+        name = f"files/{uuid.uuid4().hex}"
+        with self._lock:
+            self.files[name] = (bytes(content), mime_type)
+            self.uploads += 1
+        return {"name": name, "uri": f"local://{name}"}
+
+    def delete(self, handle):
+        with self._lock:
+            self.files.pop(handle['name'], None)
+
+class ModelFileRegistry:
+    # (patient, file, model) -> provider file handle. A patient file is uploaded to
+    # the model provider once and later turns refer to it by URI instead of
+    # inlining the base64 bytes in every request.
+    #
+    # The first caller for a key loads and uploads the file outside the lock;
+    # callers for the same key that arrive meanwhile wait on its future, and
+    # callers for other keys aren't held up at all.
+    def __init__(self, provider, ttl=46 * 3600, max_size=2048):
+        self.provider = provider
+        self._handles = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> Future of the handle being uploaded
+        self.uploads = 0
+
+    def get_part(self, patient_id, file_id, model_name, load_file):
+        # load_file() -> (bytes, mime_type); only called when there is no handle yet
+        key = (patient_id, file_id, model_name)
+        handle = self._handles.get(key)
+        if handle is None:
+            with self._lock:
+                handle = self._handles.get(key)
+                future = self._in_flight.get(key)
+                owner = handle is None and future is None
+                if owner:
+                    future = self._in_flight[key] = Future()
+            if handle is None:
+                handle = self._upload(key, future, load_file) if owner else future.result()
+        return {"file_data": {"mime_type": handle['mime_type'], "file_uri": handle['uri']}}
+
+    def _upload(self, key, future, load_file):
+        patient_id, file_id, _ = key
+        try:
+            content, mime_type = load_file()
+            handle = self.provider.upload(content, mime_type, display_name=f"{patient_id}/{file_id}")
+            handle['mime_type'] = mime_type
+        except Exception as e:
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            # Not cached if the file was invalidated while it was uploading
+            current = self._in_flight.get(key) is future
+            if current:
+                del self._in_flight[key]
+                self._handles.put(key, handle)
+                self.uploads += 1
+        future.set_result(handle)
+        if not current:
+            self._delete(handle)
+        return handle
+
+    def _delete(self, handle):
+        try:
+            self.provider.delete(handle)
+        except Exception as e:
+            log.warning(f"Could not delete provider file {handle.get('name')}: {e}")
+
+    def invalidate(self, patient_id, file_id):
+        # Drops handles for every model and deletes them from the provider (best effort)
+        with self._lock:
+            for key in [k for k in self._in_flight if k[0] == patient_id and k[1] == file_id]:
+                del self._in_flight[key]
+        keys = [k for k in self._handles.keys() if k[0] == patient_id and k[1] == file_id]
+        for key in keys:
+            handle = self._handles.get(key)
+            self._handles.invalidate(key)
+            if handle:
+                self._delete(handle)
+
+    def stats(self):
+        stats = self._handles.stats()
+        stats['uploads'] = self.uploads
+        return stats
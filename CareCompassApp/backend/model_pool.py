@@ -0,0 +1,66 @@
+import hashlib
+import logging
+import threading
+from utils import TTLCache
+
+log = logging.getLogger(__name__)
+
+class ModelPool:
+    # Warm GenerativeModel instances keyed by a hash of (model, system instruction).
+    # Each instance keeps its client and the converted system instruction, so a
+    # repeat system prompt doesn't rebuild either. The underlying channel or HTTP
+    # session is shared process-wide by google.generativeai and stays open between
+    # requests; warmup() opens it before the first user request and the keep-alive
+    # thread stops it from going idle.
+    def __init__(self, factory, max_size=32, ttl=3600):
+        self.factory = factory
+        self._models = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._keepalive = None
+        self.created = 0
+
+    def _key(self, model_name, system_instruction):
+        return hashlib.sha256(f"{model_name}\0{system_instruction or ''}".encode()).hexdigest()
+
+    def get(self, model_name, system_instruction=None):
+        key = self._key(model_name, system_instruction)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self.factory(model_name=model_name, system_instruction=system_instruction)
+                    self._models.put(key, model)
+                    self.created += 1
+        return model
+
+    def warmup(self, model_name):
+        # count_tokens is free and opens the connection without generating anything
+        try:
+            self.get(model_name).count_tokens("ping")
+            return True
+        except Exception as e:
+            log.warning(f"Model warmup failed: {e}")
+            return False
+
+    def start_keepalive(self, model_name, interval):
+        if self._keepalive or not interval:
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.warmup(model_name)
+
+        self._keepalive = stop
+        threading.Thread(target=run, name='model-keepalive', daemon=True).start()
+
+    def stop_keepalive(self):
+        if self._keepalive:
+            self._keepalive.set()
+            self._keepalive = None
+
+    def stats(self):
+        stats = self._models.stats()
+        stats['created'] = self.created
+        return stats
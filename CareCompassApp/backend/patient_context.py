@@ -0,0 +1,60 @@
+# The "Current Patient Context" block of the chat system prompt, built on the
+# server from the stored patient record so clients only send a patientId.
+# Rendering is deterministic: the same patient version always produces the same
+# text, so the system prompt stays byte-identical between turns. Pooled models
+# (keyed by system instruction), the response cache and provider-side prefix
+# caching all depend on that.
+
+# The only fields render_context() reads; Firestore reads decrypt just these
+CONTEXT_FIELDS = [
+    'name', 'dob', 'age', 'insuranceProvider', 'conditions', 'medicationsList',
+    'medications', 'doctors', 'bloodPressure', 'heartRate', 'otherVitals', 'updatedAt'
+]
+
+# Longest value kept per line; free-text fields (otherVitals, a pasted
+# medications note) can otherwise crowd the prompt. Cut at a fixed length so
+# the output stays deterministic.
+MAX_FIELD_CHARS = 500
+
+def _text(value):
+    return str(value).strip() if value is not None else ''
+
+def _join(items):
+    # Lists from the profile screens; older records may hold a plain string
+    if isinstance(items, str):
+        return items.strip()
+    return ', '.join(t for t in (_text(item) for item in items or []) if t)
+
+def _medication(med):
+    return ' '.join(t for t in (_text(med.get(k)) for k in ('name', 'dosage', 'frequency')) if t)
+
+def _doctor(doc):
+    name, kind = _text(doc.get('name')), _text(doc.get('type'))
+    return f"{name} ({kind})" if name and kind else name or kind
+
+def render_context(patient):
+    # One "Label: value" line per non-empty field, in a fixed order
+    lines = []
+
+    def add(label, value):
+        value = _text(value)
+        if len(value) > MAX_FIELD_CHARS:
+            value = value[:MAX_FIELD_CHARS].rstrip() + '…'
+        if value:
+            lines.append(f"{label}: {value}")
+
+    add('Patient Name', patient.get('name'))
+    add('DOB', patient.get('dob'))
+    add('Age', patient.get('age'))
+    add('Insurance', patient.get('insuranceProvider'))
+    add('Conditions', _join(patient.get('conditions')))
+    meds = patient.get('medicationsList')
+    if meds:
+        add('Meds', '; '.join(t for t in (_medication(m) for m in meds if isinstance(m, dict)) if t))
+    else:
+        add('Meds', patient.get('medications'))
+    add('Doctors', '; '.join(t for t in (_doctor(d) for d in patient.get('doctors') or [] if isinstance(d, dict)) if t))
+    add('BP', patient.get('bloodPressure'))
+    add('HR', patient.get('heartRate'))
+    add('Other Vitals', patient.get('otherVitals'))
+    return '\n'.join(lines)
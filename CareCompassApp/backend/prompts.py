@@ -18,3 +18,15 @@ Format of response:
 - Content
 - Close with a reminder that you are an AI and not a doctor with a horizontal rule above the statement.
 """
+
+HISTORY_SUMMARY_PROMPT_TEMPLATE = """
+You are maintaining a running summary of a conversation between a patient or caregiver and CareCompass, a health assistant.
+
+Summary so far:
+{summary}
+
+New conversation turns to fold into the summary:
+{transcript}
+
+Write an updated summary in under 200 words. Keep symptoms, medications, doses, test results, dates, questions the user still has, and any advice already given. Leave out greetings and the AI disclaimer. Reply with the summary only.
+"""
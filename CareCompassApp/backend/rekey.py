@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# Documents under patients/<id> that hold encrypted fields, as
+# (collection, subcollections of each of its documents)
+PATIENT_COLLECTIONS = [('chats', ['messages', 'digest']), ('files', [])]
+DOCUMENT_ID = '__name__'
+
+class ReKeyWorker:
+    # Background migration onto envelope encryption. Walks every patient (in
+    # document ID order, a page at a time) and every document stored under it,
+    # and rewrites the encrypted fields that aren't sealed under the patient's
+    # current data key: Fernet values from before envelope encryption, and
+    # values under an older version after DataKeyStore.rotate().
+    #
+    # Only the changed fields are written, with update() guarded by the
+    # document's update time. A batch that loses a race with a user's write
+    # fails as a whole and is picked up again by the next pass. Patients are
+    # migrated 'workers' at a time, and the worker sleeps as needed to rewrite
+    # at most docs_per_second documents, so it doesn't compete with request
+    # traffic.
+    def __init__(self, db, crypto, batch_size=100, workers=4, docs_per_second=200, rotate=False, page_size=100):
+        self.db = db
+        self.crypto = crypto
+        self.batch_size = batch_size
+        self.workers = workers
+        self.docs_per_second = docs_per_second
+        self.rotate = rotate
+        self.page_size = page_size
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.passes = 0
+        self._reset()
+
+    def _reset(self):
+        self.patients = 0
+        self.scanned = 0
+        self.migrated = 0
+        self.failed = 0
+        self.seconds = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run, name='rekey', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        # One full pass over all patients; safe to repeat, since documents that
+        # are already migrated are only read. Counters are for the latest pass.
+        if not self.db or not self.crypto.envelope:
+            log.warning("Re-key needs Firestore and envelope_encryption; not started")
+            return
+        self._reset()
+        started = time.perf_counter()
+        self._window = (time.monotonic(), 0)
+        try:
+            self._run_pass()
+        except Exception as e:
+            log.error(f"Re-key pass stopped: {e}")
+        self.passes += 1
+        self.seconds = time.perf_counter() - started
+        log.info(f"Re-key pass finished in {self.seconds:.1f} s", extra={'fields': self.stats()})
+
+    def _run_pass(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight = []
+            for patient in self._patients():
+                in_flight.append(pool.submit(self._migrate_patient, patient))
+                # At most 2 * workers patients queued at a time
+                if len(in_flight) >= self.workers * 2:
+                    in_flight.pop(0).result()
+            for future in in_flight:
+                future.result()
+
+    def _patients(self):
+        last = None
+        while not self._stop.is_set():
+            query = self.db.collection('patients').order_by(DOCUMENT_ID).limit(self.page_size)
+            if last is not None:
+                query = query.start_after({DOCUMENT_ID: last})
+            page = list(query.stream())
+            yield from page
+            if len(page) < self.page_size:
+                return
+            last = page[-1].id
+
+    def _documents(self, patient):
+        yield patient
+        for name, subcollections in PATIENT_COLLECTIONS:
+            for snapshot in patient.reference.collection(name).stream():
+                yield snapshot
+                for sub in subcollections:
+                    yield from snapshot.reference.collection(sub).stream()
+
+    def _migrate_patient(self, patient):
+        if self._stop.is_set():
+            return
+        try:
+            if self.rotate:
+                self.crypto.data_keys.rotate(patient.id)
+            batch = []
+            scanned = 0
+            for snapshot in self._documents(patient):
+                scanned += 1
+                changes = self.crypto.reencrypt_dict(snapshot.to_dict() or {}, patient.id)
+                if changes:
+                    batch.append((snapshot, changes))
+                if len(batch) >= self.batch_size:
+                    self._commit(batch)
+                    batch = []
+            if batch:
+                self._commit(batch)
+            with self._lock:
+                self.patients += 1
+                self.scanned += scanned
+        except Exception as e:
+            log.warning(f"Re-key of patient {patient.id} stopped, retried next pass: {e}")
+
+    def _commit(self, batch):
+        from google.cloud.firestore_v1.field_path import FieldPath
+        self._throttle(len(batch))
+        write = self.db.batch()
+        for snapshot, changes in batch:
+            # update() reads keys as field paths; quote them so a stored name
+            # with a dot is written as itself, not as a nested field
+            changes = {FieldPath(name).to_api_repr(): value for name, value in changes.items()}
+            write.update(snapshot.reference, changes, option=self.db.write_option(last_update_time=snapshot.update_time))
+        try:
+            write.commit()
+            with self._lock:
+                self.migrated += len(batch)
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            log.warning(f"Re-key batch of {len(batch)} documents not written, retried next pass: {e}")
+
+    def _throttle(self, count):
+        # Fixed one-second windows shared by the pool threads
+        if not self.docs_per_second:
+            return
+        while True:
+            with self._lock:
+                start, used = self._window
+                now = time.monotonic()
+                if now - start >= 1:
+                    start, used = now, 0
+                if used + count <= self.docs_per_second or used == 0:
+                    self._window = (start, used + count)
+                    return
+                wait = start + 1 - now
+            time.sleep(wait)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "passes": self.passes,
+            "patients": self.patients,
+            "scanned": self.scanned,
+            "migrated": self.migrated,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 2) if self.seconds is not None else None
+        }
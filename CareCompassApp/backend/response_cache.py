@@ -0,0 +1,37 @@
+import hashlib
+import json
+from utils import TTLCache
+
+def normalize_text(text):
+    # Only changes that can't alter meaning: case and whitespace
+    return ' '.join((text or '').split()).casefold()
+
+class ResponseCache:
+    # Caches complete model answers keyed by a hash of everything that shapes the
+    # answer: model, system instruction (which carries the patient context),
+    # normalized history, normalized prompt and attachment identity. Entries are
+    # Fernet-encrypted in memory and expire after 'ttl' seconds.
+    def __init__(self, crypto, max_size=512, ttl=3600):
+        self.crypto = crypto
+        self._entries = TTLCache(max_size=max_size, ttl=ttl)
+
+    def make_key(self, model_name, system_instruction, history, prompt, attachment=None, scope=None):
+        normalized_history = [
+            [turn.get('role'), [normalize_text(p.get('text')) if 'text' in p else p for p in turn.get('parts', [])]]
+            for turn in history
+        ]
+        material = json.dumps([
+            scope, model_name, system_instruction, normalized_history, normalize_text(prompt), attachment
+        ], sort_keys=True, default=str)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key):
+        encrypted = self._entries.get(key)
+        return self.crypto.decrypt(encrypted) if encrypted is not None else None
+
+    def put(self, key, text):
+        if text:
+            self._entries.put(key, self.crypto.encrypt(text))
+
+    def stats(self):
+        return self._entries.stats()
@@ -0,0 +1,120 @@
+import re
+import threading
+import unicodedata
+
+# Search over a patient's chat messages and file names without decrypting them.
+# Text is split into normalized terms, and each term is stored only as a blind
+# index token: a keyed HMAC of "<patientId>:term:<term>" (CryptoManager.blind_index)
+# cut to 64 bits. A query is tokenized the same way and matched against the
+# stored tokens. Tokens are scoped to the patient, so the same word gives
+# unrelated tokens for different patients. What the index does reveal is which
+# of one patient's documents share a term, and roughly how many distinct terms
+# each has.
+#
+# Matching is on whole terms after normalization (case, accents); every query
+# term must match (AND).
+
+TOKEN_CHARS = 16
+MAX_TOKENS = 5000  # Per document; Firestore indexes each array entry
+MAX_TERM_CHARS = 40
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from had has have how i if in is it its "
+    "me my no not of on or our so than that the their them then there these they this to "
+    "was we were what when where which who will with you your".split()
+)
+_WORD = re.compile(r'[a-z0-9]+')
+
+def terms(text):
+    # Distinct normalized terms: lower case, accents stripped, split on anything
+    # that isn't a letter or digit, stopwords and single characters dropped
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode().lower()
+    return {w[:MAX_TERM_CHARS] for w in _WORD.findall(text) if len(w) > 1 and w not in STOPWORDS}
+
+def messages_text(messages):
+    return ' '.join(str(m.get('text') or '') for m in messages or [] if isinstance(m, dict))
+
+def file_text(file_data):
+    # File names are the searchable part of file metadata ("lab_results_2024.pdf")
+    return file_data.get('name') or ''
+
+class BlindIndex:
+    def __init__(self, crypto):
+        self.crypto = crypto
+
+    def token(self, patient_id, term):
+        return self.crypto.blind_index(f"{patient_id}:term:{term}")[:TOKEN_CHARS]
+
+    def tokens(self, patient_id, text, existing=()):
+        # Sorted tokens for a document's text, merged with the ones it already has
+        tokens = set(existing)
+        tokens.update(self.token(patient_id, term) for term in terms(text))
+        return sorted(tokens)[:MAX_TOKENS]
+
+    def query(self, patient_id, q):
+        return sorted({self.token(patient_id, term) for term in terms(q)})
+
+class MemorySearchIndex:
+    # In-memory counterpart of the Firestore search documents for the no-Firebase
+    # mode: token -> {(kind, id)} per patient. A patient's index is built from the
+    # store by load(patient_id) -> [(kind, id, text, updatedAt)] on its first search, and
+    # kept current by add()/remove() from then on.
+    def __init__(self, blind, load):
+        self.blind = blind
+        self.load = load
+        # patient ID -> {'postings': {token: {ref}}, 'docs': {ref: tokens}, 'stamps': {ref: updatedAt}}
+        self._patients = {}
+        self._lock = threading.Lock()
+
+    def _build(self, patient_id):
+        index = {'postings': {}, 'docs': {}, 'stamps': {}}
+        for kind, ref_id, text, stamp in self.load(patient_id):
+            self._add(index, (kind, ref_id), self.blind.tokens(patient_id, text), stamp, replace=True)
+        return index
+
+    @staticmethod
+    def _add(index, ref, tokens, stamp, replace):
+        old = index['docs'].get(ref, set())
+        new = set(tokens) if replace else old | set(tokens)
+        for token in old - new:
+            index['postings'][token].discard(ref)
+        for token in new - old:
+            index['postings'].setdefault(token, set()).add(ref)
+        index['docs'][ref] = new
+        index['stamps'][ref] = stamp
+
+    def add(self, patient_id, kind, ref_id, text, stamp, replace=True):
+        # replace=False adds terms (appended messages) instead of replacing them
+        with self._lock:
+            index = self._patients.get(patient_id)
+            if index is not None:
+                self._add(index, (kind, ref_id), self.blind.tokens(patient_id, text), stamp, replace)
+
+    def remove(self, patient_id, kind, ref_id):
+        with self._lock:
+            index = self._patients.get(patient_id)
+            if index is not None and (kind, ref_id) in index['docs']:
+                self._add(index, (kind, ref_id), (), None, replace=True)
+                del index['docs'][(kind, ref_id)]
+                del index['stamps'][(kind, ref_id)]
+
+    def reset(self, patient_id):
+        # Rebuilt from the store on the next search (after an import replaces chats)
+        with self._lock:
+            self._patients.pop(patient_id, None)
+
+    def search(self, patient_id, tokens):
+        # [(kind, id)] containing every token, most recently written first
+        with self._lock:
+            index = self._patients.get(patient_id)
+            if index is None:
+                index = self._patients[patient_id] = self._build(patient_id)
+            postings = [index['postings'].get(token, set()) for token in tokens]
+            refs = set.intersection(*postings) if postings else set()
+            return sorted(refs, key=lambda ref: index['stamps'][ref] or '', reverse=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "patients": len(self._patients),
+                "tokens": sum(len(doc) for index in self._patients.values() for doc in index['docs'].values())
+            }
@@ -0,0 +1,58 @@
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other by name (python app.py is run from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def make_token(uid='test-user', **claims):
+    # Unsigned token in the Firebase ID token shape; the dev fallback in
+    # verify_token accepts it while Firebase isn't initialized
+    payload = base64.urlsafe_b64encode(json.dumps(dict({'sub': uid, 'email': f'{uid}@example.com'}, **claims)).encode()).decode().rstrip('=')
+    return f"header.{payload}.signature"
+
+class FakeClock:
+    # Stands in for time.time/time.monotonic; tests move it by changing 'now'
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def app_module(monkeypatch):
+    # app.py against a fresh fake_firestore.FakeFirestore, with the in-process
+    # caches emptied so tests don't see each other's data
+    import app as app_module
+    import fake_firestore
+    monkeypatch.setattr(app_module, 'db', fake_firestore.FakeFirestore())
+    for cache in (app_module.token_cache, app_module.patient_owner_cache, app_module.patient_context_cache, app_module.import_progress):
+        cache.clear()
+    yield app_module
+    app_module.patient_writes.flush_all()
+
+@pytest.fixture
+def memory_app(app_module, monkeypatch):
+    # app.py without Firestore: a fresh MemoryStore and in-memory search index
+    from memory_store import MemoryStore
+    from search_index import MemorySearchIndex
+    monkeypatch.setattr(app_module, 'db', None)
+    monkeypatch.setattr(app_module, 'memory_store', MemoryStore())
+    monkeypatch.setattr(app_module, 'memory_search', MemorySearchIndex(app_module.blind_index, app_module.memory_search_documents))
+    return app_module
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture
+def headers():
+    return {'Authorization': f'Bearer {make_token()}'}
+
+@pytest.fixture
+def patient(client, headers):
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada'}, headers=headers)
+    return 'p1'
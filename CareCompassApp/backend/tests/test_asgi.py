@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import pytest
+
+async def call(application, method, path, headers=None, body=b''):
+    # One request through the ASGI app; returns (status, headers, body)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {'status': None, 'headers': {}, 'body': b''}
+    finished = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {k.decode(): v.decode() for k, v in message['headers']}
+        else:
+            response['body'] += message.get('body', b'')
+            if not message.get('more_body'):
+                finished.set()
+
+    await application(scope, receive, send)
+    return response['status'], response['headers'], response['body']
+
+class FakeSession:
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    async def send_message_async(self, parts, stream=False):
+        return self.stream()
+
+    async def stream(self):
+        for piece in self.pieces:
+            yield type('Chunk', (), {'text': piece})()
+
+class FakeModel:
+    def start_chat(self, history=None):
+        return FakeSession(['Use it ', 'twice a day.'])
+
+@pytest.fixture
+def asgi_app(app_module, monkeypatch):
+    import asgi
+    monkeypatch.setattr(asgi, '_stream_slots', None)
+    monkeypatch.setattr(app_module, 'create_model', lambda model_name, system_instruction: FakeModel())
+    return asgi.application
+
+def test_flask_routes_are_served(asgi_app, headers):
+    status, response_headers, body = asyncio.run(call(asgi_app, 'GET', '/api/stats', headers))
+    assert status == 200 and 'tokenCache' in json.loads(body)
+    assert response_headers['x-request-id']
+
+def test_chat_is_streamed_natively(asgi_app, headers):
+    request = json.dumps({'prompt': 'How often should I use my inhaler?'}).encode()
+    status, response_headers, body = asyncio.run(call(asgi_app, 'POST', '/api/chat', dict(headers, **{'X-Request-ID': 'chat-test-1'}), request))
+    assert status == 200 and body == b'Use it twice a day.'
+    assert response_headers['x-request-id'] == 'chat-test-1'
+
+def test_chat_needs_a_token(asgi_app):
+    status, _, body = asyncio.run(call(asgi_app, 'POST', '/api/chat', {}, b'{}'))
+    assert status == 401 and json.loads(body) == {'error': 'Unauthorized'}
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+from firebase_admin import auth
+
+from conftest import FakeClock, make_token
+
+class FakeVerifier:
+    # Stands in for auth.verify_id_token: counts calls, issues claims that
+    # expire after 'lifetime' seconds (None: no exp claim), and can start
+    # rejecting tokens to simulate revocation
+    def __init__(self):
+        self.calls = 0
+        self.lifetime = 3600
+        self.revoked = False
+
+    def __call__(self, id_token, check_revoked=False):
+        self.calls += 1
+        if self.revoked:
+            raise auth.RevokedIdTokenError('Token revoked')
+        claims = {'uid': 'test-user', 'email': 'test-user@example.com'}
+        if self.lifetime is not None:
+            claims['exp'] = time.time() + self.lifetime
+        return claims
+
+@pytest.fixture
+def verifier(app_module, monkeypatch):
+    fake = FakeVerifier()
+    monkeypatch.setattr(auth, 'verify_id_token', fake)
+    # Any non-None value makes verify_token take the verified path
+    monkeypatch.setattr(app_module.firebase, 'get', lambda: (app_module.db, None))
+    return fake
+
+@pytest.fixture
+def clock(app_module, monkeypatch):
+    fake = FakeClock(time.time())
+    monkeypatch.setattr(app_module.token_cache, 'clock', fake)
+    return fake
+
+def test_repeat_requests_verify_once(client, headers, verifier):
+    for _ in range(5):
+        assert client.get('/api/stats', headers=headers).status_code == 200
+    assert verifier.calls == 1
+    stats = client.get('/api/stats', headers=headers).get_json()['tokenCache']
+    assert stats['hits'] == 5 and stats['misses'] == 1
+
+def test_each_token_is_verified(client, verifier):
+    for uid in ('a', 'b', 'a', 'b'):
+        client.get('/api/stats', headers={'Authorization': f'Bearer {make_token(uid)}'})
+    assert verifier.calls == 2
+
+def test_verified_again_after_cache_ttl(client, headers, verifier, clock, app_module):
+    client.get('/api/stats', headers=headers)
+    clock.now += app_module.token_cache.ttl + 1
+    client.get('/api/stats', headers=headers)
+    assert verifier.calls == 2
+
+def test_verified_again_after_token_exp(client, headers, verifier, clock):
+    verifier.lifetime = 10
+    client.get('/api/stats', headers=headers)
+    client.get('/api/stats', headers=headers)
+    assert verifier.calls == 1
+    clock.now += 11
+    client.get('/api/stats', headers=headers)
+    assert verifier.calls == 2
+
+def test_revoked_token_rejected_once_cache_entry_expires(client, headers, verifier, clock, app_module):
+    assert client.get('/api/stats', headers=headers).status_code == 200
+    verifier.revoked = True
+    clock.now += app_module.token_cache.ttl + 1
+    assert client.get('/api/stats', headers=headers).status_code == 401
+    # A failed verification is never cached
+    assert client.get('/api/stats', headers=headers).status_code == 401
+    assert verifier.calls == 3
+
+def test_token_without_exp_not_cached(client, headers, verifier):
+    verifier.lifetime = None
+    client.get('/api/stats', headers=headers)
+    client.get('/api/stats', headers=headers)
+    assert verifier.calls == 2
@@ -0,0 +1,38 @@
+import os
+
+from blob_cache import BlobCache
+
+KEY = b'k' * 32
+
+def test_round_trip_and_new_generation_misses(tmp_path):
+    cache = BlobCache(str(tmp_path), 1024, KEY)
+    cache.put('patients/p1/f1/scan.pdf', 1, b'%PDF-1')
+    assert cache.get('patients/p1/f1/scan.pdf', 1) == b'%PDF-1'
+    assert cache.get('patients/p1/f1/scan.pdf', 2) is None
+
+def test_entries_from_a_previous_process_are_reused(tmp_path):
+    BlobCache(str(tmp_path), 1024, KEY).put('patients/p1/f1/scan.pdf', 1, b'%PDF-1')
+    assert BlobCache(str(tmp_path), 1024, KEY).get('patients/p1/f1/scan.pdf', 1) == b'%PDF-1'
+
+def test_invalidate_reaches_entries_from_a_previous_process(tmp_path):
+    first = BlobCache(str(tmp_path), 1024, KEY)
+    first.put('patients/p1/f1/scan.pdf', 1, b'%PDF-1')
+    first.put('patients/p1/f2/xray.png', 1, b'PNG')
+    restarted = BlobCache(str(tmp_path), 1024, KEY)
+    restarted.invalidate('patients/p1/f1/scan.pdf')
+    assert restarted.get('patients/p1/f1/scan.pdf', 1) is None
+    assert restarted.get('patients/p1/f2/xray.png', 1) == b'PNG'
+    assert len(os.listdir(tmp_path)) == 1
+
+def test_unreachable_old_files_are_removed(tmp_path):
+    (tmp_path / ('0' * 64 + '.blob')).write_bytes(b'old')
+    cache = BlobCache(str(tmp_path), 1024, KEY)
+    assert cache.stats()['entries'] == 0 and not os.listdir(tmp_path)
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = BlobCache(str(tmp_path), 200, KEY)
+    cache.put('a', 1, b'a' * 60)
+    cache.put('b', 1, b'b' * 60)
+    cache.get('a', 1)
+    cache.put('c', 1, b'c' * 60)
+    assert cache.get('b', 1) is None and cache.get('a', 1) == b'a' * 60
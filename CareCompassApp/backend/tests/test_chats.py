@@ -0,0 +1,26 @@
+def turn(i):
+    return {'id': i, 'sender': 'user' if i % 2 == 0 else 'ai', 'text': f'message {i}'}
+
+def chat_messages(client, headers, patient):
+    return client.get(f'/api/patients/{patient}/chats', headers=headers).get_json()[0]['messages']
+
+def test_long_legacy_chat_is_migrated_on_append(app_module, client, headers, patient):
+    # Saved whole, with every message embedded in the chat document
+    legacy = [turn(i) for i in range(1200)]
+    client.post(f'/api/patients/{patient}/chats', json={'id': 'c1', 'createdAt': '2024-01-01T00:00:00Z', 'messages': legacy}, headers=headers)
+    response = client.post(f'/api/patients/{patient}/chats/c1/messages', json={'messages': [turn(1200)]}, headers=headers)
+    assert response.status_code == 200 and response.get_json()['messageCount'] == 1201
+    raw = app_module.db.collection('patients').document(patient).collection('chats').document('c1').get().to_dict()
+    assert 'messages' not in raw
+    assert chat_messages(client, headers, patient) == legacy + [turn(1200)]
+    found = client.get(f'/api/patients/{patient}/search?q=message', headers=headers).get_json()
+    assert found['total'] == 1
+
+def test_append_to_a_new_chat(client, headers, patient):
+    for i in range(3):
+        client.post(f'/api/patients/{patient}/chats/c1/messages', json={'messages': [turn(i)]}, headers=headers)
+    assert chat_messages(client, headers, patient) == [turn(i) for i in range(3)]
+
+def test_append_is_limited_to_one_transaction(app_module, client, headers, patient):
+    messages = [turn(i) for i in range(app_module.MAX_APPEND_MESSAGES + 1)]
+    assert client.post(f'/api/patients/{patient}/chats/c1/messages', json={'messages': messages}, headers=headers).status_code == 400
@@ -0,0 +1,145 @@
+import pytest
+from cryptography.fernet import Fernet
+
+import fake_firestore
+from conftest import FakeClock
+from envelope import DataKeyStore
+from utils import CryptoManager, DecryptionError
+
+def make_crypto(db, key=None, clock=None):
+    crypto = CryptoManager(key or Fernet.generate_key())
+    crypto.data_keys = DataKeyStore(lambda: db, crypto.derive_key('data-key-wrap'), clock=clock or FakeClock())
+    crypto.envelope = True
+    return crypto
+
+@pytest.fixture
+def db():
+    return fake_firestore.FakeFirestore()
+
+def test_round_trip(db):
+    crypto = make_crypto(db)
+    doc = {'id': 'p1', 'name': 'Ada', 'conditions': ['asthma']}
+    sealed = crypto.encrypt_dict(doc, 'p1')
+    assert sealed['name'].startswith('g2:p1.v1:')
+    assert crypto.decrypt_dict(sealed, patient_id='p1') == doc
+
+def test_untagged_plain_text_is_returned(db):
+    assert make_crypto(db).decrypt('written before encryption') == 'written before encryption'
+
+def test_failed_key_lookup_raises(db, monkeypatch):
+    crypto = make_crypto(db, key=Fernet.generate_key())
+    sealed = crypto.encrypt('secret', 'p1', 'name')
+    other = make_crypto(db, key=crypto.key)
+
+    def unavailable():
+        raise ConnectionError('Firestore unavailable')
+    monkeypatch.setattr(other.data_keys, '_db', unavailable)
+    with pytest.raises(DecryptionError):
+        other.decrypt(sealed, 'name')
+
+def test_corrupt_compressed_value_raises(db):
+    crypto = make_crypto(db)
+    with pytest.raises(DecryptionError):
+        crypto.decrypt(crypto.COMPRESSED_TAG + 'not-a-token')
+
+def test_value_moved_to_another_field_fails(db):
+    crypto = make_crypto(db)
+    sealed = crypto.encrypt_dict({'name': 'Ada'}, 'p1')
+    with pytest.raises(DecryptionError):
+        crypto.decrypt_field('insuranceProvider', sealed['name'])
+
+def test_value_moved_to_another_patient_fails(db):
+    crypto = make_crypto(db)
+    sealed = crypto.encrypt_dict({'name': 'Ada'}, 'p1')
+    crypto.encrypt_dict({'name': 'Bob'}, 'p2')
+    with pytest.raises(DecryptionError):
+        crypto.decrypt_dict(sealed, patient_id='p2')
+
+def test_rotation_by_another_instance_is_picked_up(db):
+    clock = FakeClock()
+    key = Fernet.generate_key()
+    first, second = make_crypto(db, key, clock), make_crypto(db, key, clock)
+    assert first.data_keys.current('p1')[0] == second.data_keys.current('p1')[0] == 'p1.v1'
+    second.data_keys.rotate('p1')
+    assert first.data_keys.current('p1')[0] == 'p1.v1'
+    clock.now += first.data_keys.refresh_seconds + 1
+    assert first.data_keys.current('p1')[0] == 'p1.v2'
+
+def test_append_keeps_chat_metadata_single_encrypted(app_module, client, headers, monkeypatch):
+    crypto = make_crypto(app_module.db, key=app_module.crypto.key)
+    monkeypatch.setattr(app_module, 'crypto', crypto)
+    monkeypatch.setattr(app_module.blind_index, 'crypto', crypto)
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada'}, headers=headers)
+    for turn in range(3):
+        response = client.post('/api/patients/p1/chats/c1/messages', json={
+            'title': 'Inhaler', 'messages': [{'id': turn, 'sender': 'user', 'text': f'question {turn}'}]
+        }, headers=headers)
+        assert response.status_code == 200
+    raw = app_module.db.collection('patients').document('p1').collection('chats').document('c1').get().to_dict()
+    assert crypto.decrypt_field('title', raw['title'], 'p1') == 'Inhaler'
+
+def test_append_aborts_when_stored_values_cannot_be_read(app_module, client, headers, monkeypatch):
+    crypto = make_crypto(app_module.db, key=app_module.crypto.key)
+    monkeypatch.setattr(app_module, 'crypto', crypto)
+    monkeypatch.setattr(app_module.blind_index, 'crypto', crypto)
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada'}, headers=headers)
+    chat_ref = app_module.db.collection('patients').document('p1').collection('chats').document('c1')
+    # A legacy chat with embedded messages whose data key can't be loaded
+    chat_ref.set({'id': 'c1', 'messages': crypto.encrypt('[]', 'p1', 'messages')})
+    crypto.data_keys._keys.clear()
+    crypto.data_keys._current.clear()
+
+    def unavailable(patient_id):
+        raise ConnectionError('Firestore unavailable')
+    monkeypatch.setattr(crypto.data_keys, '_ref', unavailable)
+    before = chat_ref.get().to_dict()
+    response = client.post('/api/patients/p1/chats/c1/messages', json={'messages': [{'id': 0, 'text': 'hi'}]}, headers=headers)
+    assert response.status_code == 500
+    assert chat_ref.get().to_dict() == before
+
+def test_message_moved_to_another_patients_chat_is_rejected(app_module, client, headers, monkeypatch):
+    crypto = make_crypto(app_module.db, key=app_module.crypto.key)
+    monkeypatch.setattr(app_module, 'crypto', crypto)
+    monkeypatch.setattr(app_module.blind_index, 'crypto', crypto)
+    for patient_id in ('p1', 'p2'):
+        client.post('/api/patients', json={'id': patient_id, 'name': 'Ada'}, headers=headers)
+        client.post(f'/api/patients/{patient_id}/chats/c1/messages', json={'messages': [{'id': 0, 'sender': 'user', 'text': f'{patient_id} question'}]}, headers=headers)
+    patients = app_module.db.collection('patients')
+    sealed = patients.document('p1').collection('chats').document('c1').collection('messages').document('00000000').get().to_dict()
+    patients.document('p2').collection('chats').document('c1').collection('messages').document('00000000').set(sealed)
+    for view in ('', '?view=summary'):
+        chats = client.get(f'/api/patients/p2/chats{view}', headers=headers).get_json()
+        assert chats == []
+
+def test_compressed_round_trip():
+    crypto = CryptoManager(Fernet.generate_key(), compress_min_bytes=100)
+    messages = [{'id': i, 'sender': 'ai', 'text': 'Use the inhaler twice a day. ' * 10} for i in range(20)]
+    sealed = crypto.encrypt_dict({'messages': messages})
+    assert sealed['messages'].startswith(CryptoManager.COMPRESSED_TAG)
+    assert crypto.decrypt_dict(sealed) == {'messages': messages}
+
+def test_values_below_threshold_stay_uncompressed():
+    crypto = CryptoManager(Fernet.generate_key(), compress_min_bytes=100)
+    assert not crypto.encrypt('x' * 99).startswith(CryptoManager.COMPRESSED_TAG)
+    assert crypto.encrypt('x' * 100).startswith(CryptoManager.COMPRESSED_TAG)
+    # Off unless configured
+    assert not CryptoManager(crypto.key).encrypt('x' * 10000).startswith(CryptoManager.COMPRESSED_TAG)
+
+def test_compressed_and_plain_values_mix_in_one_document():
+    key = Fernet.generate_key()
+    doc = {'id': 'p1', 'name': 'Ada', 'notes': 'Seasonal asthma, worse in spring. ' * 20}
+    sealed = CryptoManager(key, compress_min_bytes=100).encrypt_dict(doc)
+    assert sealed['notes'].startswith(CryptoManager.COMPRESSED_TAG)
+    assert not sealed['name'].startswith(CryptoManager.COMPRESSED_TAG)
+    # Readable without compression configured, and next to values written without it
+    reader = CryptoManager(key)
+    mixed = dict(sealed, conditions=reader.encrypt('["asthma"]'))
+    assert reader.decrypt_dict(mixed) == dict(doc, conditions=['asthma'])
+
+def test_compressed_envelope_round_trip(db):
+    crypto = make_crypto(db)
+    crypto.compress_min_bytes = 100
+    notes = 'Seasonal asthma, worse in spring. ' * 20
+    sealed = crypto.encrypt(notes, 'p1', 'notes')
+    assert len(sealed) < len(notes)
+    assert crypto.decrypt(sealed, 'notes', 'p1') == notes
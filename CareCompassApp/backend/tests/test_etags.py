@@ -0,0 +1,35 @@
+import pytest
+
+def revalidate(client, headers, url, etag):
+    return client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+
+@pytest.mark.parametrize('url', ['/api/patients', '/api/patients/p1/chats'])
+def test_unchanged_list_is_not_modified(client, headers, patient, url):
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'private, no-cache'
+    again = revalidate(client, headers, url, first.headers['ETag'])
+    assert again.status_code == 304 and not again.get_data()
+    assert again.headers['ETag'] == first.headers['ETag']
+
+def test_patient_change_gives_a_new_etag(client, headers, patient):
+    etag = client.get('/api/patients', headers=headers).headers['ETag']
+    client.patch('/api/patients/p1', json={'weight': '172 lb'}, headers=headers)
+    response = revalidate(client, headers, '/api/patients', etag)
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+def test_new_chat_message_gives_a_new_etag(client, headers, patient):
+    url = '/api/patients/p1/chats'
+    client.post(f'{url}/c1/messages', json={'messages': [{'id': 0, 'sender': 'user', 'text': 'hi'}]}, headers=headers)
+    etag = client.get(url, headers=headers).headers['ETag']
+    client.post(f'{url}/c1/messages', json={'messages': [{'id': 1, 'sender': 'ai', 'text': 'hello'}]}, headers=headers)
+    assert revalidate(client, headers, url, etag).status_code == 200
+
+def test_etag_depends_on_the_query(client, headers, patient):
+    full = client.get('/api/patients', headers=headers).headers['ETag']
+    assert revalidate(client, headers, '/api/patients?view=summary', full).status_code == 200
+
+def test_since_returns_only_changes(client, headers, patient):
+    since = client.get('/api/patients', query_string={'since': '2000-01-01T00:00:00Z'}, headers=headers).get_json()['since']
+    client.post('/api/patients', json={'id': 'p2', 'name': 'Bob'}, headers=headers)
+    delta = client.get('/api/patients', query_string={'since': since}, headers=headers).get_json()
+    assert [p['id'] for p in delta['items']] == ['p2'] and delta['since'] > since
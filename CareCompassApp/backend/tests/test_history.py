@@ -0,0 +1,92 @@
+import pytest
+
+from history import HistoryManager
+
+class InlineExecutor:
+    def submit(self, fn):
+        fn()
+
+class DeferredExecutor:
+    # Holds submitted folds until run() so tests can look at the request in between
+    def __init__(self):
+        self.queue = []
+
+    def submit(self, fn):
+        self.queue.append(fn)
+
+    def run(self):
+        while self.queue:
+            self.queue.pop(0)()
+
+class Summarizer:
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    def __call__(self, previous_summary, messages):
+        self.calls.append(len(messages))
+        if self.fail:
+            raise TimeoutError('Deadline exceeded')
+        return f"{len(messages)} earlier messages"
+
+def turns(count, chars=400):
+    return [{'sender': 'user' if i % 2 == 0 else 'model', 'text': str(i) * chars} for i in range(count)]
+
+def test_within_budget_sends_everything():
+    summarize = Summarizer()
+    manager = HistoryManager(summarize, token_budget=1000, executor=InlineExecutor())
+    saved = []
+    assert len(manager.build(turns(4), key='c1', save=saved.append)) == 4
+    assert not saved and not summarize.calls
+
+def test_fold_does_not_hold_up_the_request():
+    executor = DeferredExecutor()
+    manager = HistoryManager(Summarizer(), token_budget=1000, executor=executor)
+    saved = []
+    messages = turns(20)
+    # The triggering request gets every message; the digest comes later
+    assert len(manager.build(messages, key='c1', save=saved.append)) == 20
+    assert not saved
+    executor.run()
+    digest = saved[0]
+    history = manager.build(messages[digest['covered']:], digest, key='c1', save=saved.append)
+    assert history[0]['parts'][0]['text'].endswith(digest['summary'])
+    assert len(history) == 2 + 20 - digest['covered']
+
+def test_failed_fold_keeps_every_message():
+    summarize = Summarizer()
+    summarize.fail = True
+    manager = HistoryManager(summarize, token_budget=1000, executor=InlineExecutor())
+    saved = []
+    assert len(manager.build(turns(20), key='c1', save=saved.append)) == 20
+    assert not saved and manager.failures == 1
+    summarize.fail = False
+    manager.build(turns(20), key='c1', save=saved.append)
+    assert saved[0]['covered'] == summarize.calls[-1]
+
+def test_one_fold_per_chat_at_a_time():
+    summarize = Summarizer()
+    executor = DeferredExecutor()
+    manager = HistoryManager(summarize, token_budget=1000, executor=executor)
+    for _ in range(3):
+        manager.build(turns(20), key='c1', save=lambda digest: None)
+    manager.build(turns(20), key='c2', save=lambda digest: None)
+    executor.run()
+    assert len(summarize.calls) == 2
+
+@pytest.fixture
+def history(app_module, monkeypatch):
+    summarize = Summarizer()
+    monkeypatch.setattr(app_module.history_manager, 'summarize', summarize)
+    monkeypatch.setattr(app_module.history_manager, 'executor', InlineExecutor())
+    monkeypatch.setattr(app_module.history_manager, 'token_budget', 1000)
+    return summarize
+
+def test_digest_is_stored_and_used(app_module, client, headers, history):
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada'}, headers=headers)
+    for message in turns(20):
+        client.post('/api/patients/p1/chats/c1/messages', json={'messages': [message]}, headers=headers)
+    assert len(app_module.load_chat_history('p1', 'c1', 'next question')) == 20
+    history_after = app_module.load_chat_history('p1', 'c1', 'next question')
+    assert history_after[0]['parts'][0]['text'].startswith('Summary of our earlier conversation')
+    assert len(history_after) < 20
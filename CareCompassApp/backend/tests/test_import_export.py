@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+PATIENT = {'id': 'p1', 'name': 'Ada', 'conditions': ['asthma']}
+CHATS = [{'id': f'c{i}', 'title': f'Chat {i}', 'messages': [{'id': 0, 'sender': 'user', 'text': f'question {i}'}]} for i in range(5)]
+
+def exported(client, headers, **args):
+    response = client.get('/api/patients/p1/export', query_string=args, headers=headers)
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+def test_json_round_trip(client, headers):
+    assert client.post('/api/patients/import', json={'patient': PATIENT, 'chats': CHATS}, headers=headers).status_code == 200
+    export = json.loads(exported(client, headers))
+    assert export['patient']['name'] == 'Ada' and export['patient']['conditions'] == ['asthma']
+    assert sorted(c['id'] for c in export['chats']) == [c['id'] for c in CHATS]
+    # Re-importing the export gives the same data back
+    assert client.post('/api/patients/import', json=export, headers=headers).status_code == 200
+    again = json.loads(exported(client, headers))
+    # Imported documents are stamped with the import time
+    for doc in [again['patient'], export['patient']] + again['chats'] + export['chats']:
+        doc.pop('updatedAt')
+    assert again['patient'] == export['patient'] and again['chats'] == export['chats']
+
+def test_ndjson_round_trip(client, headers):
+    client.post('/api/patients/import', json={'patient': PATIENT, 'chats': CHATS}, headers=headers)
+    body = exported(client, headers, format='ndjson')
+    response = client.post('/api/patients/import', data=body, content_type='application/x-ndjson', headers=headers)
+    assert response.status_code == 200 and response.get_json()['committedChats'] == len(CHATS)
+    chats = [json.loads(line)['data'] for line in body.splitlines() if json.loads(line)['type'] == 'chat']
+    assert [c['messages'] for c in chats] == [c['messages'] for c in json.loads(exported(client, headers))['chats']]
+
+@pytest.fixture
+def flaky_batches(app_module, monkeypatch):
+    # One chat per batch; the batch holding c2 fails the first time
+    monkeypatch.setattr(app_module, 'IMPORT_BATCH_SIZE', 1)
+    commit = app_module.commit_chat_batch
+    failed = []
+
+    def flaky(patient_id, index, chats):
+        if chats[0]['id'] == 'c2' and not failed:
+            failed.append(index)
+            return {"batch": index, "chats": 1, "status": "failed", "error": "Deadline exceeded", "chatIds": []}
+        return commit(patient_id, index, chats)
+    monkeypatch.setattr(app_module, 'commit_chat_batch', flaky)
+    return failed
+
+def test_resume_writes_only_missing_chats(client, headers, flaky_batches):
+    first = client.post('/api/patients/import', json={'patient': PATIENT, 'chats': CHATS}, headers=headers)
+    assert first.status_code == 207
+    import_id = first.get_json()['importId']
+    retry = client.post(f'/api/patients/import?resume={import_id}', json={'patient': PATIENT, 'chats': CHATS}, headers=headers)
+    assert retry.status_code == 200
+    assert [b['chats'] for b in retry.get_json()['batches']] == [1]
+    assert retry.get_json()['committedChats'] == len(CHATS)
+
+def test_resume_id_is_scoped_to_the_patient(client, headers, flaky_batches):
+    import_id = client.post('/api/patients/import', json={'patient': PATIENT, 'chats': CHATS}, headers=headers).get_json()['importId']
+    other = client.post(f'/api/patients/import?resume={import_id}', json={'patient': dict(PATIENT, id='p2'), 'chats': CHATS}, headers=headers)
+    assert other.get_json()['committedChats'] == len(CHATS)
+    assert sum(b['chats'] for b in other.get_json()['batches']) == len(CHATS)
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lazy import Lazy, LazyProxy, Warmup
+
+class SlowFactory:
+    # Blocks until released, so tests can have several threads waiting on one get()
+    def __init__(self, value='client'):
+        self.value = value
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        assert self.release.wait(5)
+        return self.value
+
+def test_concurrent_get_builds_once():
+    factory = SlowFactory()
+    lazy = Lazy('client', factory)
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(lazy.get) for _ in range(8)]
+        factory.release.set()
+        values = [f.result() for f in futures]
+    assert factory.calls == 1 and values == ['client'] * 8
+    assert lazy.status()['ready'] and lazy.status()['configured']
+
+def test_failed_factory_is_not_retried():
+    calls = []
+    def factory():
+        calls.append(1)
+        raise RuntimeError('no credentials')
+    lazy = Lazy('client', factory)
+    assert lazy.get() is None and lazy.get() is None
+    assert len(calls) == 1
+    status = lazy.status()
+    assert not status['ready'] and not status['configured'] and status['error'] == 'no credentials'
+
+def test_proxy_forwards_and_is_falsy_when_not_configured():
+    proxy = LazyProxy(Lazy('text', lambda: 'abc').get)
+    assert proxy and proxy.upper() == 'ABC'
+    missing = LazyProxy(Lazy('missing', lambda: None).get)
+    assert not missing
+    with pytest.raises(AttributeError, match='not configured'):
+        missing.upper
+
+def test_plain_ready_probe_starts_warmup(app_module, client, monkeypatch):
+    # Stand-ins for the four services, so the probe doesn't need credentials
+    services = {'firebase': 'firebase', 'lazy_memory_store': 'memory_store', 'lazy_blob_store': 'blob_store', 'gemini': 'gemini'}
+    lazies = []
+    for attr, name in services.items():
+        lazies.append(Lazy(name, lambda name=name: name))
+        monkeypatch.setattr(app_module, attr, lazies[-1])
+    warmup = Warmup([lazy.get for lazy in lazies])
+    monkeypatch.setattr(app_module, 'warmup', warmup)
+    client.get('/ready')
+    assert warmup.started
+    warmup.wait(5)
+    second = client.get('/ready')
+    assert second.status_code == 200 and second.get_json()['ready']
+    assert all(status['ready'] for status in second.get_json()['services'].values())
@@ -0,0 +1,97 @@
+import pytest
+
+from memory_store import MemoryStore
+
+KEY = b'k' * 32
+
+def open_store(tmp_path):
+    # snapshot_interval=0: no background snapshots, so tests decide when they happen
+    return MemoryStore(path=str(tmp_path / 'store'), key=KEY, snapshot_interval=0)
+
+def fill(store):
+    store.save_patient({'id': 'p1', 'userId': 'u1', 'name': 'Ada'})
+    store.save_chat('p1', {'id': 'c1', 'createdAt': '2024-01-01T00:00:01Z', 'messages': [{'id': 0, 'text': 'hi'}]})
+    store.append_messages('p1', 'c1', {'title': 'Inhaler'}, [{'id': 1, 'text': 'hello'}])
+    store.save_file('p1', {'id': 'f1', 'name': 'scan.pdf'})
+    store.save_file('p1', {'id': 'f2', 'name': 'xray.png'})
+    store.delete_file('p1', 'f1')
+    store.set_digest('p1', 'c1', {'summary': 'Greetings', 'covered': 1})
+
+def assert_filled(store):
+    assert store.get_patient('p1')['name'] == 'Ada'
+    chat = store.get_chat('p1', 'c1')
+    assert chat['title'] == 'Inhaler' and [m['id'] for m in chat['messages']] == [0, 1]
+    assert [f['id'] for f in store.list_files('p1')] == ['f2']
+    assert store.get_digest('p1', 'c1') == {'summary': 'Greetings', 'covered': 1}
+
+def test_log_is_replayed_after_restart(tmp_path):
+    fill(open_store(tmp_path))
+    assert_filled(open_store(tmp_path))
+
+def test_snapshot_then_log_tail(tmp_path):
+    store = open_store(tmp_path)
+    fill(store)
+    assert store.snapshot()
+    store.append_messages('p1', 'c1', {}, [{'id': 2, 'text': 'bye'}])
+    store.save_patient({'id': 'p2', 'userId': 'u1', 'name': 'Bob'})
+    restarted = open_store(tmp_path)
+    assert [m['id'] for m in restarted.get_chat('p1', 'c1')['messages']] == [0, 1, 2]
+    assert [p['id'] for p in restarted.patients_for_user('u1')] == ['p1', 'p2']
+    assert restarted.get_digest('p1', 'c1') == {'summary': 'Greetings', 'covered': 1}
+    assert not (tmp_path / 'store.log.old').exists()
+
+@pytest.mark.parametrize('damage', ['truncate', 'corrupt'])
+def test_damaged_last_log_record_is_skipped(tmp_path, damage):
+    store = open_store(tmp_path)
+    fill(store)
+    store.save_patient({'id': 'p2', 'userId': 'u1', 'name': 'Bob'})
+    log_path = tmp_path / 'store.log'
+    lines = log_path.read_text().splitlines()
+    last = lines[-1][:len(lines[-1]) // 2] if damage == 'truncate' else lines[-1][:-8] + 'AAAAAAAA'
+    log_path.write_text('\n'.join(lines[:-1] + [last]) + '\n')
+    restarted = open_store(tmp_path)
+    assert_filled(restarted)
+    assert restarted.get_patient('p2') is None
+    # New writes after the damaged record are kept
+    restarted.save_patient({'id': 'p3', 'userId': 'u1', 'name': 'Cy'})
+    assert open_store(tmp_path).get_patient('p3')['name'] == 'Cy'
+
+def test_indexes_follow_changes():
+    store = MemoryStore()
+    for pid, user in (('p1', 'u1'), ('p2', 'u1'), ('p3', 'u2')):
+        store.save_patient({'id': pid, 'userId': user})
+    # Moving a patient to another user moves it between user indexes
+    store.save_patient({'id': 'p2', 'userId': 'u2'})
+    assert [p['id'] for p in store.patients_for_user('u1')] == ['p1']
+    assert [p['id'] for p in store.patients_for_user('u2')] == ['p2', 'p3']
+
+    store.save_chat('p1', {'id': 'c1', 'createdAt': '2024-01-01T00:00:01Z'})
+    store.save_chat('p1', {'id': 'c2', 'createdAt': '2024-01-01T00:00:02Z'})
+    # A re-saved chat is re-sorted, not listed twice
+    store.save_chat('p1', {'id': 'c1', 'createdAt': '2024-01-01T00:00:03Z'})
+    assert [c['id'] for c in store.chats_for_patient('p1')] == ['c1', 'c2']
+    assert [c['id'] for c in store.chats_for_patient('p1', before=('2024-01-01T00:00:03Z', 'c1'), limit=5)] == ['c2']
+
+    # Import adds to the existing chats; a patient with a 'chats' dict replaces them
+    assert store.import_patient({'id': 'p1', 'userId': 'u1'}, iter([{'id': 'c3', 'createdAt': '2024-01-01T00:00:00Z'}])) == 1
+    assert [c['id'] for c in store.chats_for_patient('p1')] == ['c1', 'c2', 'c3']
+    store.set_digest('p1', 'c1', {'summary': 'old', 'covered': 2})
+    store.save_patient({'id': 'p1', 'userId': 'u1', 'chats': {'c9': {'id': 'c9'}}})
+    assert [c['id'] for c in store.chats_for_patient('p1')] == ['c9']
+    assert store.get_digest('p1', 'c1') is None
+
+    store.save_file('p1', {'id': 'f2'})
+    store.save_file('p1', {'id': 'f1'})
+    store.delete_file('p1', 'f2')
+    store.delete_file('p1', 'missing')
+    assert [f['id'] for f in store.list_files('p1')] == ['f1']
+    assert store.stats()['files'] == 1
+
+def test_digest_is_not_returned_with_the_chat(memory_app, client, headers):
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada'}, headers=headers)
+    client.post('/api/patients/p1/chats/c1/messages', json={'messages': [{'id': 0, 'sender': 'user', 'text': 'hi'}]}, headers=headers)
+    memory_app.memory_store.set_digest('p1', 'c1', {'summary': 'Greetings', 'covered': 1})
+    chats = client.get('/api/patients/p1/chats', headers=headers).get_json()
+    export = client.get('/api/patients/p1/export', headers=headers).get_json()
+    assert 'digest' not in chats[0] and 'digest' not in export['chats'][0]
+    assert memory_app.load_chat_history('p1', 'c1', 'next')[0]['parts'][0]['text'].endswith('Greetings')
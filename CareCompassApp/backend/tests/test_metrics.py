@@ -0,0 +1,52 @@
+import logging
+
+from metrics import Instrumentation, JsonFormatter, RequestContextFilter, phase
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def counter(body, endpoint, status):
+    prefix = f'carecompass_requests_total{{endpoint="{endpoint}",method="GET",status="{status}"}} '
+    line = next((l for l in body.splitlines() if l.startswith(prefix)), None)
+    return int(float(line[len(prefix):])) if line else 0
+
+def test_metrics_count_requests(client, headers):
+    before = counter(client.get('/metrics').get_data(as_text=True), 'get_stats', 200)
+    for _ in range(3):
+        client.get('/api/stats', headers=headers)
+    client.get('/api/stats')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert counter(body, 'get_stats', 200) == before + 3
+    assert counter(body, 'get_stats', 401) >= 1
+    assert 'carecompass_request_seconds_bucket{endpoint="get_stats"' in body
+
+def test_request_id_is_echoed_or_generated(client, headers):
+    assert client.get('/api/stats', headers=dict(headers, **{'X-Request-ID': 'abc-123'})).headers['X-Request-ID'] == 'abc-123'
+    generated = client.get('/api/stats', headers=dict(headers, **{'X-Request-ID': 'not valid!'})).headers['X-Request-ID']
+    assert generated and generated != 'not valid!'
+
+def test_logs_during_a_request_carry_its_id():
+    instrumentation = Instrumentation(sample_rate=0)
+    handler = Records()
+    handler.addFilter(RequestContextFilter())
+    logger = logging.getLogger('tests.metrics')
+    logger.addHandler(handler)
+    try:
+        trace = instrumentation.start('chat', 'POST', 'req-42')
+        with phase('firestore'):
+            logger.warning('slow read')
+        # Unsampled requests drop INFO records
+        logger.info('detail')
+        instrumentation.finish(trace, 200)
+        logger.warning('after the request')
+    finally:
+        logger.removeHandler(handler)
+    assert [r.getMessage() for r in handler.records] == ['slow read', 'after the request']
+    assert '"requestId": "req-42"' in JsonFormatter().format(handler.records[0])
+    assert getattr(handler.records[1], 'request_id', None) is None
+    assert 'carecompass_phase_seconds_count{endpoint="chat",phase="firestore"} 1' in instrumentation.registry.render()
@@ -0,0 +1,79 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from model_files import ModelFileRegistry
+
+class SlowProvider:
+    # Upload blocks until released, so tests can hold uploads in flight
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = []
+        self.deleted = []
+        self.fail = 0
+
+    def upload(self, content, mime_type, display_name=None):
+        self.started.append(display_name)
+        assert self.release.wait(5)
+        if self.fail:
+            self.fail -= 1
+            raise TimeoutError('Upload timed out')
+        return {'name': display_name, 'uri': f'files/{display_name}/{len(self.started)}'}
+
+    def delete(self, handle):
+        self.deleted.append(handle['name'])
+
+def load_pdf():
+    return b'%PDF', 'application/pdf'
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_concurrent_requests_for_one_file_upload_once():
+    provider = SlowProvider()
+    registry = ModelFileRegistry(provider)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(registry.get_part, 'p1', 'f1', 'gemini', load_pdf) for _ in range(4)]
+        provider.release.set()
+        parts = [f.result() for f in futures]
+    assert registry.uploads == 1 and len(provider.started) == 1
+    assert all(part == parts[0] for part in parts)
+
+def test_other_files_are_not_blocked_by_an_upload():
+    provider = SlowProvider()
+    registry = ModelFileRegistry(provider)
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(registry.get_part, 'p1', 'f1', 'gemini', load_pdf)
+        second = pool.submit(registry.get_part, 'p2', 'f2', 'gemini', load_pdf)
+        assert wait_for(lambda: len(provider.started) == 2)
+        provider.release.set()
+        first.result(), second.result()
+    assert registry.uploads == 2
+
+def test_failed_upload_is_retried_by_the_next_request():
+    provider = SlowProvider()
+    provider.release.set()
+    provider.fail = 1
+    registry = ModelFileRegistry(provider)
+    with pytest.raises(TimeoutError):
+        registry.get_part('p1', 'f1', 'gemini', load_pdf)
+    assert registry.get_part('p1', 'f1', 'gemini', load_pdf)['file_data']['mime_type'] == 'application/pdf'
+    assert registry.uploads == 1
+
+def test_file_invalidated_mid_upload_is_not_cached():
+    provider = SlowProvider()
+    registry = ModelFileRegistry(provider)
+    with ThreadPoolExecutor(1) as pool:
+        pending = pool.submit(registry.get_part, 'p1', 'f1', 'gemini', load_pdf)
+        assert wait_for(lambda: provider.started)
+        registry.invalidate('p1', 'f1')
+        provider.release.set()
+        pending.result()
+    assert registry.uploads == 0 and provider.deleted == ['p1/f1']
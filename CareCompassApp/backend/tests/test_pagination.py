@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+def collect(client, headers, url, limit):
+    # Follows nextCursor to the end; returns (item IDs, pages)
+    ids, pages, cursor = [], 0, None
+    while True:
+        query = {'limit': limit}
+        if cursor:
+            query['cursor'] = cursor
+        response = client.get(url, query_string=query, headers=headers)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['items']) <= limit
+        ids.extend(item['id'] for item in page['items'])
+        pages += 1
+        cursor = page['nextCursor']
+        if cursor is None:
+            return ids, pages
+
+def test_patients_are_paged_in_id_order(client, headers):
+    for i in range(7):
+        client.post('/api/patients', json={'id': f'p{i}', 'name': f'Patient {i}'}, headers=headers)
+    ids, pages = collect(client, headers, '/api/patients', 3)
+    assert ids == [f'p{i}' for i in range(7)] and pages == 3
+
+def test_chats_are_paged_newest_first(client, headers, patient):
+    # Two chats share a createdAt, so the cursor has to break ties by ID
+    stamps = ['2024-01-01T00:00:01Z', '2024-01-01T00:00:02Z', '2024-01-01T00:00:02Z', '2024-01-01T00:00:03Z', '2024-01-01T00:00:04Z']
+    for i, stamp in enumerate(stamps):
+        client.post(f'/api/patients/{patient}/chats', json={'id': f'c{i}', 'createdAt': stamp, 'messages': []}, headers=headers)
+    ids, _ = collect(client, headers, f'/api/patients/{patient}/chats', 2)
+    assert sorted(ids) == [f'c{i}' for i in range(5)] and len(set(ids)) == 5
+    assert ids[0] == 'c4' and ids[-1] == 'c0'
+
+def test_files_are_paged(client, headers, patient, app_module, monkeypatch, tmp_path):
+    from blob_store import LocalBlobStore
+    monkeypatch.setattr(app_module, 'blob_store', LocalBlobStore(str(tmp_path), b'k' * 32, url_for=lambda token: f'/api/blobs/{token}'))
+    for i in range(5):
+        client.post(f'/api/patients/{patient}/files', data={'file': (io.BytesIO(b'x' * (i + 1)), f'scan{i}.pdf')}, headers=headers, content_type='multipart/form-data')
+    ids, pages = collect(client, headers, f'/api/patients/{patient}/files', 2)
+    assert ids == sorted(ids) and len(set(ids)) == 5 and pages == 3
+
+def test_unpaginated_list_is_a_plain_array(client, headers, patient):
+    assert isinstance(client.get('/api/patients', headers=headers).get_json(), list)
+
+@pytest.mark.parametrize('query', ['limit=abc', 'cursor=not-a-cursor', 'cursor=WzEsIDJd'])
+def test_bad_page_arguments(client, headers, patient, query):
+    assert client.get(f'/api/patients?{query}', headers=headers).status_code == 400
+
+def test_limit_is_clamped(client, headers, patient):
+    assert len(client.get('/api/patients?limit=0', headers=headers).get_json()['items']) == 1
@@ -0,0 +1,35 @@
+from patient_context import MAX_FIELD_CHARS, render_context
+
+def test_fields_render_in_a_fixed_order():
+    patient = {
+        'otherVitals': 'SpO2 98%', 'heartRate': '72', 'bloodPressure': '120/80',
+        'conditions': ['Asthma', ' ', 'Hypertension'], 'insuranceProvider': 'Acme',
+        'age': 36, 'dob': '1990-01-01', 'name': ' Ada '
+    }
+    assert render_context(patient) == '\n'.join([
+        'Patient Name: Ada', 'DOB: 1990-01-01', 'Age: 36', 'Insurance: Acme',
+        'Conditions: Asthma, Hypertension', 'BP: 120/80', 'HR: 72', 'Other Vitals: SpO2 98%'
+    ])
+
+def test_empty_fields_are_skipped():
+    assert render_context({'name': 'Ada', 'dob': '', 'age': None, 'conditions': [], 'doctors': []}) == 'Patient Name: Ada'
+    assert render_context({}) == ''
+
+def test_medications_list_wins_over_the_legacy_string():
+    meds = [{'name': 'Albuterol', 'dosage': '90mcg', 'frequency': 'PRN'}, {'name': 'Lisinopril'}, 'not a dict', {}]
+    assert render_context({'medicationsList': meds, 'medications': 'old note'}) == 'Meds: Albuterol 90mcg PRN; Lisinopril'
+    assert render_context({'medicationsList': [], 'medications': 'old note'}) == 'Meds: old note'
+
+def test_doctors_and_legacy_string_conditions():
+    doctors = [{'name': 'Dr. Lee', 'type': 'Cardiology'}, {'name': 'Dr. Kim'}, {'type': 'GP'}, {}]
+    assert render_context({'doctors': doctors, 'conditions': ' Asthma '}) == 'Conditions: Asthma\nDoctors: Dr. Lee (Cardiology); Dr. Kim; GP'
+
+def test_long_values_are_truncated_deterministically():
+    text = render_context({'name': 'Ada', 'otherVitals': 'x' * (MAX_FIELD_CHARS + 100)})
+    assert text == 'Patient Name: Ada\nOther Vitals: ' + 'x' * MAX_FIELD_CHARS + '…'
+    assert render_context({'otherVitals': 'x' * MAX_FIELD_CHARS}) == 'Other Vitals: ' + 'x' * MAX_FIELD_CHARS
+
+def test_context_follows_patch(app_module, client, headers, patient):
+    assert app_module.get_patient_context(patient) == 'Patient Name: Ada'
+    client.patch(f'/api/patients/{patient}', json={'conditions': ['Asthma']}, headers=headers)
+    assert app_module.get_patient_context(patient) == 'Patient Name: Ada\nConditions: Asthma'
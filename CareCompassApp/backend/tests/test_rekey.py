@@ -0,0 +1,22 @@
+from cryptography.fernet import Fernet
+
+import fake_firestore
+from envelope import DataKeyStore
+from rekey import ReKeyWorker
+from utils import CryptoManager
+
+def test_fields_are_moved_onto_the_data_key():
+    db = fake_firestore.FakeFirestore()
+    crypto = CryptoManager(Fernet.generate_key())
+    # Written with Fernet, before envelope encryption was turned on; one
+    # imported field name contains a dot
+    db.collection('patients').document('p1').set(dict(crypto.encrypt_dict({'name': 'Ada', 'blood.type': 'O+'}), id='p1'))
+    crypto.data_keys = DataKeyStore(lambda: db, crypto.derive_key('data-key-wrap'))
+    crypto.envelope = True
+    worker = ReKeyWorker(db, crypto, docs_per_second=0)
+    worker.run()
+    raw = db.collection('patients').document('p1').get().to_dict()
+    assert sorted(raw) == ['blood.type', 'id', 'name']
+    assert raw['name'].startswith('g2:p1.v1:') and raw['blood.type'].startswith('g2:p1.v1:')
+    assert crypto.decrypt_dict(raw, patient_id='p1') == {'id': 'p1', 'name': 'Ada', 'blood.type': 'O+'}
+    assert worker.stats()['migrated'] == 1
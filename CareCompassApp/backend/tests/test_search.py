@@ -0,0 +1,92 @@
+import io
+
+import pytest
+from cryptography.fernet import Fernet
+
+from search_index import BlindIndex, MemorySearchIndex, terms
+from utils import CryptoManager
+
+@pytest.fixture
+def blind():
+    return BlindIndex(CryptoManager(Fernet.generate_key()))
+
+def test_terms_are_normalized():
+    assert terms('Café AND the Inhaler, inhaler! x') == {'cafe', 'inhaler'}
+
+def test_tokens_are_scoped_to_the_patient(blind):
+    assert blind.query('p1', 'inhaler') == blind.query('p1', 'INHALER')
+    assert blind.query('p1', 'inhaler') != blind.query('p2', 'inhaler')
+
+class Docs:
+    # load() for MemorySearchIndex over a dict of patient -> {(kind, id): text}
+    def __init__(self):
+        self.docs = {}
+        self.loads = 0
+
+    def __call__(self, patient_id):
+        self.loads += 1
+        return [(kind, ref_id, text, None) for (kind, ref_id), text in self.docs.get(patient_id, {}).items()]
+
+def test_memory_index(blind):
+    docs = Docs()
+    docs.docs['p1'] = {('chat', 'c1'): 'inhaler dosage', ('chat', 'c2'): 'inhaler refill', ('file', 'f1'): 'dosage_chart.pdf'}
+    index = MemorySearchIndex(blind, docs)
+    # Every term has to match
+    assert sorted(index.search('p1', blind.query('p1', 'inhaler'))) == [('chat', 'c1'), ('chat', 'c2')]
+    assert index.search('p1', blind.query('p1', 'inhaler dosage')) == [('chat', 'c1')]
+    # Another patient's tokens match nothing
+    assert index.search('p1', blind.query('p2', 'inhaler')) == []
+
+    index.add('p1', 'chat', 'c2', 'spacer', '2024-01-02', replace=False)
+    assert index.search('p1', blind.query('p1', 'inhaler spacer')) == [('chat', 'c2')]
+    index.add('p1', 'chat', 'c2', 'spacer', '2024-01-02')
+    assert index.search('p1', blind.query('p1', 'inhaler spacer')) == []
+
+    index.remove('p1', 'file', 'f1')
+    assert index.search('p1', blind.query('p1', 'dosage')) == [('chat', 'c1')]
+
+    docs.docs['p1'] = {('chat', 'c9'): 'nebulizer'}
+    index.reset('p1')
+    assert index.search('p1', blind.query('p1', 'nebulizer')) == [('chat', 'c9')]
+    assert index.search('p1', blind.query('p1', 'inhaler')) == []
+    assert docs.loads == 2
+
+def search(client, headers, q):
+    response = client.get('/api/patients/p1/search', query_string={'q': q}, headers=headers)
+    assert response.status_code == 200
+    return sorted((item['kind'], item['id']) for item in response.get_json()['items'])
+
+def say(client, headers, chat_id, text):
+    client.post(f'/api/patients/p1/chats/{chat_id}/messages', json={'messages': [{'id': 0, 'sender': 'user', 'text': text}]}, headers=headers)
+
+@pytest.fixture(params=['firestore', 'memory'])
+def mode(request, app_module, monkeypatch, tmp_path):
+    from blob_store import LocalBlobStore
+    if request.param == 'memory':
+        request.getfixturevalue('memory_app')
+    monkeypatch.setattr(app_module, 'blob_store', LocalBlobStore(str(tmp_path), b'k' * 32, url_for=lambda token: f'/api/blobs/{token}'))
+    return request.param
+
+def test_search_route(mode, app_module, client, headers, patient):
+    say(client, headers, 'c1', 'How often should I use the inhaler?')
+    say(client, headers, 'c2', 'Is the inhaler safe with my new medication?')
+    say(client, headers, 'c1', 'And what about a spacer?')
+    upload = client.post('/api/patients/p1/files', data={'file': (io.BytesIO(b'%PDF'), 'inhaler_guide.pdf')}, headers=headers, content_type='multipart/form-data')
+    file_id = upload.get_json()['file']['id']
+
+    assert search(client, headers, 'inhaler') == [('chat', 'c1'), ('chat', 'c2'), ('file', file_id)]
+    # Appended messages add terms; earlier ones are still found
+    assert search(client, headers, 'inhaler spacer') == [('chat', 'c1')]
+    assert search(client, headers, 'medication') == [('chat', 'c2')]
+
+    client.delete(f'/api/patients/p1/files/{file_id}', headers=headers)
+    assert search(client, headers, 'guide') == []
+
+    client.post('/api/patients/import', json={'patient': {'id': 'p1', 'name': 'Ada'}, 'chats': [
+        {'id': 'c3', 'createdAt': '2024-01-01T00:00:00Z', 'messages': [{'id': 0, 'sender': 'user', 'text': 'nebulizer settings'}]}
+    ]}, headers=headers)
+    assert search(client, headers, 'nebulizer') == [('chat', 'c3')]
+    assert (app_module.db is None) == (mode == 'memory')
+
+def test_search_needs_a_term(client, headers, patient):
+    assert client.get('/api/patients/p1/search?q=the', headers=headers).status_code == 400
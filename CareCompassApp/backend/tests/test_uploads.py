@@ -0,0 +1,78 @@
+import io
+
+import pytest
+
+class CountingStream(io.BytesIO):
+    # Request body that records how much of it the server read
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+@pytest.fixture
+def patient(patient, app_module, monkeypatch, tmp_path):
+    from blob_store import LocalBlobStore
+    monkeypatch.setattr(app_module, 'MAX_UPLOAD_BYTES', 1024)
+    monkeypatch.setattr(app_module, 'blob_store', LocalBlobStore(str(tmp_path), b'k' * 32, url_for=lambda token: f'/api/blobs/{token}'))
+    return patient
+
+def test_upload_within_limit(client, headers, patient):
+    response = client.post(f'/api/patients/{patient}/files', data={'file': (io.BytesIO(b'x' * 1000), 'scan.pdf')}, headers=headers, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.get_json()['file']['size'] == 1000
+
+def test_oversized_upload_rejected_before_the_body_is_read(client, headers, app_module, patient):
+    body = CountingStream(b'x' * (app_module.MAX_UPLOAD_BYTES + app_module.MULTIPART_OVERHEAD + 1))
+    response = client.post(f'/api/patients/{patient}/files', input_stream=body, content_type='multipart/form-data; boundary=b',
+                           headers=dict(headers, **{'Content-Length': str(len(body.getvalue()))}))
+    assert response.status_code == 413
+    assert body.bytes_read == 0
+
+def test_oversized_file_within_overhead_rejected_while_streaming(client, headers, patient):
+    response = client.post(f'/api/patients/{patient}/files', data={'file': (io.BytesIO(b'x' * 2000), 'scan.pdf')}, headers=headers, content_type='multipart/form-data')
+    assert response.status_code == 413
+
+@pytest.mark.parametrize('size', ['100', 1.5, -1, True])
+def test_session_size_must_be_an_integer(client, headers, patient, size):
+    response = client.post(f'/api/patients/{patient}/uploads', json={'name': 'scan.pdf', 'size': size}, headers=headers)
+    assert response.status_code == 400
+
+def test_session_over_limit(client, headers, patient):
+    response = client.post(f'/api/patients/{patient}/uploads', json={'name': 'scan.pdf', 'size': 4096}, headers=headers)
+    assert response.status_code == 413
+
+def test_bad_chunk_offset(client, headers, patient):
+    upload = client.post(f'/api/patients/{patient}/uploads', json={'name': 'scan.pdf', 'size': 10}, headers=headers).get_json()
+    response = client.put(f"/api/patients/{patient}/uploads/{upload['uploadId']}?offset=abc", data=b'x' * 10, headers=headers)
+    assert response.status_code == 400
+
+def test_chunked_upload_resumes(client, headers, patient):
+    upload_id = client.post(f'/api/patients/{patient}/uploads', json={'name': 'scan.pdf', 'size': 10}, headers=headers).get_json()['uploadId']
+    url = f'/api/patients/{patient}/uploads/{upload_id}'
+    assert client.put(f'{url}?offset=0', data=b'x' * 6, headers=headers).get_json()['received'] == 6
+    assert client.put(f'{url}?offset=0', data=b'x' * 6, headers=headers).status_code == 409
+    assert client.get(url, headers=headers).get_json()['received'] == 6
+    client.put(f'{url}?offset=6', data=b'x' * 4, headers=headers)
+    response = client.post(f'{url}/complete', headers=headers)
+    assert response.status_code == 200 and response.get_json()['file']['size'] == 10
+
+def test_chunk_past_declared_size(client, headers, patient):
+    upload_id = client.post(f'/api/patients/{patient}/uploads', json={'name': 'scan.pdf', 'size': 10}, headers=headers).get_json()['uploadId']
+    response = client.put(f'/api/patients/{patient}/uploads/{upload_id}?offset=0', data=b'x' * 11, headers=headers)
+    assert response.status_code == 413
+
+def upload_scan(client, headers, patient):
+    return client.post(f'/api/patients/{patient}/files', data={'file': (io.BytesIO(b'x' * 100), 'scan.pdf')}, headers=headers, content_type='multipart/form-data').get_json()
+
+def test_content_key_stays_on_the_server(client, headers, patient):
+    first, duplicate = upload_scan(client, headers, patient), upload_scan(client, headers, patient)
+    assert duplicate['duplicate'] and duplicate['file']['id'] == first['file']['id']
+    files = client.get(f'/api/patients/{patient}/files', headers=headers).get_json()
+    found = client.get(f'/api/patients/{patient}/search?q=scan', headers=headers).get_json()['items']
+    assert len(files) == len(found) == 1
+    for file_data in [first['file'], duplicate['file']] + files + found:
+        assert 'contentKey' not in file_data
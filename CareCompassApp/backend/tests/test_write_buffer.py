@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+
+from write_buffer import WriteBuffer
+
+class Store:
+    # write_fn that records writes and can be told to fail the next N of them
+    def __init__(self):
+        self.writes = []
+        self.fail = 0
+        self.written = threading.Event()
+
+    def __call__(self, key, fields):
+        if self.fail:
+            self.fail -= 1
+            raise TimeoutError('Deadline exceeded')
+        self.writes.append((key, dict(fields)))
+        self.written.set()
+
+def test_burst_is_coalesced_into_one_write():
+    store = Store()
+    buffer = WriteBuffer(store, delay=60, max_delay=60)
+    for weight in ('170 lb', '171 lb', '172 lb'):
+        buffer.write('p1', {'weight': weight})
+    buffer.write('p1', {'height': '5 ft 9'})
+    assert buffer.flush('p1')
+    assert store.writes == [('p1', {'weight': '172 lb', 'height': '5 ft 9'})]
+    assert not buffer.flush('p1')
+
+def test_failed_flush_raises_and_keeps_the_fields():
+    store = Store()
+    buffer = WriteBuffer(store, delay=60, max_delay=60, retry_delay=60)
+    buffer.write('p1', {'weight': '172 lb'})
+    store.fail = 1
+    with pytest.raises(TimeoutError):
+        buffer.flush('p1')
+    assert buffer.stats()['pending'] == 1
+    assert buffer.flush('p1')
+    assert store.writes == [('p1', {'weight': '172 lb'})]
+
+def test_retried_fields_merge_under_newer_ones():
+    store = Store()
+    buffer = WriteBuffer(store, delay=60, max_delay=60, retry_delay=60)
+    buffer.write('p1', {'weight': '172 lb', 'height': '5 ft 9'})
+    store.fail = 1
+    with pytest.raises(TimeoutError):
+        buffer.flush('p1')
+    buffer.write('p1', {'weight': '173 lb'})
+    buffer.flush('p1')
+    assert store.writes == [('p1', {'weight': '173 lb', 'height': '5 ft 9'})]
+
+def test_background_write_is_retried():
+    store = Store()
+    buffer = WriteBuffer(store, delay=0.01, max_delay=0.01, retry_delay=0.01)
+    store.fail = 2
+    buffer.write('p1', {'weight': '172 lb'})
+    assert store.written.wait(5)
+    assert store.writes == [('p1', {'weight': '172 lb'})]
+    stats = buffer.stats()
+    assert stats['failures'] == 2 and stats['writes'] == 1 and stats['pending'] == 0
+
+def test_gives_up_after_max_attempts():
+    store = Store()
+    buffer = WriteBuffer(store, delay=60, max_delay=60, max_attempts=2, retry_delay=60)
+    buffer.write('p1', {'weight': '172 lb'})
+    store.fail = 2
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            buffer.flush('p1')
+    assert buffer.stats()['pending'] == 0 and buffer.stats()['dropped'] == 1
+
+def test_flush_group_tries_every_key_then_raises():
+    store = Store()
+    buffer = WriteBuffer(store, delay=60, max_delay=60, retry_delay=60)
+    buffer.write('p1', {'weight': '172 lb'}, group='u1')
+    buffer.write('p2', {'weight': '140 lb'}, group='u1')
+    store.fail = 1
+    with pytest.raises(TimeoutError):
+        buffer.flush_group('u1')
+    assert len(store.writes) == 1 and buffer.stats()['pending'] == 1
+
+@pytest.fixture
+def buffered(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.patient_writes, 'delay', 60)
+    monkeypatch.setattr(app_module.patient_writes, 'max_delay', 60)
+    monkeypatch.setattr(app_module.patient_writes, 'retry_delay', 60)
+    return app_module.patient_writes
+
+def test_patch_writes_through_by_default(app_module, client, headers):
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada', 'weight': '170 lb'}, headers=headers)
+    response = client.patch('/api/patients/p1', json={'weight': '172 lb'}, headers=headers)
+    assert response.status_code == 200
+    stored = app_module.db.collection('patients').document('p1').get().to_dict()
+    assert app_module.crypto.decrypt_field('weight', stored['weight']) == '172 lb'
+
+def test_buffered_patch_is_seen_by_reads(client, headers, buffered):
+    writes = buffered.stats()['writes']
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada', 'weight': '170 lb'}, headers=headers)
+    assert client.patch('/api/patients/p1', json={'weight': '172 lb'}, headers=headers).status_code == 202
+    assert client.patch('/api/patients/p1', json={'height': '5 ft 9'}, headers=headers).status_code == 202
+    patients = client.get('/api/patients', headers=headers).get_json()
+    assert patients[0]['weight'] == '172 lb' and patients[0]['height'] == '5 ft 9' and patients[0]['name'] == 'Ada'
+    assert buffered.stats()['writes'] == writes + 1
+
+def test_failed_buffered_patch_fails_the_read_and_is_kept(app_module, client, headers, buffered, monkeypatch):
+    client.post('/api/patients', json={'id': 'p1', 'name': 'Ada'}, headers=headers)
+    client.patch('/api/patients/p1', json={'weight': '172 lb'}, headers=headers)
+    failing = Store()
+    failing.fail = 1
+    write_fn = buffered.write_fn
+    monkeypatch.setattr(buffered, 'write_fn', failing)
+    assert client.get('/api/patients/p1/export', headers=headers).status_code == 500
+    monkeypatch.setattr(buffered, 'write_fn', write_fn)
+    export = client.get('/api/patients/p1/export', headers=headers).get_json()
+    assert export['patient']['weight'] == '172 lb'
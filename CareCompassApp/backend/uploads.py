@@ -0,0 +1,117 @@
+import hashlib
+import tempfile
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 1024 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadOffsetMismatch(Exception):
+    def __init__(self, expected):
+        super().__init__(f"Expected chunk at offset {expected}")
+        self.expected = expected
+
+def stream_to_tempfile(stream, max_bytes, chunk_size=CHUNK_SIZE):
+    # Copies an upload stream to a temp file in fixed-size chunks, computing size
+    # and SHA-256 on the way. Raises UploadTooLarge as soon as max_bytes is passed.
+    tmp = tempfile.TemporaryFile()
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File exceeds the {max_bytes} byte limit")
+            hasher.update(chunk)
+            tmp.write(chunk)
+    except Exception:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return tmp, size, hasher.hexdigest()
+
+class UploadSession:
+    def __init__(self, patient_id, user_id, name, content_type, total_size=None):
+        self.id = uuid.uuid4().hex
+        self.patient_id = patient_id
+        self.user_id = user_id
+        self.name = name
+        self.content_type = content_type
+        self.total_size = total_size
+        self.received = 0
+        self.updated_at = time.time()
+        self.file = tempfile.TemporaryFile()
+        self._hasher = hashlib.sha256()
+        self.lock = threading.Lock()
+
+    def append(self, offset, stream, max_bytes, chunk_size=CHUNK_SIZE):
+        # Chunks must arrive in order. A client that lost its connection asks for
+        # 'received' and resends from there.
+        with self.lock:
+            if offset != self.received:
+                raise UploadOffsetMismatch(self.received)
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if self.received + len(chunk) > max_bytes:
+                    raise UploadTooLarge(f"File exceeds the {max_bytes} byte limit")
+                self._hasher.update(chunk)
+                self.file.write(chunk)
+                self.received += len(chunk)
+            self.updated_at = time.time()
+            return self.received
+
+    def finish(self):
+        # Returns (file, size, sha256) positioned at the start of the data
+        self.file.seek(0)
+        return self.file, self.received, self._hasher.hexdigest()
+
+    def close(self):
+        self.file.close()
+
+    def to_dict(self):
+        return {
+            "uploadId": self.id,
+            "name": self.name,
+            "type": self.content_type,
+            "received": self.received,
+            "totalSize": self.total_size
+        }
+
+class UploadManager:
+    # In-process registry of chunked upload sessions. Sessions idle for longer than
+    # 'ttl' seconds are dropped along with their temp files.
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, patient_id, user_id, name, content_type, total_size=None):
+        session = UploadSession(patient_id, user_id, name, content_type, total_size)
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, upload_id):
+        with self._lock:
+            self._expire()
+            return self._sessions.get(upload_id)
+
+    def discard(self, upload_id):
+        with self._lock:
+            session = self._sessions.pop(upload_id, None)
+        if session:
+            session.close()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for upload_id in [k for k, s in self._sessions.items() if s.updated_at < cutoff]:
+            self._sessions.pop(upload_id).close()
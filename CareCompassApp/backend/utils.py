@@ -1,13 +1,24 @@
 import yaml
 import os
+import json
+import time
+import hashlib
+import hmac
+import logging
+import threading
+import zlib
+from collections import OrderedDict
 from cryptography.fernet import Fernet
+from envelope import ENVELOPE_TAG, DataKeyStore, seal, parse, open_sealed
+
+log = logging.getLogger(__name__)
 
 def load_config(path):
     try:
         with open(path, 'r') as f:
             return yaml.safe_load(f) or {}
     except FileNotFoundError:
-        print(f"WARNING: Config file not found at {path}")
+        log.warning(f"Config file not found at {path}")
         return {}
 
 class ConfigManager:
@@ -21,62 +32,267 @@ class ConfigManager:
         env_key = key.upper()
         env_val = os.environ.get(env_key)
         if env_val:
-            print(f"DEBUG: Loaded secret '{key}' from Environment Variable '{env_key}'")
+            log.debug(f"Loaded secret '{key}' from Environment Variable '{env_key}'")
             return env_val
         
         file_val = self.secrets.get(key)
         if file_val:
-            print(f"DEBUG: Loaded secret '{key}' from secrets.yaml")
+            log.debug(f"Loaded secret '{key}' from secrets.yaml")
             return file_val
             
-        print(f"WARNING: Secret '{key}' not found in Environment or secrets.yaml")
+        log.info(f"Secret '{key}' not found in Environment or secrets.yaml")
         return None
 
     def get_setting(self, key):
         return self.settings.get(key)
 
+# First characters json.loads can accept (objects, arrays, strings, numbers,
+# true/false/null, NaN/Infinity, leading whitespace)
+JSON_START = frozenset('{["-0123456789tfnNI \t\r\n')
+
+class DecryptionError(Exception):
+    # A tagged (envelope or compressed) value that should decrypt but doesn't:
+    # unknown or unreachable data key, tampering, or a value moved from another
+    # field or patient. Never swallowed, so callers don't mistake ciphertext for
+    # plain text and write it back encrypted a second time.
+    pass
+
 class CryptoManager:
-    def __init__(self, key):
+    # Don't encrypt IDs, userId, timestamps or counters needed for sorting/querying
+    PLAIN_FIELDS = ['id', 'createdAt', 'lastUpdate', 'updatedAt', 'userId', 'seq', 'messageCount', 'contentKey']
+    # Prefix of a value that was zlib-compressed before encryption. A Fernet token
+    # never starts with it, so plain and compressed values can be mixed freely.
+    COMPRESSED_TAG = 'z1:'
+
+    def __init__(self, key, compress_min_bytes=None, compress_level=1, data_keys=None, envelope=False):
+        self.key = key
         self.fernet = Fernet(key)
+        # Opt-in: values of at least this many bytes (JSON-dumped lists and dicts
+        # like chat messages, long strings) are compressed. decrypt() reads both
+        # forms regardless, but older code can only read uncompressed values.
+        self.compress_min_bytes = compress_min_bytes or None
+        self.compress_level = compress_level
+        # envelope.DataKeyStore, used to open AES-GCM values. With 'envelope' on,
+        # new values encrypted for a patient are sealed under that patient's data
+        # key; everything else is Fernet under the master key. Turning it off
+        # again only affects new writes.
+        self.data_keys = data_keys
+        self.envelope = envelope and data_keys is not None
+        self._index_key = self.derive_key('blind-index')
 
-    def encrypt(self, data):
+    def derive_key(self, purpose):
+        # 32-byte sub-key for a single purpose (blind indexes, cache encryption, ...)
+        # so the master key itself is only ever used for Fernet
+        key_bytes = self.key.encode() if isinstance(self.key, str) else self.key
+        return hashlib.sha256(f'carecompass-{purpose}:'.encode() + key_bytes).digest()
+
+    def blind_index(self, value):
+        # Keyed HMAC so equal values can be matched in queries without storing
+        # them (or a plain hash of them) in clear text
+        return hmac.new(self._index_key, value.encode(), hashlib.sha256).hexdigest()
+
+    def encrypt(self, data, patient_id=None, field=None):
+        # 'field' is authenticated with envelope values; decrypt with the same name
         if isinstance(data, str):
-            return self.fernet.encrypt(data.encode()).decode()
+            raw = data.encode()
+            compress = self.compress_min_bytes is not None and len(raw) >= self.compress_min_bytes
+            if compress:
+                raw = zlib.compress(raw, self.compress_level)
+            data_key = self.data_keys.current(patient_id) if self.envelope and patient_id else None
+            if data_key is not None:
+                return seal(*data_key, 1 if compress else 0, raw, field)
+            if compress:
+                return self.COMPRESSED_TAG + self.fernet.encrypt(raw).decode()
+            return self.fernet.encrypt(raw).decode()
         return data
 
-    def decrypt(self, data):
-        if isinstance(data, str):
+    def decrypt(self, data, field=None, patient_id=None):
+        # Untagged values that aren't Fernet tokens are returned as they are
+        # (data written before encryption). Envelope and compressed values raise
+        # DecryptionError instead. With 'patient_id', an envelope value sealed
+        # for a different patient is rejected as well.
+        if not isinstance(data, str):
+            return data
+        plain = self._decrypt_bytes(data, field, patient_id)
+        return data if plain is None else plain.decode()
+
+    def _decrypt_bytes(self, data, field, patient_id):
+        # Plain bytes of an encrypted string, or None if it isn't encrypted
+        if data.startswith(ENVELOPE_TAG):
             try:
-                return self.fernet.decrypt(data.encode()).decode()
-            except:
-                return data # Return original if not encrypted or fails
-        return data
+                key_id, body = parse(data)
+                if patient_id is not None and DataKeyStore.split_key_id(key_id)[0] != patient_id:
+                    raise DecryptionError(f"{field or 'Value'} is sealed for another patient")
+                compressed, payload = open_sealed(key_id, self.data_keys.get(key_id), body, field)
+                return zlib.decompress(payload) if compressed else payload
+            except DecryptionError:
+                raise
+            except Exception as e:
+                raise DecryptionError(f"Cannot decrypt {field or 'value'}: {e!r}") from e
+        if data.startswith(self.COMPRESSED_TAG):
+            try:
+                return zlib.decompress(self.fernet.decrypt(data[len(self.COMPRESSED_TAG):]))
+            except Exception as e:
+                raise DecryptionError(f"Cannot decrypt {field or 'value'}: {e!r}") from e
+        try:
+            return self.fernet.decrypt(data)
+        except Exception:
+            return None # Not encrypted
 
-    def encrypt_dict(self, data_dict):
+    def encrypt_dict(self, data_dict, patient_id=None):
         encrypted = {}
         for k, v in data_dict.items():
-            if k in ['id', 'createdAt', 'lastUpdate', 'userId']: # Don't encrypt ID, userId or timestamps needed for sorting/querying
+            if k in self.PLAIN_FIELDS:
                 encrypted[k] = v
             elif isinstance(v, (dict, list)):
                  # Simple recursive encryption could be added here, 
                  # but for now let's just encrypt top level strings or JSON dump
-                 import json
-                 encrypted[k] = self.encrypt(json.dumps(v))
+                 encrypted[k] = self.encrypt(json.dumps(v), patient_id, k)
             else:
-                encrypted[k] = self.encrypt(str(v))
+                encrypted[k] = self.encrypt(str(v), patient_id, k)
         return encrypted
 
-    def decrypt_dict(self, data_dict):
+    def reencrypt_dict(self, data_dict, patient_id):
+        # Encrypted fields that aren't sealed under the patient's current data key
+        # (Fernet, or an older key version), re-encrypted under it. Untagged values
+        # that aren't Fernet tokens are left alone; a tagged value that doesn't
+        # decrypt raises DecryptionError.
+        data_key = self.data_keys.current(patient_id) if self.envelope else None
+        if data_key is None:
+            return {}
+        current = f"{ENVELOPE_TAG}{data_key[0]}:"
+        changes = {}
+        for k, v in data_dict.items():
+            if k in self.PLAIN_FIELDS or not isinstance(v, str) or v.startswith(current):
+                continue
+            plain = self.decrypt(v, k, patient_id)
+            if plain is not v:
+                changes[k] = self.encrypt(plain, patient_id, k)
+        return changes
+
+    def decrypt_field(self, key, value, patient_id=None):
+        if key in self.PLAIN_FIELDS or not isinstance(value, str):
+            return value
+        plain = self._decrypt_bytes(value, key, patient_id)
+        if plain is None:
+            plain = value
+        # Lists, dicts and numbers were JSON-dumped by encrypt_dict. json.loads
+        # reads the decrypted bytes directly; plain text that can't be JSON skips
+        # the parse (and the exception) altogether.
+        first = plain[:1].decode('latin-1') if isinstance(plain, bytes) else plain[:1]
+        if first and first in JSON_START:
+            try:
+                return json.loads(plain)
+            except ValueError:
+                pass
+        return plain.decode() if isinstance(plain, bytes) else plain
+
+    def decrypt_dict(self, data_dict, fields=None, patient_id=None):
+        # 'fields' projects the result: only those keys are decrypted and returned,
+        # everything else is skipped without touching Fernet or json.
         decrypted = {}
         for k, v in data_dict.items():
-            if k in ['id', 'createdAt', 'lastUpdate', 'userId']:
-                decrypted[k] = v
-            else:
-                val = self.decrypt(v)
-                # Try to parse back to json if possible
-                import json
-                try:
-                    decrypted[k] = json.loads(val)
-                except:
-                    decrypted[k] = val
+            if fields is not None and k not in fields:
+                continue
+            decrypted[k] = self.decrypt_field(k, v, patient_id)
         return decrypted
+
+    def encrypt_many(self, docs, workers=1, use_processes=False, patient_id=None):
+        return self._map_many('encrypt_dict', docs, workers, use_processes, patient_id=patient_id)
+
+    def decrypt_many(self, docs, workers=1, use_processes=False, patient_id=None):
+        return self._map_many('decrypt_dict', docs, workers, use_processes, patient_id=patient_id)
+
+    def _map_many(self, method, docs, workers, use_processes, **kwargs):
+        # Bulk path for import/export: one pass over the documents, optionally spread
+        # over a pool. Work is handed out in chunks so pool overhead stays small
+        # relative to the Fernet work. Results keep the input order.
+        docs = list(docs)
+        if workers <= 1 or len(docs) < 2:
+            fn = getattr(self, method)
+            return [fn(d, **kwargs) for d in docs]
+
+        chunk_size = max(1, -(-len(docs) // (workers * 4)))
+        chunks = [docs[i:i + chunk_size] for i in range(0, len(docs), chunk_size)]
+        if use_processes and self.data_keys is None:
+            # Each worker process builds its own CryptoManager from the key once.
+            # Data keys live in this process, so with them threads are used instead.
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker_crypto, initargs=(self.key, self.compress_min_bytes, self.compress_level)) as pool:
+                results = pool.map(_worker_map_chunk, [method] * len(chunks), chunks)
+                return [doc for chunk in results for doc in chunk]
+
+        from concurrent.futures import ThreadPoolExecutor
+        fn = getattr(self, method)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(lambda chunk: [fn(d, **kwargs) for d in chunk], chunks)
+            return [doc for chunk in results for doc in chunk]
+
+_worker_crypto = None
+
+def _init_worker_crypto(key, compress_min_bytes, compress_level):
+    global _worker_crypto
+    _worker_crypto = CryptoManager(key, compress_min_bytes, compress_level)
+
+def _worker_map_chunk(method, chunk):
+    fn = getattr(_worker_crypto, method)
+    return [fn(d) for d in chunk]
+
+class TTLCache:
+    # Small thread-safe LRU cache whose entries expire after a fixed TTL (seconds),
+    # or earlier when put() is given an expires_at (in the clock's units).
+    def __init__(self, max_size=1024, ttl=300, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, expires_at=None):
+        with self._lock:
+            ttl_expiry = self.clock() + self.ttl
+            self._entries[key] = (value, min(expires_at, ttl_expiry) if expires_at is not None else ttl_expiry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            now = self.clock()
+            return [k for k, (_, expires_at) in self._entries.items() if expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
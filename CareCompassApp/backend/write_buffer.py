@@ -0,0 +1,156 @@
+import heapq
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+class WriteBuffer:
+    # Write-behind buffer for partial document updates. write(key, fields) merges
+    # the fields into the key's pending update and returns at once. A background
+    # thread hands the merged fields to write_fn(key, fields) once the key has
+    # had no new update for 'delay' seconds, or 'max_delay' seconds after its
+    # first pending update, so a burst of edits becomes one write.
+    #
+    # flush(key) / flush_group(group) write pending updates immediately. Callers
+    # use them before reading or overwriting a document, so nothing reads around
+    # a pending write. Writes to one key never overlap or reorder: the fields
+    # are taken from the buffer and written under a per-key lock.
+    #
+    # A failed write isn't dropped: its fields go back in the buffer, under any
+    # newer fields for the key, and are retried with exponential backoff up to
+    # max_attempts times. flush() raises the error so a reader doesn't go on as
+    # if the write had landed.
+    def __init__(self, write_fn, delay=0.5, max_delay=2.0, lock_stripes=64, max_attempts=5, retry_delay=1.0, max_retry_delay=60.0):
+        self.write_fn = write_fn
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._pending = {}       # key -> {'fields', 'group', 'first', 'last', 'attempts', 'retry_at'}
+        self._due = []           # heap of (due time, key); stale entries are skipped
+        self._cond = threading.Condition()
+        self._key_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._stop = False
+        self._thread = None
+        self.updates = 0
+        self.writes = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def write(self, key, fields, group=None):
+        now = time.monotonic()
+        with self._cond:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {'fields': {}, 'group': group, 'first': now, 'attempts': 0, 'retry_at': 0}
+            entry['fields'].update(fields)
+            entry['last'] = now
+            self.updates += 1
+            heapq.heappush(self._due, (self._due_time(entry), key))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-buffer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _due_time(self, entry):
+        return max(entry['retry_at'], min(entry['last'] + self.delay, entry['first'] + self.max_delay))
+
+    def flush(self, key):
+        # Returns True if a pending update was written. If the write fails, the
+        # fields are put back for a retry and the error is raised.
+        with self._key_locks[hash(key) % len(self._key_locks)]:
+            with self._cond:
+                entry = self._pending.pop(key, None)
+            if entry is None:
+                return False
+            try:
+                self.write_fn(key, entry['fields'])
+            except Exception as e:
+                self.failures += 1
+                self._requeue(key, entry, e)
+                raise
+            self.writes += 1
+            return True
+
+    def _requeue(self, key, entry, error):
+        attempts = entry['attempts'] + 1
+        if attempts >= self.max_attempts:
+            self.dropped += 1
+            log.error(f"Buffered write for {key} failed {attempts} times, giving up: {error}")
+            return
+        log.warning(f"Buffered write for {key} failed (attempt {attempts}), will retry: {error}")
+        with self._cond:
+            newer = self._pending.get(key)
+            if newer is not None:
+                # Written while this attempt was in flight; those fields win
+                entry['fields'].update(newer['fields'])
+                entry['last'] = newer['last']
+            entry['attempts'] = attempts
+            entry['retry_at'] = time.monotonic() + min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            self._pending[key] = entry
+            heapq.heappush(self._due, (self._due_time(entry), key))
+            self._cond.notify()
+
+    def _flush_keys(self, keys):
+        # Tries every key, then raises the first error
+        error = None
+        for key in keys:
+            try:
+                self.flush(key)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def flush_group(self, group):
+        with self._cond:
+            keys = [key for key, entry in self._pending.items() if entry['group'] == group]
+        self._flush_keys(keys)
+
+    def flush_all(self):
+        with self._cond:
+            keys = list(self._pending)
+        self._flush_keys(keys)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    now = time.monotonic()
+                    # Drop heap entries superseded by a later update or a flush
+                    while self._due and (self._due[0][1] not in self._pending or self._due[0][0] < self._due_time(self._pending[self._due[0][1]])):
+                        heapq.heappop(self._due)
+                    if self._due and self._due[0][0] <= now:
+                        key = heapq.heappop(self._due)[1]
+                        break
+                    self._cond.wait(self._due[0][0] - now if self._due else None)
+                else:
+                    return
+            try:
+                self.flush(key)
+            except Exception:
+                pass  # Logged and queued for a retry by flush()
+
+    def close(self):
+        # Writes everything still pending; registered with atexit. That doesn't
+        # run on a hard kill, which is why buffering is off by default.
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        try:
+            self.flush_all()
+        except Exception as e:
+            log.error(f"Pending writes lost at shutdown: {e}")
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "updates": self.updates,
+            "writes": self.writes,
+            "failures": self.failures,
+            "dropped": self.dropped
+        }
@@ -11,7 +11,7 @@ import PatientFormModal from './components/PatientFormModal';
 import DebugInfoModal from './components/DebugInfoModal';
 import Login from './components/Login';
 import InitialSetupForm from './components/InitialSetupForm';
-import { callChatAPI, getPatients, savePatient, getPatientChats, savePatientChat } from './api';
+import { callChatAPI, getPatients, savePatient, patchPatient, getPatientChats, appendChatMessages } from './api';
 import { Loader2 } from 'lucide-react';
 import { auth } from './firebase';
 import { onAuthStateChanged } from 'firebase/auth';
@@ -109,8 +109,8 @@ export default function App() {
       p.id === currentPatientId ? updatedPatient : p
     ));
 
-    // Save to backend
-    await savePatient(updatedPatient);
+    // Save only the changed fields to backend
+    await patchPatient(activePatient.id, updates);
   };
 
   const handleInitialSetupSave = async (data) => {
@@ -276,8 +276,8 @@ export default function App() {
       setChats(prev => prev.map(c => c.id === updatedChat.id ? updatedChat : c));
     }
 
-    // Save user message immediately to backend so it persists
-    await savePatientChat(currentPatientId, updatedChat);
+    // Save user message immediately to backend so it persists (append-only)
+    await appendChatMessages(currentPatientId, updatedChat.id, [userMsg], { createdAt: updatedChat.createdAt });
 
     setInput('');
     setAttachedFile(null);
@@ -317,7 +317,8 @@ export default function App() {
           }
           return c;
         }));
-      }
+      },
+      updatedChat.id
     );
 
     if (aiResponseText === null) {
@@ -334,7 +335,7 @@ export default function App() {
     const finalChatSaved = { ...updatedChat, messages: finalMessages };
 
     setChats(prev => prev.map(c => c.id === updatedChat.id ? finalChatSaved : c));
-    await savePatientChat(currentPatientId, finalChatSaved);
+    await appendChatMessages(currentPatientId, updatedChat.id, [finalAiMsg]);
 
     setIsLoading(false);
     setAbortController(null);
@@ -364,7 +365,7 @@ export default function App() {
     setChats(prev => [newChat, ...prev]);
 
     // Save immediately
-    await savePatientChat(currentPatientId, newChat);
+    await appendChatMessages(currentPatientId, newChatId, [userMsg], { createdAt: newChat.createdAt });
 
     setIsLoading(true);
 
@@ -401,7 +402,8 @@ export default function App() {
           }
           return c;
         }));
-      }
+      },
+      newChatId
     );
 
     const finalAiMsg = { id: aiMsgId, sender: 'ai', text: aiResponseText };
@@ -410,7 +412,7 @@ export default function App() {
 
     setChats(prev => prev.map(c => c.id === newChatId ? finalChat : c));
 
-    await savePatientChat(currentPatientId, finalChat);
+    await appendChatMessages(currentPatientId, newChatId, [finalAiMsg]);
 
     setIsLoading(false);
   };
@@ -14,13 +14,19 @@ const getAuthHeaders = async () => {
     return { 'Content-Type': 'application/json' };
 };
 
-export const callChatAPI = async (prompt, imageBase64, context, history, signal, mimeType = 'image/jpeg', fileId = null, patientId = null, onUpdate = null) => {
+export const callChatAPI = async (prompt, imageBase64, context, history, signal, mimeType = 'image/jpeg', fileId = null, patientId = null, onUpdate = null, chatId = null) => {
     try {
         const headers = await getAuthHeaders();
+        // With a chatId the backend loads (and trims) the history itself, and with
+        // a patientId it builds the patient context from the stored record
+        if (patientId) context = undefined;
+        const body = chatId && patientId
+            ? { prompt, image: imageBase64, mimeType, fileId, patientId, chatId }
+            : { prompt, image: imageBase64, mimeType, context, history, fileId, patientId };
         const response = await fetch(`${API_BASE_URL}/chat`, {
             method: 'POST',
             headers: headers,
-            body: JSON.stringify({ prompt, image: imageBase64, mimeType, context, history, fileId, patientId }),
+            body: JSON.stringify(body),
             signal: signal
         });
 
@@ -96,6 +102,29 @@ export const savePatient = async (patient) => {
     }
 };
 
+// Sends only the changed top-level fields; the backend may buffer the write (202)
+export const patchPatient = async (patientId, changes) => {
+    try {
+        console.log("API: patchPatient called for", patientId);
+        const headers = await getAuthHeaders();
+        const response = await fetch(`${API_BASE_URL}/patients/${patientId}`, {
+            method: 'PATCH',
+            headers: headers,
+            body: JSON.stringify(changes)
+        });
+        console.log("API: patchPatient response status:", response.status);
+        if (!response.ok) {
+            const text = await response.text();
+            console.error("API: Failed to update patient:", response.status, text);
+            throw new Error('Failed to update patient');
+        }
+        return await response.json();
+    } catch (error) {
+        console.error("API: patchPatient error:", error);
+        throw error;
+    }
+};
+
 export const getPatientChats = async (patientId) => {
     try {
         console.log("API: getPatientChats called for", patientId);
@@ -142,6 +171,27 @@ export const savePatientChat = async (patientId, chatData) => {
     }
 };
 
+export const appendChatMessages = async (patientId, chatId, messages, chatMeta = {}) => {
+    try {
+        console.log("API: appendChatMessages called for", patientId, chatId);
+        const headers = await getAuthHeaders();
+        const response = await fetch(`${API_BASE_URL}/patients/${patientId}/chats/${chatId}/messages`, {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({ ...chatMeta, messages })
+        });
+        if (!response.ok) {
+            const text = await response.text();
+            console.error("API: Failed to append chat messages:", response.status, text);
+            throw new Error('Failed to append chat messages');
+        }
+        return await response.json();
+    } catch (error) {
+        console.error("API: appendChatMessages error:", error);
+        throw error;
+    }
+};
+
 export const exportPatient = async (patientId) => {
     try {
         const headers = await getAuthHeaders();